@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module engine asyncio cho bot Telegram: nhận, dựng phản hồi và gửi chạy song song
+
+Ba giai đoạn nối với nhau bằng hàng đợi có giới hạn:
+    poller (getUpdates long-polling) -> renderer (handler dựng phản hồi) -> sender (sendMessage)
+
+Mỗi sender có hàng đợi riêng và mỗi chat luôn đi vào cùng một sender, nên thứ tự
+phản hồi trong một chat được giữ nguyên trong khi các chat khác nhau được gửi đồng
+thời (tối đa `concurrency` lời gọi sendMessage cùng lúc). Offset chỉ được commit khi
+mọi update đứng trước đã xử lý xong.
+
+Dùng aiohttp nếu đã cài (tùy chọn), nếu không thì chạy TelegramClient trong thread pool.
+"""
+
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from telegram_client import TelegramAPIError
+from circuit_breaker import TRANSPORT_ERRORS, is_transport_error, retry_after
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+
+class Reply:
+    """Một tin nhắn cần gửi; `on_sent` (nếu có) được gọi sau khi Telegram xác nhận"""
+
+    __slots__ = ("update_id", "chat_id", "text", "on_sent", "on_failed")
+
+    def __init__(self, update_id, chat_id, text, on_sent=None, on_failed=None):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.text = text
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+
+
+# Thêm lỗi của asyncio/aiohttp vào danh sách lỗi đường truyền
+_TRANSPORT_ERRORS = TRANSPORT_ERRORS + (asyncio.TimeoutError,) + ((aiohttp.ClientError,) if aiohttp else ())
+
+
+def message_from_update(update):
+    """Chuyển update Telegram thành dict tin nhắn như các bot đang dùng; None nếu không phải tin nhắn text"""
+    message = update.get("message")
+    if not message or "text" not in message:
+        return None
+    sender = message.get("from", {})
+    return {
+        "platform": "telegram",
+        "update_id": update["update_id"],
+        "chat_id": message["chat"]["id"],
+        "user_id": sender.get("id"),
+        "sender": sender.get("username", sender.get("first_name", "Unknown")),
+        "content": message.get("text", ""),
+        "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
+        "date": message["date"],
+        "message_id": message["message_id"]
+    }
+
+
+async def send_limited(rate_limiter, chat_id, send, max_retries=3):
+    """Bản bất đồng bộ của TelegramClient.send_message: chờ lượt bằng asyncio.sleep,
+    gặp 429 thì chờ `retry_after` rồi gửi lại"""
+    if rate_limiter is None:
+        return await send()
+    attempt = 0
+    while True:
+        wait = rate_limiter.reserve(chat_id)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await send()
+        except TelegramAPIError as e:
+            if e.error_code != 429 or attempt >= max_retries:
+                raise
+            attempt += 1
+            rate_limiter.penalize(chat_id, e.retry_after or 1)
+
+
+class ThreadTransport:
+    """Gọi TelegramClient (đồng bộ) trong thread pool, không cần thư viện ngoài"""
+
+    def __init__(self, client, workers=16):
+        if client.pool_maxsize < workers:
+            logger.warning(f"pool_maxsize={client.pool_maxsize} nhỏ hơn số luồng gửi ({workers}): "
+                           "kết nối thừa sẽ bị đóng và mở lại")
+        self.client = client
+        self.breaker = client.breaker
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telegram-io")
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def get_updates(self, offset, timeout, limit):
+        return await self._run(self.client.get_updates, offset=offset, timeout=timeout, limit=limit)
+
+    async def send_message(self, chat_id, text):
+        # Chờ lượt gửi trong vòng lặp sự kiện thay vì để luồng của pool ngủ trong send_message
+        params = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        return await send_limited(
+            self.client.rate_limiter, chat_id,
+            lambda: self._run(self.client.call, "sendMessage", params),
+            self.client.max_throttle_retries
+        )
+
+    async def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AiohttpTransport:
+    """Gọi Bot API bằng aiohttp với một connector giới hạn `workers` kết nối"""
+
+    def __init__(self, client, workers=16):
+        if aiohttp is None:
+            raise RuntimeError("Cần cài đặt aiohttp để dùng AiohttpTransport")
+        self.base_url = f"{client.base_url}/bot{client.token}"
+        self.connect_timeout = client.connect_timeout
+        self.read_timeout = client.read_timeout
+        self.ssl = None if client.verify else False
+        self.rate_limiter = client.rate_limiter
+        self.breaker = client.breaker
+        self.max_throttle_retries = client.max_throttle_retries
+        self.workers = workers
+        self.session = None
+
+    async def _call(self, method, params, read_timeout):
+        if self.breaker is None:
+            return await self._request(method, params, read_timeout)
+        self.breaker.check()
+        try:
+            result = await self._request(method, params, read_timeout)
+        except Exception as e:
+            if is_transport_error(e, _TRANSPORT_ERRORS):
+                self.breaker.record_failure()
+            elif isinstance(e, TelegramAPIError):
+                # 4xx/429: Telegram vẫn trả lời, đường truyền tốt
+                self.breaker.record_success()
+            else:
+                # Lỗi cục bộ: không tính là lỗi đường truyền, chỉ kết thúc lượt thăm dò half-open
+                self.breaker.release_probe()
+            raise
+        except BaseException:
+            # Bị hủy (CancelledError) giữa lượt thăm dò half-open: kết thúc lượt để breaker không kẹt
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def _request(self, method, params, read_timeout):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.workers, ssl=self.ssl),
+                                                 json_serialize=json_codec.dumps)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=read_timeout)
+        async with self.session.post(f"{self.base_url}/{method}", json=params, timeout=timeout) as response:
+            data = await response.json(content_type=None, loads=json_codec.loads)
+        if not isinstance(data, dict):
+            raise TelegramAPIError(method, response.status, "Phản hồi JSON không phải object")
+        if not data.get("ok", False):
+            raise TelegramAPIError(
+                method,
+                data.get("error_code", response.status),
+                data.get("description", "Unknown error"),
+                data.get("parameters", {}).get("retry_after")
+            )
+        return data.get("result")
+
+    async def get_updates(self, offset, timeout, limit):
+        params = {"offset": offset, "timeout": timeout, "limit": limit}
+        return await self._call("getUpdates", params, self.read_timeout + timeout) or []
+
+    async def send_message(self, chat_id, text):
+        params = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        return await send_limited(
+            self.rate_limiter, chat_id,
+            lambda: self._call("sendMessage", params, self.read_timeout),
+            self.max_throttle_retries
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+def make_transport(client, workers=16, backend="auto"):
+    """Chọn transport: "aiohttp", "thread" hoặc "auto" (aiohttp nếu đã cài)"""
+    if backend == "aiohttp" or (backend == "auto" and aiohttp is not None):
+        return AiohttpTransport(client, workers)
+    return ThreadTransport(client, workers)
+
+
+def engine_from_config(config, client, handler, checkpoint=None):
+    """Dựng engine theo mục `app.engine` của config.json"""
+    settings = config.get("app.engine", {})
+    concurrency = settings.get("concurrency", 16)
+    # Thêm một luồng cho poller để long-polling không chiếm chỗ của sender
+    transport = make_transport(client, concurrency + 1, settings.get("backend", "auto"))
+    return AsyncTelegramEngine(
+        transport,
+        handler,
+        checkpoint,
+        concurrency=concurrency,
+        queue_size=settings.get("queue_size", 1000),
+        poll_timeout=settings.get("poll_timeout", 30)
+    )
+
+
+class _OffsetTracker:
+    """Theo dõi update đang xử lý; offset commit được là update cuối của dãy đã xong liên tiếp"""
+
+    def __init__(self, committed):
+        self.committed = committed
+        self._pending = deque()
+        self._done = set()
+
+    def add(self, update_id):
+        self._pending.append(update_id)
+
+    def done(self, update_id):
+        """Đánh dấu xong; trả về offset mới nếu tiến lên được, ngược lại None"""
+        self._done.add(update_id)
+        advanced = False
+        while self._pending and self._pending[0] in self._done:
+            self._done.discard(self._pending[0])
+            self.committed = self._pending.popleft()
+            advanced = True
+        return self.committed if advanced else None
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class AsyncTelegramEngine:
+    """Chạy poller, renderer và các sender như các task asyncio riêng.
+
+    `handler.handle_batch(messages)` nhận danh sách tin nhắn (dict như message_from_update)
+    và trả về danh sách Reply; handler chạy trong event loop nên phải nhanh và không chặn.
+    """
+
+    def __init__(self, transport, handler, checkpoint=None, offset=0, concurrency=16,
+                 queue_size=1000, poll_timeout=30, limit=100, error_delay=1.0):
+        self.transport = transport
+        self.handler = handler
+        self.checkpoint = checkpoint
+        self.offset = checkpoint.last if checkpoint is not None else offset
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.poll_timeout = poll_timeout
+        self.limit = limit
+        self.error_delay = error_delay
+        self._tracker = _OffsetTracker(self.offset)
+        self._remaining = {}
+        self._stop = None
+        self.received = 0
+        self.sent = 0
+        self.failed = 0
+        self.started_at = None
+
+    def stop(self):
+        """Yêu cầu engine dừng (an toàn khi gọi từ thread khác qua loop.call_soon_threadsafe)"""
+        if self._stop is not None:
+            self._stop.set()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "received": self.received,
+            "sent": self.sent,
+            "failed": self.failed,
+            "in_flight": len(self._tracker),
+            "committed_offset": self._tracker.committed,
+            "replies_per_second": self.sent / elapsed if elapsed else 0.0
+        }
+
+    def _settle(self, update_id):
+        remaining = self._remaining.get(update_id, 1) - 1
+        if remaining > 0:
+            self._remaining[update_id] = remaining
+            return
+        self._remaining.pop(update_id, None)
+        committed = self._tracker.done(update_id)
+        if committed is not None and self.checkpoint is not None:
+            self.checkpoint.commit(committed)
+
+    async def _poll(self, batches):
+        while not self._stop.is_set():
+            try:
+                updates = await self.transport.get_updates(self.offset + 1, self.poll_timeout, self.limit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Lỗi khi lấy updates: {e}")
+                await asyncio.sleep(delay if delay is not None else self._retry_delay())
+                continue
+            if not updates:
+                continue
+            for update in updates:
+                self._tracker.add(update["update_id"])
+            self.offset = updates[-1]["update_id"]
+            self.received += len(updates)
+            # Hàng đợi đầy thì poller chờ: không lấy thêm khi phía sau chưa kịp xử lý
+            await batches.put(updates)
+
+    async def _render(self, batches, outboxes):
+        while True:
+            updates = await batches.get()
+            if updates is None:
+                break
+            messages = []
+            for update in updates:
+                message = message_from_update(update)
+                if message is None:
+                    self._settle(update["update_id"])
+                else:
+                    messages.append(message)
+            try:
+                replies = self.handler.handle_batch(messages) if messages else []
+            except Exception as e:
+                logger.error(f"Lỗi khi dựng phản hồi: {e}")
+                replies = []
+            for reply in replies:
+                self._remaining[reply.update_id] = self._remaining.get(reply.update_id, 0) + 1
+            for message in messages:
+                if message["update_id"] not in self._remaining:
+                    self._settle(message["update_id"])
+            for reply in replies:
+                await outboxes[hash(reply.chat_id) % len(outboxes)].put(reply)
+        for outbox in outboxes:
+            await outbox.put(None)
+
+    def _retry_delay(self):
+        breaker = getattr(self.transport, "breaker", None)
+        return breaker.delay(self.error_delay) if breaker is not None else self.error_delay
+
+    async def _deliver(self, reply):
+        """Gửi một phản hồi; lỗi đường truyền thì chờ theo circuit breaker rồi gửi lại, Telegram
+        vẫn trả 429 sau các lần thử của transport thì chờ `retry_after` rồi gửi lại.
+
+        Trong lúc chờ, hàng đợi của sender đầy dần rồi chặn renderer và poller, nên tin
+        nhắn mới được giữ lại (ở đây hoặc phía Telegram) thay vì bị bỏ.
+        Trả về False nếu Telegram từ chối tin nhắn, None nếu engine dừng khi mạng vẫn lỗi
+        (update đó không được commit để lần chạy sau xử lý lại).
+        """
+        while True:
+            try:
+                await self.transport.send_message(reply.chat_id, reply.text)
+                return True
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None and not is_transport_error(e, _TRANSPORT_ERRORS):
+                    logger.error(f"Lỗi khi gửi tin nhắn đến {reply.chat_id}: {e}")
+                    return False
+                if self._stop.is_set():
+                    logger.error(f"Engine dừng khi chưa gửi được tin nhắn đến {reply.chat_id}: {e}")
+                    return None
+                logger.warning(f"Chưa gửi được tin nhắn đến {reply.chat_id}, sẽ gửi lại: {e}")
+                await asyncio.sleep(self._retry_delay())
+
+    async def _send(self, outbox):
+        while True:
+            reply = await outbox.get()
+            if reply is None:
+                break
+            delivered = await self._deliver(reply)
+            try:
+                if delivered:
+                    self.sent += 1
+                    if reply.on_sent is not None:
+                        reply.on_sent()
+                else:
+                    self.failed += 1
+                    if reply.on_failed is not None:
+                        reply.on_failed()
+            finally:
+                if delivered is not None:
+                    self._settle(reply.update_id)
+
+    async def run(self):
+        """Chạy đến khi stop() được gọi rồi gửi nốt các phản hồi đã dựng"""
+        self._stop = asyncio.Event()
+        self.started_at = time.monotonic()
+        batches = asyncio.Queue(maxsize=max(1, self.queue_size // max(1, self.limit)))
+        outboxes = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.concurrency)]
+        poller = asyncio.create_task(self._poll(batches))
+        renderer = asyncio.create_task(self._render(batches, outboxes))
+        senders = [asyncio.create_task(self._send(outbox)) for outbox in outboxes]
+        logger.info(f"Engine asyncio đã chạy với {self.concurrency} sender ({type(self.transport).__name__})")
+        try:
+            await self._stop.wait()
+        finally:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+            await batches.put(None)
+            await renderer
+            await asyncio.gather(*senders)
+            await self.transport.close()
+            logger.info(f"Engine asyncio đã dừng: {self.stats()}")
+
+
+class OfflineResponderHandler:
+    """Dùng logic của OfflineAutoResponder (giới hạn số lần trả lời, tin nhắn chờ) làm handler"""
+
+    def __init__(self, responder):
+        self.responder = responder
+
+    def handle_batch(self, messages):
+        responder = self.responder
+        responder.check_offline_status()
+        template_ids = responder.classify_batch(messages)
+        replies = []
+        for message, template_id in zip(messages, template_ids):
+            responder.pending_messages.append({
+                **message,
+                "received_at": datetime.now().isoformat(),
+                "auto_responded": True
+            })
+            user_id = message.get("user_id")
+            if not responder.should_auto_respond(user_id):
+                continue
+            text = responder.create_smart_response(message, template_id)
+            if not text:
+                continue
+            # Giữ chỗ trước khi gửi để tin nhắn cùng lô không vượt max_responses_per_user
+            key = str(user_id)
+            responder.user_response_count[key] = responder.user_response_count.get(key, 0) + 1
+            replies.append(Reply(message["update_id"], message["chat_id"], text,
+                                 on_failed=functools.partial(self._release, key)))
+        if len(responder.pending_messages) > 100:
+            responder.pending_messages = responder.pending_messages[-100:]
+        # Lưu trạng thái một lần cho cả lô thay vì mỗi tin nhắn
+        responder.save_state()
+        return replies
+
+    def _release(self, key):
+        count = self.responder.user_response_count.get(key, 0)
+        if count > 0:
+            self.responder.user_response_count[key] = count - 1
+
+
+class MessageHandlerAdapter:
+    """Dùng MessageHandler (keyword mapping, intent, fallback, template) làm handler"""
+
+    def __init__(self, message_handler):
+        self.message_handler = message_handler
+
+    def handle_batch(self, messages):
+        template_ids = self.message_handler.classify_batch(messages)
+        replies = []
+        for message, template_id in zip(messages, template_ids):
+            response = self.message_handler.create_response(message, template_id)
+            if response and response.get("body"):
+                replies.append(Reply(message["update_id"], message["chat_id"], response["body"]))
+        return replies
+
+
+def run_engine(engine):
+    """Chạy engine trong asyncio.run cho tới Ctrl+C"""
+    async def main():
+        task = asyncio.create_task(engine.run())
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            engine.stop()
+            await task
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
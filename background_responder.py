@@ -1,12 +1,15 @@
 import json
 import time
 import logging
-import requests
 import os
 import sys
-import threading
 from datetime import datetime
 import subprocess
+from checkpoint import OffsetCheckpoint
+from template_engine import TemplateRenderer, RenderCache
+from telegram_client import shared_client, http_options
+from polling import PollingStrategy
+from json_codec import load_file, dump_file
 
 # Thiết lập logging
 log_file = os.path.join(os.path.dirname(__file__), 'background_responder.log')
@@ -26,6 +29,11 @@ class BackgroundResponder:
         self.pid_file = "responder.pid"
         self.load_config()
         self.load_state()
+        self.checkpoint = OffsetCheckpoint("background_offset.log", initial=self.state.get("last_update_id", 0))
+        self.last_update_id = self.checkpoint.last
+        self.renderer = TemplateRenderer(cache=RenderCache())
+        # check_interval chỉ dùng khi short-polling (tắt long_polling hoặc mạng kém)
+        self.polling = PollingStrategy.from_settings(self.config, short_interval=self.config["check_interval"])
         self.responded_messages = set()
         self.running = True
         
@@ -51,8 +59,7 @@ class BackgroundResponder:
     def load_state(self):
         """Tải trạng thái hiện tại"""
         try:
-            with open(self.state_file, 'r', encoding='utf-8') as f:
-                self.state = json.load(f)
+            self.state = load_file(self.state_file)
         except FileNotFoundError:
             self.state = {
                 "last_update_id": 0,
@@ -62,9 +69,8 @@ class BackgroundResponder:
             self.save_state()
             
     def save_state(self):
-        """Lưu trạng thái"""
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        """Lưu trạng thái (tệp do máy ghi: dạng gọn)"""
+        dump_file(self.state, self.state_file)
             
     def save_pid(self):
         """Lưu Process ID"""
@@ -89,37 +95,37 @@ class BackgroundResponder:
         except:
             return False
             
+    @property
+    def client(self):
+        """Client Telegram dùng chung (pool kết nối keep-alive)"""
+        return shared_client(
+            self.config["telegram_token"],
+            rate_limit=self.config.get("rate_limit", {}),
+            circuit_breaker=self.config.get("circuit_breaker", {}),
+            **http_options(self.config.get("http", {}))
+        )
+        
+    def poll_delay(self):
+        """Nghỉ theo polling khi kết nối tốt, theo backoff của circuit breaker khi đang lỗi"""
+        breaker = self.client.breaker
+        return breaker.delay(self.polling.delay()) if breaker is not None else self.polling.delay()
+        
     def get_telegram_updates(self):
         """Lấy tin nhắn mới từ Telegram"""
         try:
-            url = f"https://api.telegram.org/bot{self.config['telegram_token']}/getUpdates"
-            params = {
-                "offset": self.state["last_update_id"] + 1,
-                "timeout": 10
-            }
-            
-            response = requests.get(url, params=params, timeout=15)
-            if response.status_code == 200:
-                data = response.json()
-                if data["ok"]:
-                    return data["result"]
-            return []
+            updates = self.client.get_updates(offset=self.last_update_id + 1, **self.polling.params())
+            self.polling.record_success(len(updates))
+            return updates
         except Exception as e:
+            self.polling.record_failure()
             logger.error(f"Lỗi khi lấy tin nhắn: {e}")
             return []
             
     def send_telegram_message(self, chat_id, text):
         """Gửi tin nhắn qua Telegram"""
         try:
-            url = f"https://api.telegram.org/bot{self.config['telegram_token']}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            
-            response = requests.post(url, json=data, timeout=10)
-            return response.status_code == 200
+            self.client.send_message(chat_id, text, parse_mode="HTML")
+            return True
         except Exception as e:
             logger.error(f"Lỗi khi gửi tin nhắn: {e}")
             return False
@@ -148,10 +154,11 @@ class BackgroundResponder:
                 sender_name += " " + message["from"]["last_name"]
                 
             # Gửi tin nhắn offline tự động
-            response_text = self.config["auto_offline_message"].format(name=sender_name)
+            response_text = self.renderer.render_text(self.config["auto_offline_message"], {"name": sender_name})
                 
             # Gửi phản hồi
             if self.send_telegram_message(chat_id, response_text):
+                self.polling.record_reply(message["date"])
                 self.responded_messages.add(unique_id)
                 self.state["message_count"] += 1
                 self.save_state()
@@ -167,7 +174,10 @@ class BackgroundResponder:
         self.save_pid()
         logger.info("🚀 Background Responder đã khởi động")
         logger.info(f"📱 Token: ...{self.config['telegram_token'][-10:]}")
-        logger.info(f"⏰ Kiểm tra mỗi {self.config['check_interval']} giây")
+        if self.polling.mode == "long":
+            logger.info(f"⏰ Long-polling {self.polling.timeout} giây, trả lời ngay khi có tin nhắn")
+        else:
+            logger.info(f"⏰ Kiểm tra mỗi {self.config['check_interval']} giây")
         
         try:
             while self.running:
@@ -175,24 +185,26 @@ class BackgroundResponder:
                 updates = self.get_telegram_updates()
                 
                 for update in updates:
-                    # Cập nhật last_update_id
-                    self.state["last_update_id"] = update["update_id"]
-                    self.save_state()
+                    # Cập nhật last_update_id (chỉ commit sau khi xử lý xong lô)
+                    self.last_update_id = update["update_id"]
                     
                     # Xử lý tin nhắn
                     self.process_message(update)
+                self.checkpoint.commit(self.last_update_id)
                     
                 # Dọn dẹp danh sách tin nhắn đã trả lời
                 if len(self.responded_messages) > 1000:
                     self.responded_messages = set(list(self.responded_messages)[-500:])
                     
                 # Nghỉ trước khi kiểm tra lại
-                time.sleep(self.config["check_interval"])
+                time.sleep(self.poll_delay())
                 
         except Exception as e:
             logger.error(f"❌ Lỗi không mong muốn: {e}")
         finally:
             self.remove_pid()
+            logger.info(f"📊 Thống kê kết nối Telegram: {self.client.connection_stats()}")
+            logger.info(f"📊 Thống kê polling và độ trễ trả lời: {self.polling.stats()}")
             logger.info("🛑 Background Responder đã dừng")
             
     def stop_daemon(self):
@@ -203,8 +215,7 @@ class BackgroundResponder:
         """Lấy thông tin trạng thái"""
         if self.is_running():
             try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    state = json.load(f)
+                state = load_file(self.state_file)
                 return {
                     "running": True,
                     "start_time": state.get("start_time"),
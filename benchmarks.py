@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Các benchmark nhỏ cho những đường xử lý nóng của bot
+
+Cách dùng:
+    python benchmarks.py            # chạy tất cả
+    python benchmarks.py config     # chỉ chạy một benchmark
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import timeit
+import logging
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from config import Config
+from keyword_matcher import KeywordMatcher
+from intent_rules import IntentClassifier, DEFAULT_INTENT_RULES
+from fuzzy_matcher import TrigramIndex
+from text_normalizer import fold, normalize, normalize_accented
+from tfidf_fallback import TfidfFallback, np
+from template_engine import TemplateRenderer, RenderCache
+from telegram_client import TelegramClient
+from rate_limiter import RateLimiter, SharedRateLimiter
+from outbox import Outbox
+from prefetch import PrefetchPoller
+from json_codec import available_codecs
+from async_engine import AsyncTelegramEngine, ThreadTransport, Reply, message_from_update
+
+
+def report(name, seconds, number):
+    """In thời gian trung bình cho mỗi lần gọi"""
+    print(f"  {name:<46} {seconds / number * 1e6:10.3f} µs")
+
+
+def bench_config(number):
+    """So sánh chi phí đọc cấu hình cho mỗi tin nhắn: Config.get và ConfigSnapshot"""
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Config(os.path.join(tmp, "config.json"), write_behind=False)
+    sender = "customer_42"
+
+    def before():
+        config.get("platforms.telegram.enabled", False)
+        config.get("platforms.telegram.check_interval", 30)
+        sender in config.get("excluded_senders", [])
+        config.get("keyword_template_mapping", {}).items()
+
+    def after():
+        snapshot = config.snapshot
+        snapshot.telegram.enabled
+        snapshot.telegram.check_interval
+        sender in snapshot.excluded_senders
+        snapshot.keyword_template_mapping.items()
+
+    print("config: chi phí đọc cấu hình mỗi tin nhắn")
+    report("Config.get (trước)", timeit.timeit(before, number=number), number)
+    report("Config.snapshot (sau)", timeit.timeit(after, number=number), number)
+
+
+TEMPLATE_BODY = (
+    "🤖 Xin chào {sender_name}!\n\nCảm ơn bạn đã nhắn tin! Tôi hiện đang offline và không thể trả lời ngay lúc này."
+    "\n\n📝 Tin nhắn của bạn đã được ghi nhận.\n\n⏰ Offline {offline_hours} giờ {offline_minutes} phút."
+    "\n\n🕐 Thời gian hiện tại: {current_time} - {current_date}"
+)
+
+
+def bench_template(number):
+    """So sánh chuỗi str.replace cũ với renderer đã biên dịch"""
+    renderer = TemplateRenderer()
+    variables = {"sender_name": "Minh", "offline_hours": 2, "offline_minutes": 15}
+
+    def before():
+        body = TEMPLATE_BODY.replace("{sender_name}", "Minh")
+        body = body.replace("{offline_hours}", str(2))
+        body = body.replace("{offline_minutes}", str(15))
+        body = body.replace("{current_time}", datetime.now().strftime("%H:%M"))
+        body = body.replace("{current_date}", datetime.now().strftime("%d/%m/%Y"))
+        return body
+
+    def after():
+        return renderer.render_text(TEMPLATE_BODY, variables)
+
+    cached = TemplateRenderer(cache=RenderCache())
+
+    def after_cached():
+        return cached.render_text(TEMPLATE_BODY, variables)
+
+    print("template: render một mẫu có 5 placeholder")
+    report("str.replace nối chuỗi (trước)", timeit.timeit(before, number=number), number)
+    report("TemplateRenderer (sau)", timeit.timeit(after, number=number), number)
+    report("TemplateRenderer + RenderCache", timeit.timeit(after_cached, number=number), number)
+    print(f"  cache: {cached.cache.stats()}")
+
+
+SAMPLE_MESSAGES = [
+    "Chào shop, cho mình hỏi giá sản phẩm này bao nhiêu vậy?",
+    "Hello, I would like to buy two of these, can you help?",
+    "Mình cần hỗ trợ gấp, đơn hàng bị lỗi thanh toán",
+    "What are your business hours on the weekend?",
+    "ok cảm ơn nhé",
+]
+
+
+def bench_keywords(number):
+    """So sánh vòng lặp re.search theo từng từ khóa với automaton Aho-Corasick"""
+    print("keywords: chọn template theo keyword_template_mapping cho mỗi tin nhắn")
+    base = {"help": "support_ticket", "hours": "business_hours", "vacation": "out_of_office",
+            "hello": "welcome", "buy": "sales_inquiry"}
+    for size in (5, 100, 1000):
+        mapping = dict(base)
+        for i in range(size - len(base)):
+            mapping[f"sanpham{i}"] = "sales_inquiry"
+        matcher = KeywordMatcher(mapping.items())
+        loops = max(1, number // size)
+
+        def before():
+            for content in SAMPLE_MESSAGES:
+                for keyword, template_id in mapping.items():
+                    if re.search(r'\b' + re.escape(keyword) + r'\b', content, re.IGNORECASE):
+                        break
+
+        def after():
+            for content in SAMPLE_MESSAGES:
+                matcher.match(content)
+
+        count = loops * len(SAMPLE_MESSAGES)
+        report(f"{size} từ khóa - re.search (trước)", timeit.timeit(before, number=loops), count)
+        report(f"{size} từ khóa - KeywordMatcher (sau)", timeit.timeit(after, number=loops), count)
+
+
+TRAFFIC = [
+    "Chào shop ạ",
+    "shop ơi sản phẩm này giá bao nhiêu vậy",
+    "Cho em hỏi ship về Đà Nẵng mất mấy ngày?",
+    "mình muốn đặt hàng 2 cái size M",
+    "Gấp lắm, đơn hàng của mình chưa tới mà mai phải dùng rồi",
+    "ad ơi giúp mình đổi địa chỉ nhận hàng với",
+    "Xin chào, bên bạn có bán sỉ không?",
+    "ok cảm ơn bạn nhiều nhé",
+    "Sản phẩm còn màu đen không shop",
+    "Mình cần hỗ trợ về bảo hành",
+    "Hello, is this still available?",
+    "How much does the premium plan cost per month?",
+    "I want to order three units, do you ship to Singapore?",
+    "URGENT: my payment went through twice, please refund",
+    "Can you help me reset my password",
+    "thanks, got it",
+    "Do you have a store in Hanoi?",
+    "hi there 👋",
+    "What is the price for bulk orders?",
+    "I'd like to buy a gift card",
+]
+
+
+def bench_intents(number):
+    """So sánh chuỗi if/elif any(...) cũ với bộ phân loại ý định dùng một automaton"""
+    classifier = IntentClassifier.from_config(DEFAULT_INTENT_RULES)
+    chains = [(rule["keywords"], rule["template_id"]) for rule in DEFAULT_INTENT_RULES]
+
+    def classify_old(content):
+        content = content.lower()
+        for words, template_id in chains:
+            if any(word in content for word in words):
+                return template_id
+        return "default_offline"
+
+    def classify_new(content):
+        rule = classifier.classify(content)
+        return rule.template_id if rule else "default_offline"
+
+    # Hồi quy: luật chào hỏi chỉ khớp nguyên từ ("hi" không nằm trong "this"), luật khác vẫn khớp trong từ
+    for text, expected in (("this is fine", "default_offline"), ("nothing", "default_offline"),
+                           ("hi there", "welcome_offline"), ("helpful tips please", "support_offline")):
+        assert classify_new(text) == expected, (text, classify_new(text))
+    mismatches = [text for text in TRAFFIC if classify_old(text) != classify_new(text)]
+    # Khác nhau chỉ ở các tin "hi" nằm trong từ khác ("ship", "nhiều"): chuỗi cũ coi là lời chào,
+    # luật chào hỏi giờ chỉ khớp nguyên từ
+    assert all(classify_old(text) == "welcome_offline" and " hi " not in f" {text.lower()} "
+               for text in mismatches), mismatches
+    loops = max(1, number // len(TRAFFIC))
+
+    def before():
+        for text in TRAFFIC:
+            classify_old(text)
+
+    def after():
+        for text in TRAFFIC:
+            classify_new(text)
+
+    count = loops * len(TRAFFIC)
+    print(f"intents: phân loại {len(TRAFFIC)} tin nhắn tiếng Việt/tiếng Anh thực tế")
+    report("if/elif any(word in content) (trước)", timeit.timeit(before, number=loops), count)
+    report("IntentClassifier (sau)", timeit.timeit(after, number=loops), count)
+    print(f"  kết quả khác nhau: {len(mismatches)} (\"hi\" nằm trong từ khác, không còn bị coi là lời chào)")
+
+    # Cùng lưu lượng nhưng bảng luật có thêm 500 tên sản phẩm
+    large_rules = DEFAULT_INTENT_RULES + [{
+        "intent": "product", "priority": 6, "template_id": "sales_offline",
+        "keywords": [f"sản phẩm mã sp{i:04d}" for i in range(500)]
+    }]
+    classifier = IntentClassifier.from_config(large_rules)
+    chains = [(rule["keywords"], rule["template_id"]) for rule in large_rules]
+    report("505 từ khóa - if/elif any(...) (trước)", timeit.timeit(before, number=loops), count)
+    report("505 từ khóa - IntentClassifier (sau)", timeit.timeit(after, number=loops), count)
+
+
+def bench_normalize(number):
+    """Chi phí chuẩn hóa không dấu và độ phủ khi khách gõ không dấu"""
+    unaccented = [fold(text) for text in TRAFFIC]
+    exact = IntentClassifier.from_config(DEFAULT_INTENT_RULES)
+    folded = IntentClassifier.from_config(DEFAULT_INTENT_RULES, normalizer=normalize, accented=normalize_accented)
+    loops = max(1, number // len(TRAFFIC))
+    count = loops * len(TRAFFIC)
+
+    # Hồi quy: tin nhắn có dấu không khớp từ khóa chỉ trùng khi đã bỏ dấu ("gặp"/"gấp", "mùa"/"mua")
+    for text in ("Rất vui được gặp bạn", "Gia đình tôi khỏe", "Tôi muốn tham gia", "Mùa hè năm nay", "Ăn cháo chưa"):
+        assert folded.classify(text) is None, (text, folded.classify(text))
+    for text, intent in (("cần gấp", "urgent"), ("gia bao nhieu", "price"), ("xin chao shop", "welcome")):
+        assert folded.classify(text).intent == intent, (text, folded.classify(text))
+
+    print("normalize: chuẩn hóa tiếng Việt không dấu")
+    report("fold() không cache", timeit.timeit(lambda: [fold(t) for t in TRAFFIC], number=loops), count)
+    report("normalize() trúng cache", timeit.timeit(lambda: [normalize(t) for t in TRAFFIC], number=loops), count)
+    report("IntentClassifier chuẩn hóa", timeit.timeit(lambda: [folded.classify(t) for t in TRAFFIC], number=loops), count)
+    recall_exact = sum(exact.classify(text) is not None for text in unaccented)
+    recall_folded = sum(folded.classify(text) is not None for text in unaccented)
+    print(f"  tin nhắn gõ không dấu nhận diện được: {recall_exact}/{len(TRAFFIC)} (khớp chính xác)"
+          f" -> {recall_folded}/{len(TRAFFIC)} (không phân biệt dấu)")
+
+
+def bench_batch(number):
+    """So sánh phân loại từng tin nhắn với classify_batch cho một lô getUpdates (100 update)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Config(os.path.join(tmp, "config.json"), write_behind=False)
+    batch = (TRAFFIC * 5)[:100]
+    loops = max(1, number // len(batch))
+    count = loops * len(batch)
+
+    def before():
+        for text in batch:
+            config.snapshot.classify(text)
+
+    def after():
+        config.snapshot.classify_batch(batch)
+
+    print("batch: chọn template cho lô 100 tin nhắn")
+    report("classify() từng tin nhắn (trước)", timeit.timeit(before, number=loops), count)
+    report("classify_batch() cả lô (sau)", timeit.timeit(after, number=loops), count)
+
+
+def bench_fallback(number):
+    """Thời gian dựng/nạp ma trận TF-IDF và chấm điểm mỗi tin nhắn với 300 template"""
+    print("fallback: bộ phân loại dự phòng TF-IDF, 300 template x 5 câu ví dụ")
+    if np is None:
+        print("  bỏ qua: chưa cài numpy")
+        return
+    words = ["giao", "hàng", "đổi", "trả", "bảo", "hành", "size", "màu", "giá", "ship", "order",
+             "refund", "open", "store", "voucher", "tài", "khoản", "thanh", "toán", "lỗi"]
+    examples = {
+        f"template_{i}": [" ".join(words[(i * 7 + j * 3 + k) % len(words)] for k in range(4)) + f" mã{i}"
+                          for j in range(5)]
+        for i in range(300)
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        matrix_file = os.path.join(tmp, "tfidf.npy")
+        report("dựng ma trận (lần đầu)", timeit.timeit(lambda: TfidfFallback(examples, 0.2, matrix_file), number=1), 1)
+        report("nạp lại bằng memory-map", timeit.timeit(lambda: TfidfFallback(examples, 0.2, matrix_file), number=5), 5)
+        fallback = TfidfFallback(examples, 0.2, matrix_file)
+        loops = max(1, number // len(TRAFFIC))
+        report("chấm điểm mỗi tin nhắn",
+               timeit.timeit(lambda: fallback.classify_batch(TRAFFIC), number=loops), loops * len(TRAFFIC))
+
+
+TYPOS = [
+    "khan capp, giao ngay giup minh",
+    "minh muon dat hnag 2 cai",
+    "suport me please",
+    "helo shop",
+    "emergancy!!",
+    "gia bao nhieu vay",
+]
+
+
+def bench_fuzzy(number):
+    """Chi phí thêm của so khớp gần đúng khi automaton trượt và độ phủ với tin nhắn gõ sai"""
+    exact = IntentClassifier.from_config(DEFAULT_INTENT_RULES, normalizer=normalize)
+    fuzzy = IntentClassifier.from_config(DEFAULT_INTENT_RULES, normalizer=normalize,
+                                         fuzzy={"enabled": True, "max_distance": 1})
+    misses = [text for text in TRAFFIC if exact.classify(text) is None] or TRAFFIC
+    loops = max(1, number // len(TRAFFIC))
+    # Hồi quy: câu bình thường gần một từ khóa ngắn, hoặc gồm toàn từ có thật, không bị gán ý định
+    for text in ("chắc chắn rồi", "cháu cảm ơn", "ở giữa nhà", "I lost my card", "mặt hàng này còn không"):
+        assert fuzzy.classify(text) is None, (text, fuzzy.classify(text))
+    for text, expected in (("khan capp, giao ngay giup minh", "urgent_response"), ("suport me please", "support_offline"),
+                           ("xim chao shop", "welcome_offline")):
+        assert fuzzy.classify(text).template_id == expected, text
+
+    print("fuzzy: so khớp từ khóa chịu lỗi chính tả (chỉ chạy khi automaton trượt)")
+    report("toàn bộ lưu lượng - chỉ automaton",
+           timeit.timeit(lambda: exact.classify_batch(TRAFFIC), number=loops), loops * len(TRAFFIC))
+    report("toàn bộ lưu lượng - automaton + trigram",
+           timeit.timeit(lambda: fuzzy.classify_batch(TRAFFIC), number=loops), loops * len(TRAFFIC))
+    report(f"{len(misses)} tin nhắn trượt - automaton + trigram",
+           timeit.timeit(lambda: fuzzy.classify_batch(misses), number=loops), loops * len(misses))
+    recall_exact = sum(exact.classify(text) is not None for text in TYPOS)
+    recall_fuzzy = sum(fuzzy.classify(text) is not None for text in TYPOS)
+    print(f"  tin nhắn gõ sai nhận diện được: {recall_exact}/{len(TYPOS)} -> {recall_fuzzy}/{len(TYPOS)}")
+
+    # Thời gian tra cứu gần như không đổi khi từ điển lớn lên (chỉ xét từ khóa chung trigram)
+    syllables = ["ba", "lo", "ti", "nha", "khu", "phong", "sen", "mai", "dong", "tra", "vi", "quat", "bep", "den",
+                 "ghe", "ban", "tu", "giuong", "noi", "chao", "coc", "binh", "ao", "quan", "giay", "mu", "kinh"]
+    rng = random.Random(0)
+    vocabulary = [" ".join("".join(rng.choice(syllables) for _ in range(3)) for _ in range(rng.randint(1, 2)))
+                  for _ in range(10000)]
+    for size in (100, 1000, 10000):
+        index = TrigramIndex(((keyword, i) for i, keyword in enumerate(vocabulary[:size])), normalizer=normalize)
+        report(f"{size} từ khóa - tra cứu trigram mỗi tin nhắn",
+               timeit.timeit(lambda: [index.match(text) for text in misses], number=loops), loops * len(misses))
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    """Trả lời mọi lời gọi Bot API bằng {"ok": true} qua kết nối HTTP/1.1 keep-alive"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"ok":true,"result":{"message_id":1}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_http(number):
+    """So sánh requests.post mỗi lần (kết nối mới) với TelegramClient dùng pool keep-alive"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    url = f"{base_url}/botTOKEN/sendMessage"
+    payload = {"chat_id": 1, "text": "xin chào"}
+    loops = max(1, number // 20)
+    client = TelegramClient("TOKEN", base_url=base_url)
+
+    print("http: gửi sendMessage tới máy chủ cục bộ (không TLS, chỉ tính bắt tay TCP)")
+    try:
+        report("requests.post() mỗi lần (trước)",
+               timeit.timeit(lambda: requests.post(url, json=payload, timeout=5), number=loops), loops)
+        report("TelegramClient.send_message() (sau)",
+               timeit.timeit(lambda: client.send_message(1, "xin chào"), number=loops), loops)
+        stats = client.connection_stats()
+        print(f"  {stats['requests']} lời gọi, {stats['handshakes']} lần bắt tay,"
+              f" tỉ lệ dùng lại kết nối {stats['reuse_ratio']:.1%}")
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+class _UpdatesHandler(BaseHTTPRequestHandler):
+    """getUpdates trả về lần lượt các update tổng hợp, sendMessage chậm `send_delay` giây"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    updates = []
+    send_delay = 0.02
+
+    def _reply(self, result):
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        offset = int(self.path.split("offset=")[1].split("&")[0]) if "offset=" in self.path else 0
+        batch = [update for update in self.updates if update["update_id"] >= offset][:100]
+        if not batch:
+            time.sleep(0.05)
+        self._reply(batch)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.send_delay)
+        self._reply({"message_id": 1})
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_engine(number):
+    """Vòng lặp đồng bộ (gửi tuần tự) so với engine asyncio khi sendMessage mất 20 ms"""
+    total = max(100, min(number // 10, 2000))
+    _UpdatesHandler.updates = [
+        {"update_id": i + 1, "message": {"message_id": i + 1, "date": 0, "chat": {"id": i % 50},
+                                         "from": {"id": i % 50, "first_name": "Khách"}, "text": "giá bao nhiêu?"}}
+        for i in range(total)
+    ]
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _UpdatesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    renderer = TemplateRenderer(cache=RenderCache())
+
+    class Handler:
+        def handle_batch(self, messages):
+            return [Reply(m["update_id"], m["chat_id"], renderer.render_text(TEMPLATE_BODY, {"sender_name": m["sender"]}))
+                    for m in messages]
+
+    def run_sync(count):
+        client = TelegramClient("TOKEN", base_url=base_url)
+        offset = 0
+        started = time.perf_counter()
+        while offset < count:
+            updates = client.get_updates(offset=offset + 1, timeout=0, limit=100)
+            for reply in Handler().handle_batch([message_from_update(update) for update in updates]):
+                client.send_message(reply.chat_id, reply.text)
+            offset = updates[-1]["update_id"]
+        return time.perf_counter() - started
+
+    def run_async(concurrency):
+        client = TelegramClient("TOKEN", base_url=base_url, pool_maxsize=concurrency + 1)
+        engine = AsyncTelegramEngine(ThreadTransport(client, concurrency + 1), Handler(),
+                                     concurrency=concurrency, poll_timeout=0)
+
+        async def main():
+            task = asyncio.create_task(engine.run())
+            started = time.perf_counter()
+            while engine.sent + engine.failed < total:
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            engine.stop()
+            await task
+            return elapsed
+
+        return asyncio.run(main())
+
+    print(f"engine: {total} tin nhắn từ 50 chat, sendMessage mất {_UpdatesHandler.send_delay * 1000:.0f} ms")
+    try:
+        # Vòng lặp đồng bộ chậm nên chỉ đo trên 200 tin nhắn đầu
+        sync_count = min(total, 200)
+        print(f"  {'vòng lặp đồng bộ (trước)':<46} {sync_count / run_sync(sync_count):10.1f} tin/giây")
+        for concurrency in (16, 64):
+            elapsed = run_async(concurrency)
+            print(f"  {f'engine asyncio, {concurrency} sender (sau)':<46} {total / elapsed:10.1f} tin/giây")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _max_in_window(times, window):
+    """Số lần gửi nhiều nhất trong một cửa sổ `window` giây bất kỳ"""
+    times = sorted(times)
+    best = start = 0
+    for end, moment in enumerate(times):
+        while moment - times[start] >= window - 1e-9:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def bench_ratelimit(number):
+    """Chi phí mỗi lần đặt chỗ và lịch gửi (đồng hồ giả lập) cho một đợt tin nhắn dồn dập"""
+    limiter = RateLimiter(global_per_second=1e9, private_per_second=1e9)
+    chat_ids = list(range(1000))
+    print("ratelimit: token bucket toàn cục + theo chat")
+    report("RateLimiter.reserve() mỗi tin nhắn",
+           timeit.timeit(lambda: limiter.reserve(chat_ids[random.randrange(1000)]), number=number), number)
+    # Bản dùng chung giữa các tiến trình worker của webhook_server.py (mỗi lần một transaction SQLite)
+    with tempfile.TemporaryDirectory() as directory:
+        shared = SharedRateLimiter(os.path.join(directory, "state.db"), global_per_second=1e9, private_per_second=1e9)
+        count = max(100, number // 100)
+        report("SharedRateLimiter.reserve() mỗi tin nhắn",
+               timeit.timeit(lambda: shared.reserve(chat_ids[random.randrange(1000)]), number=count), count)
+
+    # 600 tin nhắn tới cùng lúc: 200 chat riêng (mỗi chat 2 tin) và 5 nhóm (mỗi nhóm 40 tin)
+    now = [0.0]
+    limiter = RateLimiter(clock=lambda: now[0])
+    burst = [chat_id for chat_id in range(1, 201) for _ in range(2)] + [-chat for chat in range(1, 6) for _ in range(40)]
+    random.Random(0).shuffle(burst)
+    sent = {}
+    for chat_id in burst:
+        sent.setdefault(chat_id, []).append(limiter.reserve(chat_id))
+    moments = [moment for times in sent.values() for moment in times]
+    private = max(_max_in_window(times, 1.0) for chat_id, times in sent.items() if chat_id > 0)
+    groups = max(_max_in_window(times, 60.0) for chat_id, times in sent.items() if chat_id < 0)
+    print(f"  {len(burst)} tin nhắn dồn dập: gửi hết sau {max(moments):.1f} giây (không tin nào bị từ chối)")
+    print(f"  nhiều nhất {_max_in_window(moments, 1.0)} tin/giây toàn cục, {private} tin/giây mỗi chat riêng,"
+          f" {groups} tin/phút mỗi nhóm (giới hạn 30 / 1 / 20)")
+    print(f"  {limiter.stats()['delayed']} tin phải xếp hàng, tổng thời gian chờ {limiter.stats()['total_wait']} giây")
+
+
+def bench_outbox(number):
+    """Ghi phản hồi vào outbox: commit (fsync) từng tin nhắn so với group commit cả lô 100 tin"""
+    count = max(100, min(number // 100, 2000))
+    print(f"outbox: ghi {count} phản hồi vào SQLite WAL (synchronous=FULL)")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, batch in (("commit mỗi tin nhắn (không gom)", 1), ("group commit mỗi lô 100 tin", 100)):
+            outbox = Outbox(os.path.join(directory, f"outbox-{batch}.db"))
+            started = time.perf_counter()
+            for i in range(count):
+                outbox.enqueue(i % 50, "Cảm ơn bạn đã nhắn tin!", {"date": i})
+                if (i + 1) % batch == 0:
+                    outbox.flush()
+            outbox.flush()
+            report(label, time.perf_counter() - started, count)
+            started = time.perf_counter()
+            outbox.drain(lambda item: True)
+            report("  drain + ack (mỗi đợt 100 tin một commit)", time.perf_counter() - started, count)
+            print(f"  {outbox.stats()['group_commits']} transaction cho {count} tin nhắn")
+            outbox.close()
+
+
+def bench_prefetch(number):
+    """Poll rồi xử lý tuần tự so với PrefetchPoller (poll lô sau trong lúc xử lý lô hiện tại)"""
+    batches = max(10, min(number // 5000, 50))
+    fetch_delay, process_delay = 0.02, 0.015
+    print(f"prefetch: {batches} lô, getUpdates {fetch_delay * 1000:.0f} ms, xử lý {process_delay * 1000:.0f} ms mỗi lô")
+
+    def fetch(offset):
+        time.sleep(fetch_delay)
+        return [{"update_id": offset}]
+
+    started = time.perf_counter()
+    offset = 1
+    for _ in range(batches):
+        updates = fetch(offset)
+        offset = updates[-1]["update_id"] + 1
+        time.sleep(process_delay)
+    report("tuần tự (poll rồi xử lý)", time.perf_counter() - started, batches)
+
+    poller = PrefetchPoller(fetch, 1, queue_size=2)
+    started = time.perf_counter()
+    poller.start()
+    seen = []
+    while len(seen) < batches:
+        updates, _ = poller.get(timeout=1.0) or ([], None)
+        if updates:
+            seen.extend(update["update_id"] for update in updates)
+            time.sleep(process_delay)
+    elapsed = time.perf_counter() - started
+    poller.stop()
+    report("prefetch (hàng đợi 2 lô)", elapsed, batches)
+    print(f"  thứ tự giữ nguyên: {seen == list(range(1, batches + 1))}, {poller.stats()}")
+
+
+def bench_json(number):
+    """Chi phí JSON cho mỗi tin nhắn theo từng backend: ghi trạng thái (đẹp/gọn) và đọc getUpdates"""
+    state = {
+        "is_offline": True,
+        "offline_start_time": datetime.now().isoformat(),
+        "last_activity_time": datetime.now().isoformat(),
+        "user_response_count": {str(100000 + i): {"count": i % 3, "date": "2024-01-01"} for i in range(200)},
+        "pending_messages": [{"chat_id": i, "text": "Chào shop, cho mình hỏi giá"} for i in range(20)]
+    }
+    updates = json.dumps({"ok": True, "result": [
+        {"update_id": 1000 + i, "message": {
+            "message_id": i, "date": 1700000000 + i, "text": "Chào shop, sản phẩm này còn hàng không?",
+            "chat": {"id": 5000 + i, "type": "private"},
+            "from": {"id": 5000 + i, "first_name": "Khách", "username": f"khach{i}"}
+        }} for i in range(100)
+    ]}, ensure_ascii=False).encode("utf-8")
+    count = max(100, number // 100)
+    print(f"json: trạng thái {len(json.dumps(state, ensure_ascii=False, indent=2))} ký tự, "
+          f"getUpdates 100 update ({len(updates)} byte)")
+    for name, codec in available_codecs().items():
+        pretty = codec.dumps(state, pretty=True)
+        compact = codec.dumps(state)
+        assert codec.loads(compact) == state
+        report(f"{name}: ghi trạng thái (thụt lề)", timeit.timeit(lambda: codec.dumps(state, pretty=True), number=count), count)
+        report(f"{name}: ghi trạng thái (gọn)", timeit.timeit(lambda: codec.dumps(state), number=count), count)
+        report(f"{name}: đọc getUpdates (mỗi update)", timeit.timeit(lambda: codec.loads(updates), number=count), count * 100)
+        print(f"  {name}: gọn {len(compact)} ký tự so với {len(pretty)} khi thụt lề")
+
+
+BENCHMARKS = {
+    "config": bench_config,
+    "template": bench_template,
+    "keywords": bench_keywords,
+    "intents": bench_intents,
+    "normalize": bench_normalize,
+    "batch": bench_batch,
+    "fallback": bench_fallback,
+    "fuzzy": bench_fuzzy,
+    "http": bench_http,
+    "engine": bench_engine,
+    "ratelimit": bench_ratelimit,
+    "outbox": bench_outbox,
+    "prefetch": bench_prefetch,
+    "json": bench_json,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các đường xử lý nóng của bot")
+    parser.add_argument("names", nargs="*", help=f"Tên benchmark: {', '.join(BENCHMARKS)} (mặc định: tất cả)")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Số lần lặp cho mỗi phép đo")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Không có benchmark: {', '.join(unknown)}")
+    logging.basicConfig(level=logging.WARNING)
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args.number)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
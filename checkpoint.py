@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module lưu offset (last_update_id) của Telegram vào một log chỉ ghi nối tiếp
+"""
+
+import os
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OffsetCheckpoint:
+    """Log offset chỉ ghi nối tiếp với các bản ghi độ dài cố định.
+
+    Mỗi bản ghi là offset được đệm số 0 thành 20 ký tự cộng ký tự xuống dòng,
+    nên offset mới nhất luôn nằm ở bản ghi cuối cùng và được đọc bằng một lần
+    seek (O(1)) khi khởi động. Bản ghi cuối bị ghi dở (do tắt đột ngột) sẽ bị
+    bỏ qua. Log được nén lại thành một bản ghi sau mỗi `compact_every` lần commit.
+    """
+
+    RECORD_WIDTH = 20
+    RECORD_SIZE = RECORD_WIDTH + 1
+
+    def __init__(self, path, initial=0, compact_every=1000, fsync=False):
+        """Mở log offset; `initial` chỉ dùng khi log chưa tồn tại (chuyển dữ liệu cũ sang)"""
+        self.path = path
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._records = 0
+        self.last = self._load(initial or 0)
+        self._file = open(self.path, 'ab')
+        if self._records == 0 or self._records >= self.compact_every:
+            self._compact()
+        logger.info(f"Đã tải offset {self.last} từ {self.path}")
+
+    def _load(self, initial):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return initial
+        self._records = size // self.RECORD_SIZE
+        if size % self.RECORD_SIZE:
+            # Cắt bỏ bản ghi ghi dở để các bản ghi nối thêm vẫn thẳng hàng
+            os.truncate(self.path, self._records * self.RECORD_SIZE)
+        if self._records == 0:
+            return initial
+        try:
+            with open(self.path, 'rb') as file:
+                file.seek((self._records - 1) * self.RECORD_SIZE)
+                return int(file.read(self.RECORD_WIDTH))
+        except (OSError, ValueError) as e:
+            logger.error(f"Lỗi khi đọc log offset {self.path}: {e}")
+            return initial
+
+    def _record(self, offset):
+        return b"%020d\n" % offset
+
+    def commit(self, offset):
+        """Ghi nhận offset sau khi cả lô update đã được xử lý xong (at-least-once)"""
+        with self._lock:
+            if offset <= self.last:
+                return False
+            self._file.write(self._record(offset))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.last = offset
+            self._records += 1
+            if self._records >= self.compact_every:
+                self._compact()
+            return True
+
+    def _compact(self):
+        # Thay log bằng một bản ghi duy nhất chứa offset hiện tại
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".offset-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(self._record(self.last))
+                file.flush()
+                os.fsync(file.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._records = 1
+        except Exception as e:
+            logger.error(f"Lỗi khi nén log offset {self.path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        if self._file.closed:
+            self._file = open(self.path, 'ab')
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module circuit breaker cho các lời gọi Telegram Bot API
+
+- closed: gọi bình thường, đếm lỗi truyền tải liên tiếp (lỗi mạng, timeout, 5xx).
+- open: sau `failure_threshold` lỗi liên tiếp, mọi lời gọi bị từ chối ngay (CircuitOpenError)
+  trong một khoảng backoff "decorrelated jitter" thay vì chờ timeout từng lần.
+- half-open: hết thời gian chờ, cho đúng một lời gọi thử; thành công thì đóng lại,
+  lỗi thì mở lại với backoff dài hơn.
+
+Phản hồi chưa gửi được khi mạch mở nằm lại trong outbox (outbox.py) và được gửi khi mạch đóng.
+"""
+
+import time
+import random
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Mạch đang mở: lời gọi bị từ chối mà không chạm tới mạng"""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Circuit breaker đang mở, thử lại sau {retry_in:.1f} giây")
+        self.retry_in = retry_in
+
+
+TRANSPORT_ERRORS = (CircuitOpenError, requests.RequestException, ConnectionError, TimeoutError)
+
+
+def is_transport_error(error, transport_errors=TRANSPORT_ERRORS):
+    """Lỗi đường truyền (mạng, timeout, 5xx, mạch đang mở): phản hồi nên được giữ lại và gửi lại.
+
+    TelegramAPIError được nhận ra qua `error_code`: chỉ 5xx là lỗi đường truyền.
+    """
+    error_code = getattr(error, "error_code", None)
+    if error_code is not None:
+        return isinstance(error_code, int) and error_code >= 500
+    return isinstance(error, transport_errors)
+
+
+def retry_after(error):
+    """Số giây nên chờ rồi gửi lại khi Telegram hoãn lời gọi (429 kèm `retry_after`); None với lỗi khác.
+
+    Phản hồi bị hoãn không hỏng: nơi gọi giữ nó lại (outbox) thay vì bỏ như lỗi 4xx khác.
+    """
+    if getattr(error, "error_code", None) == 429:
+        return getattr(error, "retry_after", None) or 1.0
+    return None
+
+
+class DecorrelatedJitter:
+    """Backoff "decorrelated jitter": mỗi lần chờ ngẫu nhiên trong [base, 3 x lần trước], tối đa `cap`"""
+
+    def __init__(self, base=1.0, cap=60.0, rng=None):
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+        self.current = base
+
+    def next(self):
+        self.current = min(self.cap, self.rng.uniform(self.base, self.current * 3))
+        return self.current
+
+    def reset(self):
+        self.current = self.base
+
+
+class CircuitBreaker:
+    """Circuit breaker closed/open/half-open, an toàn khi dùng từ nhiều luồng"""
+
+    def __init__(self, failure_threshold=5, base_delay=1.0, max_delay=60.0, clock=time.monotonic, rng=None):
+        self.failure_threshold = failure_threshold
+        self.clock = clock
+        self.backoff = DecorrelatedJitter(base_delay, max_delay, rng)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._probing = False
+        self.failures = 0
+        self.retry_delay = 0.0
+        self.opened_until = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self.total_failures = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Dựng từ mục `circuit_breaker` của cấu hình; None nếu `enabled` là false"""
+        if not settings.get("enabled", True):
+            return None
+        options = {name: settings[name] for name in ("failure_threshold", "base_delay", "max_delay")
+                   if name in settings}
+        return cls(**options)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """True nếu được phép gọi; ở half-open chỉ cho một lời gọi thử tại một thời điểm"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self.clock() >= self.opened_until:
+                self._state = HALF_OPEN
+                self._probing = False
+                logger.info("Circuit breaker chuyển sang half-open, gửi một lời gọi thử")
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        """Như allow() nhưng ném CircuitOpenError khi bị từ chối"""
+        if not self.allow():
+            raise CircuitOpenError(self.retry_in())
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Kết nối Telegram đã hồi phục, circuit breaker đóng lại")
+            self._state = CLOSED
+            self._probing = False
+            self.failures = 0
+            self.retry_delay = 0.0
+            self.backoff.reset()
+
+    def release_probe(self):
+        """Kết thúc lượt thăm dò half-open mà không tính lỗi (lời gọi hỏng vì lỗi cục bộ, không phải
+        đường truyền): lời gọi sau được thăm dò lại, số lỗi liên tiếp không đổi"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.retry_delay = self.backoff.next()
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                    logger.warning(f"Circuit breaker mở sau {self.failures} lỗi liên tiếp, "
+                                   f"thử lại sau {self.retry_delay:.1f} giây")
+                self._state = OPEN
+                self._probing = False
+                self.opened_until = self.clock() + self.retry_delay
+
+    def retry_in(self):
+        """Số giây tới lần được thử lại (0 khi mạch đóng)"""
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0
+            return max(0.0, self.opened_until - self.clock())
+
+    def delay(self, default):
+        """Thời gian nghỉ trước lần poll tiếp theo: `default` khi kết nối tốt, backoff khi đang lỗi"""
+        with self._lock:
+            if self._state == OPEN:
+                return max(0.0, self.opened_until - self.clock())
+            return self.retry_delay if self.failures else default
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self.failures,
+                "total_failures": self.total_failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_in": round(max(0.0, self.opened_until - self.clock()), 1) if self._state != CLOSED else 0.0
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def shared_breaker(token, settings=None):
+    """Một CircuitBreaker cho mỗi token trong tiến trình (mọi client cùng token chung một đường truyền)"""
+    with _breakers_lock:
+        if token not in _breakers:
+            _breakers[token] = CircuitBreaker.from_settings(settings or {})
+        return _breakers[token]
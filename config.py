@@ -1,22 +1,163 @@
 import os
 import json
+import time
+import atexit
 import logging
+import tempfile
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from file_watcher import FileWatcher
+from keyword_matcher import KeywordMatcher
+from intent_rules import IntentClassifier, DEFAULT_INTENT_RULES
+from text_normalizer import normalize, normalize_accented
+from tfidf_fallback import TfidfFallback
+import json_codec
 
 logger = logging.getLogger(__name__)
 
+# Đánh dấu một khóa đã bị delete() nhưng chưa ghi xuống tệp
+_DELETED = object()
+
+# Bộ giới hạn tốc độ và circuit breaker được dùng chung theo token (shared_limiter,
+# shared_breaker) và giữ trạng thái qua các lần gửi: nạp lại nóng không dựng lại chúng
+RESTART_REQUIRED = ("platforms.telegram.rate_limit", "platforms.telegram.circuit_breaker")
+
+
+@dataclass(frozen=True, slots=True)
+class AppSettings:
+    name: str
+    log_level: str
+    check_interval: float
+
+
+@dataclass(frozen=True, slots=True)
+class TelegramSettings:
+    enabled: bool
+    token: str
+    check_interval: float
+    long_polling: bool
+    timeout: float
+    retry_attempts: int
+    retry_delay: float
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigSnapshot:
+    """Ảnh chụp bất biến của cấu hình, dùng cho các vòng lặp nóng thay vì Config.get"""
+    version: int
+    app: AppSettings
+    telegram: TelegramSettings
+    excluded_senders: frozenset
+    keyword_template_mapping: MappingProxyType
+    keyword_matcher: KeywordMatcher
+    intents: IntentClassifier
+    fallback: TfidfFallback
+
+    @classmethod
+    def from_dict(cls, config, version=0, previous=None):
+        app = config.get("app", {})
+        mapping = dict(config.get("keyword_template_mapping", {}))
+        # Tin nhắn gõ không dấu khớp không phân biệt dấu ("gia" khớp "giá"), tin nhắn có dấu
+        # giữ nguyên dấu ("gặp" không khớp "gấp"); tắt hẳn bằng matching.normalize = false
+        if config.get("matching", {}).get("normalize", True):
+            normalizer, accented = normalize, normalize_accented
+        else:
+            normalizer, accented = str.lower, None
+        # Chỉ biên dịch lại automaton khi mapping thực sự thay đổi
+        if (previous is not None and previous.keyword_template_mapping == mapping
+                and previous.keyword_matcher.normalizer is normalizer
+                and previous.keyword_matcher.accented is accented):
+            keyword_matcher = previous.keyword_matcher
+        else:
+            keyword_matcher = KeywordMatcher(mapping.items(), normalizer=normalizer, accented=accented)
+        telegram = config.get("platforms", {}).get("telegram", {})
+        credentials = config.get("credentials", {}).get("telegram", {})
+        return cls(
+            version=version,
+            app=AppSettings(
+                name=app.get("name", "Auto Responder"),
+                log_level=app.get("log_level", "INFO"),
+                check_interval=app.get("check_interval", 300)
+            ),
+            telegram=TelegramSettings(
+                enabled=telegram.get("enabled", False),
+                token=credentials.get("token", ""),
+                check_interval=telegram.get("check_interval", 30),
+                long_polling=telegram.get("long_polling", False),
+                timeout=telegram.get("timeout", 30),
+                retry_attempts=telegram.get("retry_attempts", 3),
+                retry_delay=telegram.get("retry_delay", 5)
+            ),
+            excluded_senders=frozenset(config.get("excluded_senders", [])),
+            keyword_template_mapping=MappingProxyType(mapping),
+            keyword_matcher=keyword_matcher,
+            intents=IntentClassifier.from_config(
+                config.get("intent_rules", DEFAULT_INTENT_RULES),
+                previous.intents if previous is not None else None,
+                normalizer,
+                config.get("matching", {}).get("fuzzy", {}),
+                accented
+            ),
+            fallback=TfidfFallback.from_config(
+                config.get("matching", {}).get("fallback", {}),
+                previous.fallback if previous is not None else None
+            )
+        )
+
+    def classify(self, text):
+        """Chọn template_id cho tin nhắn theo keyword_template_mapping (nguyên từ), rồi bộ dự phòng"""
+        return self.classify_batch((text,))[0]
+
+    def classify_batch(self, texts):
+        """Chọn template_id cho cả lô tin nhắn; None nếu không có luật nào khớp.
+
+        Bảng `intent_rules` (template *_offline) chỉ dành cho OfflineAutoResponder, dùng `intents`.
+        """
+        template_ids = [matched[1] if matched else None for matched in self.keyword_matcher.match_batch(texts)]
+        return self.fallback_batch(texts, template_ids)
+
+    def fallback_batch(self, texts, template_ids):
+        """Điền các vị trí None bằng bộ phân loại dự phòng TF-IDF (nếu được bật)"""
+        if self.fallback is None:
+            return template_ids
+        misses = [index for index, template_id in enumerate(template_ids) if template_id is None]
+        if misses:
+            guesses = self.fallback.classify_batch([texts[index] for index in misses])
+            for index, template_id in zip(misses, guesses):
+                template_ids[index] = template_id
+        return template_ids
+
 
 class Config:
-    def __init__(self, config_file="config.json"):
+    def __init__(self, config_file="config.json", write_behind=None, flush_interval=None, flush_max_dirty=None):
         self.config_file = config_file
         self.config = {}
+        self.snapshot = None
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._dirty = 0
+        # Khóa -> giá trị của các thay đổi chưa ghi, để áp lại lên tệp khi nạp lại nóng
+        self._dirty_keys = {}
+        self._flush_event = threading.Event()
+        self._flusher = None
+        self._watcher = None
+        self._own_stat = None
+        self.stats = {"sets": 0, "writes": 0, "writes_saved": 0}
+        self.reloads = {"reloads": 0, "errors": 0, "last_reload_ms": None}
         self.load_config()
+        persistence = self.get("app.persistence", {}) or {}
+        self.write_behind = persistence.get("write_behind", True) if write_behind is None else write_behind
+        self.flush_interval = persistence.get("flush_interval", 2.0) if flush_interval is None else flush_interval
+        self.flush_max_dirty = persistence.get("flush_max_dirty", 50) if flush_max_dirty is None else flush_max_dirty
+        if self.write_behind:
+            atexit.register(self.flush)
         logger.info("Config đã được khởi tạo")
 
     def load_config(self):
         try:
             if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as file:
-                    self.config = json.load(file)
+                self.config = json_codec.load_file(self.config_file)
                 logger.info(f"Đã tải cấu hình từ {self.config_file}")
             else:
                 self.config = self.create_default_config()
@@ -25,22 +166,173 @@ class Config:
         except Exception as e:
             logger.error(f"Lỗi khi tải cấu hình: {str(e)}")
             self.config = self.create_default_config()
+        self._refresh_snapshot()
+
+    def _refresh_snapshot(self):
+        # Dựng ảnh chụp mới rồi thay bằng một phép gán tham chiếu duy nhất
+        with self._lock:
+            version = self.snapshot.version + 1 if self.snapshot else 1
+            self.snapshot = ConfigSnapshot.from_dict(self.config, version, self.snapshot)
 
     def save_config(self):
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as file:
-                json.dump(self.config, file, ensure_ascii=False, indent=4)
+            with self._write_lock:
+                with self._lock:
+                    pending = self._dirty
+                    changes = dict(self._dirty_keys)
+                    data = json.dumps(self.config, ensure_ascii=False, indent=4)
+                self._atomic_write(data)
+                self._mark_clean(pending, changes)
+                self.stats["writes"] += 1
             logger.info(f"Đã lưu cấu hình vào {self.config_file}")
             return True
         except Exception as e:
             logger.error(f"Lỗi khi lưu cấu hình: {str(e)}")
             return False
 
+    def _atomic_write(self, data):
+        # Ghi ra tệp tạm cùng thư mục rồi đổi tên, để config.json không bao giờ bị ghi dở
+        directory = os.path.dirname(os.path.abspath(self.config_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.config_file)
+            st = os.stat(self.config_file)
+            self._own_stat = (st.st_mtime_ns, st.st_size)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def flush(self):
+        """Ghi ngay các thay đổi đang chờ (write-behind) xuống tệp, dùng khi tắt chương trình"""
+        try:
+            with self._write_lock:
+                with self._lock:
+                    if not self._dirty:
+                        return True
+                    pending = self._dirty
+                    changes = dict(self._dirty_keys)
+                    data = json.dumps(self.config, ensure_ascii=False, indent=4)
+                self._atomic_write(data)
+                self._mark_clean(pending, changes)
+                self.stats["writes"] += 1
+                self.stats["writes_saved"] += pending - 1
+            logger.debug(f"Đã gộp {pending} thay đổi vào một lần ghi {self.config_file}")
+            return True
+        except Exception as e:
+            # Các thay đổi vẫn được đánh dấu là chưa ghi; luồng ghi nền sẽ thử lại ở lượt sau
+            logger.error(f"Lỗi khi ghi cấu hình đang chờ: {str(e)}")
+            return False
+
+    def _mark_clean(self, written, changes):
+        # Chỉ gọi sau khi ghi thành công; thay đổi đến trong lúc đang ghi vẫn còn chờ lần sau
+        with self._lock:
+            self._dirty = max(0, self._dirty - written)
+            for key, value in changes.items():
+                if self._dirty_keys.get(key, _DELETED) is value:
+                    del self._dirty_keys[key]
+            if not self._dirty:
+                self._dirty_keys.clear()
+
+    @staticmethod
+    def _apply_change(config, key, value):
+        """Gán (hoặc xóa nếu value là _DELETED) khóa dạng "a.b.c" trong dict cấu hình"""
+        keys = key.split('.')
+        d = config
+        for k in keys[:-1]:
+            if value is _DELETED and not isinstance(d.get(k), dict):
+                return
+            if not isinstance(d.get(k), dict):
+                d[k] = {}
+            d = d[k]
+        if value is _DELETED:
+            d.pop(keys[-1], None)
+        else:
+            d[keys[-1]] = value
+
+    def start_watching(self, interval=None):
+        """Bật nạp lại nóng config.json theo `app.hot_reload`; trả về False nếu bị tắt"""
+        hot_reload = self.get("app.hot_reload", {}) or {}
+        if not hot_reload.get("enabled", True):
+            return False
+        if self._watcher is None:
+            interval = interval or hot_reload.get("interval", 1.0)
+            self._watcher = FileWatcher(self.config_file, self.reload, interval).start()
+        return True
+
+    def reload(self):
+        """Đọc lại config.json (ngoài luồng xử lý tin nhắn) rồi thay ảnh chụp bằng một phép gán"""
+        started = time.perf_counter()
+        try:
+            # Giữ khóa ghi để không nhầm lần ghi của chính tiến trình này là thay đổi từ bên ngoài
+            with self._write_lock:
+                st = os.stat(self.config_file)
+                if (st.st_mtime_ns, st.st_size) == self._own_stat:
+                    return False
+                config = json_codec.load_file(self.config_file)
+        except Exception as e:
+            self.reloads["errors"] += 1
+            logger.error(f"Lỗi khi nạp lại cấu hình, giữ nguyên phiên bản cũ: {str(e)}")
+            return False
+        with self._lock:
+            if self._dirty:
+                # Áp lại các thay đổi chưa ghi lên bản vừa đọc; lần ghi kế tiếp lưu cả hai
+                for key, value in self._dirty_keys.items():
+                    self._apply_change(config, key, value)
+                logger.info(f"Giữ {len(self._dirty_keys)} khóa chưa ghi khi nạp lại {self.config_file}")
+                self._flush_event.set()
+            changed = [key for key in RESTART_REQUIRED if self._lookup(self.config, key) != self._lookup(config, key)]
+            self.config = config
+            self._refresh_snapshot()
+        if changed:
+            logger.warning(f"Thay đổi {', '.join(changed)} chỉ có hiệu lực sau khi khởi động lại bot")
+        self.reloads["reloads"] += 1
+        self.reloads["last_reload_ms"] = (time.perf_counter() - started) * 1000
+        logger.info(f"Đã nạp lại cấu hình (phiên bản {self.snapshot.version}) trong {self.reloads['last_reload_ms']:.2f} ms")
+        return True
+
+    def reload_stats(self):
+        """Phiên bản hiện tại, số lần nạp lại (và lỗi) và độ trễ của lần nạp lại gần nhất"""
+        return {**self.reloads, "version": self.snapshot.version}
+
+    def persistence_stats(self):
+        with self._lock:
+            return {**self.stats, "pending": self._dirty}
+
+    def _persist(self):
+        if not self.write_behind:
+            return self.save_config()
+        with self._lock:
+            self._dirty += 1
+            self.stats["sets"] += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="config-flusher", daemon=True)
+                self._flusher.start()
+            if self._dirty >= self.flush_max_dirty:
+                self._flush_event.set()
+        return True
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
     def get(self, key, default=None):
+        return self._lookup(self.config, key, default)
+
+    @staticmethod
+    def _lookup(config, key, default=None):
+        """Giá trị của khóa dạng "a.b.c" trong dict cấu hình, hoặc `default`"""
         try:
-            keys = key.split('.')
-            value = self.config
-            for k in keys:
+            value = config
+            for k in key.split('.'):
                 value = value[k]
             return value
         except (KeyError, TypeError):
@@ -49,28 +341,37 @@ class Config:
     def set(self, key, value):
         try:
             keys = key.split('.')
-            d = self.config
-            for k in keys[:-1]:
-                d = d.setdefault(k, {})
-            d[keys[-1]] = value
-            self.save_config()
+            with self._lock:
+                d = self.config
+                for k in keys[:-1]:
+                    d = d.setdefault(k, {})
+                d[keys[-1]] = value
+                self._dirty_keys[key] = value
+            self._refresh_snapshot()
+            self._persist()
         except Exception as e:
             logger.error(f"Lỗi khi đặt giá trị cấu hình cho key '{key}': {e}")
 
     def delete(self, key):
         keys = key.split('.')
-        config = self.config
+        with self._lock:
+            config = self.config
+            
+            for i, k in enumerate(keys[:-1]):
+                if k not in config:
+                    logger.warning(f"Không thể xóa cấu hình không tồn tại: {key}")
+                    return False
+                config = config[k]
+            
+            found = keys[-1] in config
+            if found:
+                del config[keys[-1]]
+                self._dirty_keys[key] = _DELETED
         
-        for i, k in enumerate(keys[:-1]):
-            if k not in config:
-                logger.warning(f"Không thể xóa cấu hình không tồn tại: {key}")
-                return False
-            config = config[k]
-        
-        if keys[-1] in config:
-            del config[keys[-1]]
+        if found:
             logger.info(f"Đã xóa cấu hình: {key}")
-            return self.save_config()
+            self._refresh_snapshot()
+            return self._persist()
         
         logger.warning(f"Không thể xóa cấu hình không tồn tại: {key}")
         return False
@@ -82,7 +383,23 @@ class Config:
                 "version": "1.0.0",
                 "log_level": "INFO",
                 "check_interval": 300,
-                "auto_start": True
+                "auto_start": True,
+                "persistence": {
+                    "write_behind": True,
+                    "flush_interval": 2.0,
+                    "flush_max_dirty": 50
+                },
+                "hot_reload": {
+                    "enabled": True,
+                    "interval": 1.0
+                },
+                "engine": {
+                    "mode": "sync",
+                    "backend": "auto",
+                    "concurrency": 16,
+                    "queue_size": 1000,
+                    "poll_timeout": 30
+                }
             },
             "platforms": {
                 "email": {
@@ -92,8 +409,58 @@ class Config:
                 "telegram": {
                     "enabled": True,
                     "check_interval": 60,
+                    "long_polling": True,
+                    "timeout": 30,
+                    "limit": 100,
                     "connect_timeout": 10,
-                    "read_timeout": 30
+                    "read_timeout": 30,
+                    "http": {
+                        "pool_connections": 4,
+                        "pool_maxsize": 32,
+                        "connect_timeout": 5,
+                        "read_timeout": 10,
+                        "keep_alive": True
+                    },
+                    "rate_limit": {
+                        "enabled": True,
+                        "global_per_second": 30,
+                        "private_per_second": 1,
+                        "group_per_minute": 20,
+                        "idle_ttl": 600
+                    },
+                    "circuit_breaker": {
+                        "enabled": True,
+                        "failure_threshold": 5,
+                        "base_delay": 1,
+                        "max_delay": 60
+                    },
+                    "outbox": {
+                        "path": "outbox.db",
+                        "batch_size": 100,
+                        "max_attempts": 20,
+                        "synchronous": "FULL"
+                    },
+                    "prefetch": {
+                        "enabled": False,
+                        "queue_size": 2
+                    },
+                    "webhook": {
+                        "url": "",
+                        "secret_token": "",
+                        "workers": 4,
+                        "queue_size": 1000,
+                        "dedup_size": 10000,
+                        "inline_reply": True,
+                        "host": "0.0.0.0",
+                        "port": 5000,
+                        "server": {
+                            "mode": "threaded",
+                            "processes": 0,
+                            "threads": 16,
+                            "backlog": 1024,
+                            "shared_state": "webhook_state.db"
+                        }
+                    }
                 }
             },
             "credentials": {
@@ -116,5 +483,21 @@ class Config:
                 "vacation": "out_of_office",
                 "hello": "welcome",
                 "buy": "sales_inquiry"
+            },
+            "intent_rules": [dict(rule) for rule in DEFAULT_INTENT_RULES],
+            "matching": {
+                "normalize": True,
+                "fuzzy": {
+                    "enabled": False,
+                    "max_distance": 1,
+                    "min_length": 6,
+                    "dictionary": []
+                },
+                "fallback": {
+                    "enabled": False,
+                    "threshold": 0.35,
+                    "matrix_file": "tfidf_fallback.npy",
+                    "examples": {}
+                }
             }
         }
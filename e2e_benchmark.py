@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark đầu-cuối: chạy từng bot trong một tiến trình riêng với máy chủ Telegram giả lập
+
+Với mỗi bot và mỗi mức tải, script dựng một thư mục làm việc tạm (config.json,
+templates.json, cấu hình của simple/background responder), khởi động máy chủ giả
+(fake_telegram_server.py), chạy bot trỏ vào máy chủ đó qua TELEGRAM_API_BASE_URL,
+sinh tin nhắn với tốc độ cố định rồi đo:
+- số phản hồi mỗi giây (từ tin nhắn đầu tiên tới phản hồi cuối cùng),
+- độ trễ p50/p95/p99 từ lúc tin nhắn đến tới lúc bot trả lời chat đó,
+- thời gian CPU và bộ nhớ RSS đỉnh của tiến trình bot (cần os.wait4, tức Linux/macOS),
+- số lời gọi Bot API bot đã thực hiện (webhook-inline trả phản hồi trong HTTP response
+  nên bớt được một lời gọi sendMessage cho mỗi tin nhắn).
+
+Kết quả được ghi ra JSON để so sánh giữa các commit:
+    python e2e_benchmark.py --rates 10 30 --duration 10 --output e2e_results.json
+    python e2e_benchmark.py --bots improved offline --compare e2e_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+from fake_telegram_server import FakeTelegramServer, TrafficGenerator
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:E2E-BENCHMARK"
+
+# Lệnh chạy từng bot (trong thư mục làm việc tạm, PYTHONPATH trỏ về mã nguồn)
+BOTS = {
+    "improved": "from improved_bot import main; main()",
+    "offline": "from offline_auto_responder import main; main()",
+    "offline-async": "from offline_auto_responder import main; main()",
+    "simple": "from simple_auto_responder import SimpleAutoResponder; SimpleAutoResponder().run()",
+    "background": "from background_responder import BackgroundResponder; BackgroundResponder().run_daemon()",
+    "main": "from main import main; main()",
+    "main-async": "from main import main; main()",
+    "webhook": "import runpy; runpy.run_module('telegram_webhook', run_name='__main__')",
+    "webhook-inline": "import runpy; runpy.run_module('telegram_webhook', run_name='__main__')",
+}
+
+
+def prepare_workspace(directory, bot, rate_limit, port=None, server=None):
+    """Ghi cấu hình cho bot vào thư mục làm việc tạm (`server`: mục webhook.server ghi đè)"""
+    with open(os.path.join(REPO_DIR, "config.json"), encoding="utf-8") as file:
+        config = json.load(file)
+    config["credentials"]["telegram"]["token"] = TOKEN
+    # Máy chủ giả đánh số update từ 1: bỏ offset đã lưu của bot thật
+    config.setdefault("telegram", {})["last_update_id"] = 0
+    config["platforms"]["email"]["enabled"] = False
+    config["platforms"]["telegram"]["enabled"] = True
+    config["platforms"]["telegram"]["rate_limit"] = {**config["platforms"]["telegram"].get("rate_limit", {}),
+                                                     "enabled": rate_limit}
+    config["app"]["engine"]["mode"] = "async" if bot.endswith("-async") else "sync"
+    webhook = config["platforms"]["telegram"]["webhook"] = {**config["platforms"]["telegram"].get("webhook", {}),
+                                                            "host": "127.0.0.1", "port": port,
+                                                            "inline_reply": bot == "webhook-inline"}
+    if server:
+        webhook["server"] = {**webhook.get("server", {}), **server}
+    with open(os.path.join(directory, "config.json"), "w", encoding="utf-8") as file:
+        json.dump(config, file, ensure_ascii=False, indent=4)
+    shutil.copy(os.path.join(REPO_DIR, "templates.json"), directory)
+
+    # simple/background responder dùng tệp cấu hình riêng với khóa ở cấp gốc
+    common = {"telegram_token": TOKEN, "check_interval": 1, "rate_limit": {"enabled": rate_limit}}
+    with open(os.path.join(directory, "simple_config.json"), "w", encoding="utf-8") as file:
+        json.dump({**common, "messages": {"offline": "Chào {name}, mình đang offline.",
+                                          "online": "Chào {name}, mình sẽ trả lời ngay."}},
+                  file, ensure_ascii=False)
+    with open(os.path.join(directory, "background_config.json"), "w", encoding="utf-8") as file:
+        json.dump({**common, "enabled": True, "auto_offline_message": "Chào {name}, mình đang bận."},
+                  file, ensure_ascii=False)
+
+
+def stop_process(process, timeout=10.0):
+    """Dừng bot bằng Ctrl+C (để bot ghi trạng thái), rồi trả về (mã thoát, rusage hoặc None)"""
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + timeout
+    if hasattr(os, "wait4"):
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return process.returncode, usage
+            if time.monotonic() >= deadline:
+                process.kill()
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return process.returncode, usage
+            time.sleep(0.05)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return process.returncode, None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def port_open(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_for(condition, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def run_one(bot, rate, args):
+    """Chạy một bot ở một mức tải; trả về dict kết quả"""
+    count = max(1, int(rate * args.duration))
+    result = {"bot": bot, "rate": rate, "messages": count}
+    server = FakeTelegramServer(latency=args.latency, error_rate=args.error_rate,
+                                throttle_rate=args.throttle_rate, seed=1).start()
+    api = server.api
+    directory = tempfile.mkdtemp(prefix=f"e2e-{bot}-")
+    log_path = os.path.join(directory, "stderr.log")
+    webhook_port = free_port() if bot.startswith("webhook") else None
+    try:
+        prepare_workspace(directory, bot, args.rate_limit, webhook_port)
+        env = dict(os.environ, TELEGRAM_API_BASE_URL=server.base_url, PYTHONPATH=REPO_DIR,
+                   PYTHONUNBUFFERED="1")
+        with open(log_path, "wb") as stderr:
+            process = subprocess.Popen([sys.executable, "-c", BOTS[bot]], cwd=directory, env=env,
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+        # Bot polling sẵn sàng khi đã gọi getUpdates lần đầu; bot webhook khi cổng HTTP đã mở
+        if webhook_port is not None:
+            ready = lambda: port_open(webhook_port) or process.poll() is not None
+        else:
+            ready = lambda: api.counters["get_updates"] > 0 or process.poll() is not None
+        if not wait_for(ready, args.startup_timeout) or process.poll() is not None:
+            stop_process(process)
+            result["error"] = "bot không sẵn sàng (xem log)"
+            return result
+        if webhook_port is not None:
+            api.api_setWebhook({"url": f"http://127.0.0.1:{webhook_port}/webhook", "max_connections": 40})
+
+        started = time.monotonic()
+        generator = TrafficGenerator(api, rate, args.chats, count, seed=2, round_robin=True).start()
+        generator.join()
+        # Chờ bot trả lời hết, hoặc tới khi không có phản hồi mới trong `drain` giây
+        last_sent, last_change = -1, time.monotonic()
+        while api.counters["sent"] < count and time.monotonic() - last_change < args.drain:
+            if api.counters["sent"] != last_sent:
+                last_sent, last_change = api.counters["sent"], time.monotonic()
+            time.sleep(0.05)
+        exit_code, usage = stop_process(process)
+
+        stats = api.stats()
+        replied = stats.get("sent", 0)
+        active = (api.last_reply_at - api.first_injected_at) if replied and api.first_injected_at else None
+        result.update({
+            "replied": replied,
+            "messages_per_second": round(replied / active, 2) if active else 0.0,
+            "wall_seconds": round(time.monotonic() - started, 2),
+            "latency": stats["reply_latency"],
+            "throttled": stats.get("throttled", 0),
+            "server_errors": stats.get("server_errors", 0),
+            "get_updates_calls": stats.get("get_updates", 0),
+            "api_requests": stats.get("api_requests", 0),
+            "send_message_calls": stats.get("send_message_calls", 0),
+            "inline_replies": stats.get("inline_replies", 0),
+            "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3) if usage else None,
+            # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+            "peak_rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+            if usage else None,
+            "exit_code": exit_code
+        })
+        return result
+    finally:
+        server.stop()
+        if args.keep_logs:
+            result["workspace"] = directory
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_result(result, baseline=None):
+    if "error" in result:
+        print(f"  {result['bot']:<14} {result['rate']:>6} tin/giây  LỖI: {result['error']}")
+        return
+    latency = result["latency"]
+    line = (f"  {result['bot']:<14} {result['rate']:>6} tin/giây  "
+            f"{result['replied']:>5}/{result['messages']:<5} trả lời  {result['messages_per_second']:>7.1f} tin/giây  "
+            f"p50 {latency.get('p50_ms', 0):>7.1f} ms  p95 {latency.get('p95_ms', 0):>7.1f} ms  "
+            f"p99 {latency.get('p99_ms', 0):>7.1f} ms  CPU {result['cpu_seconds']} s  RSS {result['peak_rss_mb']} MB  "
+            f"sendMessage {result['send_message_calls']}")
+    if baseline and "error" not in baseline:
+        old_p95 = baseline["latency"].get("p95_ms")
+        line += f"  (trước: {baseline['messages_per_second']:.1f} tin/giây"
+        if old_p95 is not None:
+            line += f", p95 {old_p95:.1f} ms"
+        line += ")"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark đầu-cuối các bot với máy chủ Telegram giả lập")
+    parser.add_argument("--bots", nargs="*", default=list(BOTS), choices=list(BOTS), help="Các bot cần đo")
+    parser.add_argument("--rates", nargs="*", type=float, default=[10, 30, 60], help="Các mức tải (tin nhắn/giây)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Số giây sinh tin nhắn ở mỗi mức tải")
+    parser.add_argument("--chats", type=int, default=500, help="Số chat gửi tin (lần lượt từng chat)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Độ trễ của sendMessage trên máy chủ giả (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Xác suất sendMessage trả về 502")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Xác suất sendMessage trả về 429")
+    parser.add_argument("--no-rate-limit", dest="rate_limit", action="store_false",
+                        help="Tắt bộ giới hạn 30 tin/giây của bot để đo giới hạn của chính bot")
+    parser.add_argument("--drain", type=float, default=5.0, help="Dừng chờ khi không có phản hồi mới sau số giây này")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--keep-logs", action="store_true", help="Giữ thư mục làm việc (log, trạng thái) của bot")
+    parser.add_argument("--output", default="e2e_results.json", help="Tệp JSON kết quả")
+    parser.add_argument("--compare", help="Tệp JSON kết quả của lần chạy trước để so sánh")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = {(item["bot"], item["rate"]): item for item in json.load(file)["results"]}
+
+    report = {
+        "revision": git_revision(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {name: getattr(args, name) for name in
+                     ("duration", "chats", "latency", "error_rate", "throttle_rate", "rate_limit")},
+        "results": []
+    }
+    print(f"e2e: {len(args.bots)} bot x {len(args.rates)} mức tải, {args.duration:g} giây mỗi lần, "
+          f"sendMessage {args.latency * 1000:.0f} ms")
+    for bot in args.bots:
+        for rate in args.rates:
+            result = run_one(bot, rate, args)
+            report["results"].append(result)
+            print_result(result, baseline.get((bot, rate)))
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Máy chủ Telegram Bot API giả lập chạy cục bộ, dùng để đo tải mà không cần Telegram thật
+
+Hỗ trợ getMe, getUpdates (long-poll và offset như Telegram), sendMessage (độ trễ cấu hình
+được, chèn lỗi 429/5xx, tùy chọn áp giới hạn 30 tin/giây và 1 tin/giây mỗi chat),
+setWebhook/deleteWebhook/getWebhookInfo. Khi đã đặt webhook, update được POST tới URL đó
+(phản hồi webhook dạng {"method": "sendMessage", ...} cũng được tính là một lần gửi).
+
+TrafficGenerator sinh tin nhắn tổng hợp với tốc độ và số chat cấu hình được; máy chủ đo
+độ trễ từ lúc tin nhắn vào hàng đợi tới lúc bot trả lời chat đó.
+
+Chạy độc lập:
+    python fake_telegram_server.py --port 8081 --rate 50 --chats 100 --latency 0.02
+
+rồi trỏ bot vào máy chủ giả bằng `platforms.telegram.http.base_url` (hoặc `http.base_url`
+với simple/background responder), hoặc biến môi trường TELEGRAM_API_BASE_URL:
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 python main.py
+Thống kê: GET /_fake/stats
+"""
+
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import deque, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+
+import json_codec
+from polling import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_TEXTS = (
+    "Chào shop ạ",
+    "shop ơi sản phẩm này giá bao nhiêu vậy",
+    "Cho em hỏi ship về Đà Nẵng mất mấy ngày?",
+    "mình muốn đặt hàng 2 cái size M",
+    "Gấp lắm, đơn hàng của mình chưa tới mà mai phải dùng rồi",
+    "Xin chào, bên bạn có bán sỉ không?",
+    "ok cảm ơn bạn nhiều nhé",
+    "Hello, is this still available?",
+    "How much does the premium plan cost per month?",
+    "URGENT: my payment went through twice, please refund",
+)
+
+_PATH = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)$")
+
+
+class FakeTelegramAPI:
+    """Trạng thái của bot giả: hàng đợi update, tin nhắn đã gửi, webhook và thống kê.
+
+    `error_rate`/`throttle_rate` là xác suất sendMessage trả về 502/429;
+    `enforce_limits` trả 429 khi bot vượt 30 tin/giây hoặc 1 tin/giây cho một chat.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 enforce_limits=False, token=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.enforce_limits = enforce_limits
+        self.token = token
+        self.rng = random.Random(seed)
+        self._cond = threading.Condition()
+        self._updates = deque()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._delivered_upto = 0
+        # Thời điểm vào hàng đợi của các tin nhắn chưa được trả lời, theo từng chat (FIFO)
+        self._waiting = defaultdict(deque)
+        self._sent_at = deque()
+        self._chat_sent_at = {}
+        self.webhook = None
+        self._webhook_session = None
+        self.latency_stats = LatencyStats(window=100000)
+        self.counters = defaultdict(int)
+        self.started = time.monotonic()
+        self.first_injected_at = None
+        self.last_reply_at = None
+
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    # --- Sinh tin nhắn ---
+
+    def inject(self, chat_id, text, user_id=None):
+        """Thêm một tin nhắn đến; trả về update_id"""
+        now = time.time()
+        user_id = user_id or abs(chat_id)
+        with self._cond:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self._updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(now),
+                    "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": f"Khách {user_id}",
+                             "username": f"khach{user_id}"},
+                    "text": text
+                }
+            })
+            self._waiting[chat_id].append(time.monotonic())
+            if self.first_injected_at is None:
+                self.first_injected_at = self._waiting[chat_id][-1]
+            self.counters["injected"] += 1
+            self._cond.notify_all()
+        return update_id
+
+    # --- Bot API ---
+
+    def dispatch(self, method, params):
+        """Xử lý một lời gọi; trả về (mã HTTP, nội dung JSON)"""
+        handler = getattr(self, f"api_{method}", None)
+        self._count("api_requests")
+        if handler is None:
+            return _error(404, "Not Found: method not found")
+        return handler(params)
+
+    def api_getMe(self, params):
+        return _ok({"id": 1000000, "is_bot": True, "first_name": "Fake Bot", "username": "fake_test_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False})
+
+    def api_getUpdates(self, params):
+        offset = _int(params.get("offset"), 0)
+        limit = min(max(_int(params.get("limit"), 100), 1), 100)
+        deadline = time.monotonic() + min(_int(params.get("timeout"), 0), 50)
+        with self._cond:
+            if self.webhook is not None:
+                return _error(409, "Conflict: can't use getUpdates method while webhook is active")
+            self.counters["get_updates"] += 1
+            # offset xác nhận mọi update có update_id nhỏ hơn, như Telegram
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and self.webhook is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [update for _, update in zip(range(limit), self._updates)]
+            if batch and batch[-1]["update_id"] > self._delivered_upto:
+                # Chỉ đếm update được trả về lần đầu (lần poll sau có thể trả lại update chưa xác nhận)
+                self.counters["delivered"] += sum(1 for update in batch if update["update_id"] > self._delivered_upto)
+                self._delivered_upto = batch[-1]["update_id"]
+        return _ok(batch)
+
+    def api_sendMessage(self, params):
+        self._count("send_message_calls")
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        chat_id = _chat_id(params.get("chat_id"))
+        text = params.get("text")
+        if chat_id is None:
+            self._count("rejected")
+            return _error(400, "Bad Request: chat_id is empty")
+        if not text:
+            self._count("rejected")
+            return _error(400, "Bad Request: message text is empty")
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            self._count("server_errors")
+            return _error(502, "Bad Gateway")
+        if roll < self.error_rate + self.throttle_rate or self._over_limit(chat_id):
+            self._count("throttled")
+            return _error(429, f"Too Many Requests: retry after {self.retry_after}",
+                          {"retry_after": self.retry_after})
+        return _ok(self._record_reply(chat_id, text))
+
+    def _over_limit(self, chat_id):
+        if not self.enforce_limits:
+            return False
+        now = time.monotonic()
+        with self._cond:
+            while self._sent_at and now - self._sent_at[0] >= 1.0:
+                self._sent_at.popleft()
+            last = self._chat_sent_at.get(chat_id)
+            if len(self._sent_at) >= 30 or (last is not None and now - last < 1.0):
+                return True
+            self._sent_at.append(now)
+            self._chat_sent_at[chat_id] = now
+        return False
+
+    def _record_reply(self, chat_id, text):
+        now = time.monotonic()
+        with self._cond:
+            waiting = self._waiting.get(chat_id)
+            if waiting:
+                self.latency_stats.record(now - waiting.popleft())
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.counters["sent"] += 1
+            self.last_reply_at = now
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id}, "text": text}
+
+    def api_setWebhook(self, params):
+        url = params.get("url") or None
+        with self._cond:
+            self.webhook = {"url": url, "secret_token": params.get("secret_token"),
+                            "max_connections": _int(params.get("max_connections"), 40)} if url else None
+            self._cond.notify_all()
+        if url:
+            self._start_webhook_delivery()
+        return _ok(True)
+
+    def api_deleteWebhook(self, params):
+        return self.api_setWebhook({})
+
+    def api_getWebhookInfo(self, params):
+        with self._cond:
+            return _ok({"url": self.webhook["url"] if self.webhook else "",
+                        "pending_update_count": len(self._updates)})
+
+    # --- Webhook ---
+
+    def _start_webhook_delivery(self):
+        if self._webhook_session is not None:
+            return
+        self._webhook_session = requests.Session()
+        for index in range(self.webhook["max_connections"]):
+            threading.Thread(target=self._webhook_worker, name=f"fake-webhook-{index}", daemon=True).start()
+
+    def _webhook_worker(self):
+        while True:
+            with self._cond:
+                while self.webhook is not None and not self._updates:
+                    self._cond.wait()
+                if self.webhook is None:
+                    return
+                update = self._updates.popleft()
+                webhook = self.webhook
+            headers = {"Content-Type": "application/json"}
+            if webhook["secret_token"]:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = webhook["secret_token"]
+            try:
+                response = self._webhook_session.post(
+                    webhook["url"], data=json_codec.dumps(update).encode("utf-8"), headers=headers, timeout=10)
+                accepted = response.status_code < 300
+            except requests.RequestException:
+                accepted = False
+            if not accepted:
+                # Telegram gửi lại update cho tới khi webhook trả về 2xx
+                self._count("webhook_failures")
+                with self._cond:
+                    self._updates.appendleft(update)
+                time.sleep(0.1)
+                continue
+            self._count("delivered")
+            self._count("webhook_posts")
+            self._inline_reply(response)
+
+    def _inline_reply(self, response):
+        # Phản hồi webhook có thể chứa sẵn một lời gọi API (ví dụ sendMessage)
+        if not response.content:
+            return
+        try:
+            body = json_codec.loads(response.content)
+        except ValueError:
+            return
+        if isinstance(body, dict) and body.get("method") == "sendMessage":
+            self._count("inline_replies")
+            chat_id = _chat_id(body.get("chat_id"))
+            if chat_id is not None and body.get("text"):
+                self._record_reply(chat_id, body["text"])
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        with self._cond:
+            counters = dict(self.counters)
+            pending = len(self._updates)
+        return {
+            **counters,
+            "pending_updates": pending,
+            "sent_per_second": round(counters.get("sent", 0) / elapsed, 1) if elapsed else 0.0,
+            "reply_latency": self.latency_stats.summary()
+        }
+
+
+def _ok(result):
+    return 200, {"ok": True, "result": result}
+
+
+def _error(code, description, parameters=None):
+    body = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        body["parameters"] = parameters
+    return code, body
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _chat_id(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.lstrip("-").isdigit():
+        return int(value)
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    api = None
+
+    def _params(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            body = self.rfile.read(length)
+            if "json" in self.headers.get("Content-Type", ""):
+                params.update(json_codec.loads(body))
+            else:
+                params.update(parse_qsl(body.decode("utf-8")))
+        return url.path, params
+
+    def _send(self, status, body):
+        data = json_codec.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Bot đã đóng kết nối (ví dụ bị dừng giữa lúc long-poll)
+            self.close_connection = True
+
+    def _handle(self):
+        try:
+            path, params = self._params()
+        except ValueError:
+            return self._send(*_error(400, "Bad Request: can't parse request body"))
+        if path == "/_fake/stats":
+            return self._send(200, self.api.stats())
+        match = _PATH.match(path)
+        if match is None:
+            return self._send(*_error(404, "Not Found"))
+        if self.api.token is not None and match.group("token") != self.api.token:
+            return self._send(*_error(401, "Unauthorized"))
+        self._send(*self.api.dispatch(match.group("method"), params))
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTelegramServer:
+    """Máy chủ HTTP đa luồng phục vụ một FakeTelegramAPI; `port=0` để hệ điều hành chọn cổng"""
+
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        self.api = FakeTelegramAPI(**options)
+        handler = type("FakeTelegramHandler", (_Handler,), {"api": self.api})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        logger.info(f"Máy chủ Telegram giả đang chạy tại {self.base_url}")
+        return self
+
+    def stop(self):
+        with self.api._cond:
+            self.api.webhook = None
+            self.api._cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TrafficGenerator:
+    """Luồng nền sinh `rate` tin nhắn/giây từ `chats` chat (một phần là nhóm theo `group_ratio`).
+
+    Chat được chọn ngẫu nhiên, hoặc lần lượt nếu `round_robin` (mỗi chat nhận đều số tin).
+    Dừng sau `count` tin nhắn nếu có, hoặc khi gọi stop().
+    """
+
+    def __init__(self, api, rate=10.0, chats=10, count=None, group_ratio=0.0, texts=SAMPLE_TEXTS, seed=None,
+                 round_robin=False):
+        self.api = api
+        self.rate = rate
+        self.count = count
+        self.round_robin = round_robin
+        self.texts = texts
+        self.rng = random.Random(seed)
+        groups = int(chats * group_ratio)
+        self.chats = [-(100000 + i) for i in range(groups)] + [200000 + i for i in range(chats - groups)]
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-traffic", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        started = time.monotonic()
+        while not self._stop.is_set() and (self.count is None or self.sent < self.count):
+            # Giữ đúng tốc độ trung bình: bù lại thời gian đã trễ thay vì ngủ cố định
+            wait = started + self.sent / self.rate - time.monotonic()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            chat_id = self.chats[self.sent % len(self.chats)] if self.round_robin else self.rng.choice(self.chats)
+            user_id = 300000 + self.rng.randrange(1000) if chat_id < 0 else chat_id
+            self.api.inject(chat_id, self.rng.choice(self.texts), user_id)
+            self.sent += 1
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self.join(1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Máy chủ Telegram Bot API giả lập để đo tải")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", help="Chỉ chấp nhận token này (mặc định: mọi token)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Số tin nhắn sinh ra mỗi giây (0: không sinh)")
+    parser.add_argument("--chats", type=int, default=10, help="Số chat gửi tin")
+    parser.add_argument("--group-ratio", type=float, default=0.0, help="Tỉ lệ chat là nhóm")
+    parser.add_argument("--count", type=int, help="Dừng sinh tin sau số tin nhắn này")
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ của sendMessage (giây)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Độ trễ ngẫu nhiên thêm tối đa (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Xác suất sendMessage trả về 502")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Xác suất sendMessage trả về 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after của lỗi 429")
+    parser.add_argument("--enforce-limits", action="store_true", help="Trả 429 khi vượt 30 tin/giây hoặc 1 tin/giây mỗi chat")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="In thống kê sau mỗi số giây này")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = FakeTelegramServer(
+        args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after, enforce_limits=args.enforce_limits,
+        token=args.token
+    ).start()
+    generator = None
+    if args.rate > 0:
+        generator = TrafficGenerator(server.api, args.rate, args.chats, args.count, args.group_ratio).start()
+    print(f"Đặt TELEGRAM_API_BASE_URL={server.base_url} để bot dùng máy chủ giả")
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            logger.info(f"Thống kê: {server.api.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if generator is not None:
+            generator.stop()
+        server.stop()
+        print(json_codec.dumps(server.api.stats(), pretty=True))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
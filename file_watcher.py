@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module theo dõi thay đổi của tệp cấu hình để nạp lại khi đang chạy
+"""
+
+import os
+import logging
+import threading
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher:
+    """Gọi `callback` khi tệp thay đổi, dùng inotify nếu có, ngược lại thăm dò mtime"""
+
+    def __init__(self, path, callback, interval=1.0):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_stat = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def start(self):
+        if self._thread is None:
+            target = self._run_inotify if INotify is not None else self._run_polling
+            self._thread = threading.Thread(target=target, name=f"watch-{os.path.basename(self.path)}", daemon=True)
+            self._thread.start()
+            logger.info(f"Đang theo dõi thay đổi của {self.path}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _check(self):
+        current = self._stat()
+        if current is not None and current != self._last_stat:
+            self._last_stat = current
+            try:
+                self.callback()
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý thay đổi của {self.path}: {e}")
+
+    def _run_polling(self):
+        while not self._stop.wait(self.interval):
+            self._check()
+
+    def _run_inotify(self):
+        # Theo dõi thư mục vì tệp được thay thế bằng os.replace (inode mới)
+        try:
+            inotify = INotify()
+            inotify.add_watch(os.path.dirname(self.path), flags.CLOSE_WRITE | flags.MOVED_TO)
+        except OSError as e:
+            logger.warning(f"Không dùng được inotify ({e}), chuyển sang thăm dò mtime")
+            self._run_polling()
+            return
+        name = os.path.basename(self.path)
+        with inotify:
+            while not self._stop.is_set():
+                events = inotify.read(timeout=int(self.interval * 1000))
+                if any(event.name == name for event in events):
+                    self._check()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module so khớp từ khóa chịu lỗi chính tả bằng chỉ mục trigram ký tự
+
+Chỉ từ khóa dài (mặc định từ 6 ký tự) mới được so khớp gần đúng: sửa một ký tự của từ
+4-5 ký tự thường ra một từ có nghĩa khác ("lost" -> "cost", "giua" -> "giup"). Đoạn văn
+bản mà mọi từ đều là từ có thật (COMMON_WORDS, từ của các từ khóa, `dictionary`) cũng
+không bị so khớp gần đúng, vì đó không phải lỗi gõ ("mat hang" không phải "dat hang").
+"""
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+
+# Từ thông dụng (đã bỏ dấu như text_normalizer.normalize) không bao giờ bị coi là lỗi gõ
+COMMON_WORDS = frozenset("""
+a ai anh ba ban bao bay be ben bi biet binh bo boi bon bu buoi ca cac cai cam can cang cao cap cau cha chac
+chan chang chao chau che chi chieu chinh cho chon chu chua chung chuyen co con cu cua cung cuoi da dai dang
+danh dao dat dau day de den deu di dia dien dieu dinh do doi don dong du dua dung duoc duong em gan gap ghe
+gi gia giay gio giua giup gui hai hang hay he hen het hieu hoc hoi hom hon hop hu huong khac khach khi khoe
+khong khu kia kiem la lai lam lan lau le lien lo loi lon luc luon ly ma mai man mang mat may me meo moi mon
+mot mua muon nam nao nay ne nen nghi ngay nghe ngoai ngu nguoi nha nhan nhanh nhat nhe nhieu nho nhu nhung
+noi nua o oi on ong phai phan phi phong qua quan rang rat roi ruoi sac sang sao sau se so song sua sung ta
+tai tam tan tao tat theo thi thoi thu thuc thuong tien tim tin to toi tot tra tram tren tri trong truoc tu
+tuan tuoi tuong uh va van vao ve vi viec vien vo voi vua xa xem xin xong
+about after again all also am an and any are as ask at back be been before but by call can card case come
+could day did do does done down each even find fine first for from get give go good got had has have he
+her here him his how if in into is it its just know last late let like long look lost made make many may me
+might more most much must my need new no not now of off ok okay on one only or other our out over own
+please put said same say see send she should so some still such sure take than thank thanks that the their
+them then there these they thing think this those time to today too two up us use very want was way we
+well were what when where which while who why will with work would yes yet you your
+""".split())
+
+
+def trigrams(text):
+    """Tập trigram ký tự của chuỗi, có đệm khoảng trắng hai đầu"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(first, second, limit):
+    """Khoảng cách Levenshtein nếu <= limit, ngược lại trả về limit + 1 (dừng sớm)"""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        smallest = i
+        for j, other in enumerate(second, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            current.append(cost)
+            smallest = min(smallest, cost)
+        if smallest > limit:
+            return limit + 1
+        previous = current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class TrigramIndex:
+    """Chỉ mục ngược trigram -> từ khóa để tìm từ khóa gần đúng trong tin nhắn.
+
+    Chỉ những từ khóa có chung trigram với đoạn văn bản mới được xét (không duyệt
+    toàn bộ từ điển), sau đó được kiểm tra lại bằng Levenshtein có giới hạn.
+    Từ khóa ngắn hơn `min_length` chỉ khớp chính xác (khoảng cách 0) vì sửa một ký tự
+    đã thành từ khác. Đoạn văn bản gồm toàn từ đã biết (COMMON_WORDS, `dictionary` và
+    từ của các từ khóa) không được so khớp gần đúng.
+    `normalizer` giống KeywordMatcher (mặc định: str.lower).
+    """
+
+    def __init__(self, entries, max_distance=1, min_length=6, normalizer=None, dictionary=()):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.normalizer = normalizer or str.lower
+        self.known = set(COMMON_WORDS)
+        for word in dictionary:
+            self.known.update(_TOKEN.findall(self.normalizer(word)))
+        self.keys = []
+        self.values = []
+        self.grams = []
+        self.by_length = {}
+        self.postings = {}  # (trigram, độ dài từ khóa) -> danh sách chỉ mục từ khóa
+        self.max_words = 1
+        seen = set()
+        for keyword, value in entries:
+            key = " ".join(_TOKEN.findall(self.normalizer(keyword)))
+            # Từ của mọi từ khóa (kể cả từ khóa ngắn) là từ có thật, không phải lỗi gõ
+            self.known.update(key.split())
+            if len(key) < min_length or key in seen:
+                continue
+            seen.add(key)
+            index = len(self.keys)
+            grams = trigrams(key)
+            self.keys.append(key)
+            self.values.append((keyword, value))
+            self.grams.append(frozenset(grams))
+            self.by_length.setdefault(len(key), []).append(index)
+            for gram in grams:
+                self.postings.setdefault((gram, len(key)), []).append(index)
+            self.max_words = max(self.max_words, key.count(" ") + 1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, window):
+        """Chỉ mục các từ khóa có thể nằm trong khoảng max_distance của `window`.
+
+        Mỗi lỗi sửa/thêm/xóa làm mất tối đa 3 trigram, nên từ khóa khớp phải chứa ít
+        nhất một trong 3k+1 trigram bất kỳ của đoạn văn bản: chỉ cần duyệt danh sách
+        của 3k+1 trigram hiếm nhất thay vì mọi trigram phổ biến. Danh sách được chia
+        theo độ dài từ khóa nên chỉ các độ dài trong khoảng ±k được xét.
+        """
+        lengths = range(len(window) - self.max_distance, len(window) + self.max_distance + 1)
+        window_grams = trigrams(window)
+        if len(window_grams) <= 3 * self.max_distance:
+            # Đoạn quá ngắn có thể mất hết trigram: xét mọi từ khóa cùng khoảng độ dài
+            return [index for length in lengths for index in self.by_length.get(length, ())]
+        postings = self.postings
+        lists = []
+        for gram in window_grams:
+            found = [postings[(gram, length)] for length in lengths if (gram, length) in postings]
+            lists.append((sum(map(len, found)), found))
+        lists.sort(key=lambda item: item[0])
+        candidates = set()
+        for _, found in lists[:3 * self.max_distance + 1]:
+            for indexes in found:
+                candidates.update(indexes)
+        # Lọc tiếp theo số trigram chung trước khi tính Levenshtein (đắt hơn nhiều)
+        needed = len(window_grams) - 3 * self.max_distance
+        return [index for index in candidates if len(window_grams & self.grams[index]) >= needed]
+
+    def match(self, text):
+        """Trả về (keyword, value, distance) của từ khóa gần đúng có độ ưu tiên cao nhất, hoặc None"""
+        if not self.keys or not text:
+            return None
+        words = _TOKEN.findall(self.normalizer(text))
+        known = [word in self.known for word in words]
+        best = None
+        for size in range(1, self.max_words + 1):
+            for start in range(len(words) - size + 1):
+                if all(known[start:start + size]):
+                    continue
+                window = " ".join(words[start:start + size])
+                if len(window) < self.min_length - self.max_distance:
+                    continue
+                for index in self._candidates(window):
+                    if best is not None and index >= best[0]:
+                        continue
+                    distance = bounded_levenshtein(window, self.keys[index], self.max_distance)
+                    if distance <= self.max_distance:
+                        best = (index, distance)
+        if best is None:
+            return None
+        return (*self.values[best[0]], best[1])
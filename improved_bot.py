@@ -5,7 +5,6 @@
 Bot Telegram cải tiến với xử lý lỗi kết nối tốt hơn
 """
 
-import json
 import time
 import logging
 import requests
@@ -13,6 +12,13 @@ import urllib3
 from datetime import datetime
 from response_templates import ResponseTemplates
 from config import Config
+from text_normalizer import cache_stats as normalizer_cache_stats
+from checkpoint import OffsetCheckpoint
+from polling import PollingStrategy
+from telegram_client import TelegramAPIError, shared_client, http_options
+from circuit_breaker import CircuitOpenError, DecorrelatedJitter, is_transport_error, retry_after
+from outbox import Outbox
+from prefetch import PrefetchPoller
 
 # Tắt cảnh báo SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -34,157 +40,174 @@ class ImprovedTelegramBot:
     def __init__(self):
         self.config = Config()
         self.templates = ResponseTemplates()
+        if self.config.start_watching():
+            self.templates.start_watching(self.config.get("app.hot_reload.interval", 1.0))
         self.token = self.config.get("credentials.telegram.token")
-        self.last_update_id = self.config.get("telegram.last_update_id", 0)
-        self.session = requests.Session()
-        
-        # Cấu hình session
-        self.session.headers.update({
-            'User-Agent': 'TelegramBot/2.0',
-            'Connection': 'keep-alive'
-        })
+        self.checkpoint = OffsetCheckpoint(
+            self.config.get("telegram.checkpoint_file", "telegram_offset.log"),
+            initial=self.config.get("telegram.last_update_id", 0)
+        )
+        self.last_update_id = self.checkpoint.last
+        self.polling = PollingStrategy.from_settings(self.config.get("platforms.telegram", {}), short_interval=2)
         
-        # Cấu hình adapter với retry
-        adapter = requests.adapters.HTTPAdapter(
-            max_retries=urllib3.util.Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[500, 502, 503, 504]
-            )
+        # Client dùng chung với pool kết nối keep-alive, thử lại lỗi 5xx
+        self.client = shared_client(
+            self.token,
+            verify=False,  # Tạm thời bỏ qua SSL verification
+            retries=3,
+            backoff_factor=1,
+            user_agent='TelegramBot/2.0',
+            rate_limit=self.config.get("platforms.telegram.rate_limit", {}),
+            circuit_breaker=self.config.get("platforms.telegram.circuit_breaker", {}),
+            **http_options(self.config.get("platforms.telegram.http", {}))
+        )
+        # Phản hồi được ghi xuống outbox trước khi commit offset, gửi lại được sau khi khởi động lại
+        self.outbox = Outbox.from_settings(self.config.get("platforms.telegram.outbox", {}))
+        # Tùy chọn: luồng nền long-poll tiếp trong lúc luồng chính xử lý lô hiện tại
+        self.prefetcher = PrefetchPoller.from_settings(
+            self.config.get("platforms.telegram.prefetch", {}),
+            self.fetch_updates,
+            self.last_update_id + 1,
+            idle_delay=self.poll_delay
         )
-        self.session.mount('https://', adapter)
         
         logger.info("ImprovedTelegramBot đã được khởi tạo")
     
     def get_bot_info(self):
         """Lấy thông tin bot"""
         try:
-            url = f"https://api.telegram.org/bot{self.token}/getMe"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('ok'):
-                return data.get('result')
-            return None
+            return self.client.get_me()
         except Exception as e:
             logger.error(f"Lỗi khi lấy thông tin bot: {e}")
             return None
     
     def get_updates_simple(self):
         """Lấy updates với phương pháp đơn giản hơn"""
+        updates = self.fetch_updates(self.last_update_id + 1)
+        return self.parse_updates(updates, self.polling.polled_at)
+    
+    def fetch_updates(self, offset):
+        """Gọi getUpdates một lần; trả về danh sách update thô (rỗng khi lỗi)"""
         try:
-            url = f"https://api.telegram.org/bot{self.token}/getUpdates"
-            params = {
-                "offset": self.last_update_id + 1,
-                "limit": 10,
-                "timeout": 0  # Không dùng long polling
-            }
-            
-            logger.debug(f"Đang lấy updates từ offset {self.last_update_id + 1}")
-            
-            response = self.session.get(
-                url, 
-                params=params, 
-                timeout=15,
-                verify=False  # Tạm thời bỏ qua SSL verification
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            if not data.get('ok'):
-                logger.error(f"Telegram API error: {data.get('description')}")
-                return []
+            logger.debug(f"Đang lấy updates từ offset {offset}")
             
-            updates = data.get('result', [])
-            messages = []
-            
-            for update in updates:
-                # Cập nhật last_update_id
-                self.last_update_id = update['update_id']
-                self.config.set("telegram.last_update_id", self.last_update_id)
-                
-                if 'message' in update and 'text' in update['message']:
-                    message = update['message']
-                    messages.append({
-                        "platform": "telegram",
-                        "chat_id": message["chat"]["id"],
-                        "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
-                        "content": message.get("text", ""),
-                        "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
-                        "message_id": message["message_id"]
-                    })
-            
-            if messages:
-                logger.info(f"Nhận được {len(messages)} tin nhắn mới")
-            
-            return messages
+            # Long-polling (timeout phía server, limit=100), tự chuyển short-polling khi mạng kém;
+            # còn phản hồi bị hoãn (429) thì không long-poll quá lúc phải gửi lại
+            updates = self.client.get_updates(offset=offset, **self.polling.params(self.outbox.retry_in()))
+            self.polling.record_success(len(updates))
+            return updates
             
+        except CircuitOpenError as e:
+            logger.debug(f"Bỏ qua lần lấy updates: {e}")
+            return []
+        except TelegramAPIError as e:
+            self.polling.record_failure()
+            logger.error(f"Telegram API error: {e.description}")
+            return []
         except requests.exceptions.Timeout:
+            self.polling.record_failure()
             logger.warning("Timeout khi lấy updates - sẽ thử lại")
             return []
         except requests.exceptions.ConnectionError as e:
+            self.polling.record_failure()
             logger.warning(f"Lỗi kết nối: {e} - sẽ thử lại")
             return []
         except Exception as e:
+            self.polling.record_failure()
             logger.error(f"Lỗi không mong muốn: {e}")
             return []
     
-    def send_message(self, chat_id, text):
-        """Gửi tin nhắn"""
-        try:
-            url = f"https://api.telegram.org/bot{self.token}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            
-            response = self.session.post(
-                url, 
-                json=data, 
-                timeout=10,
-                verify=False
-            )
-            response.raise_for_status()
+    def parse_updates(self, updates, polled_at=None):
+        """Chuyển update thô thành tin nhắn và cập nhật last_update_id (chỉ commit sau khi xử lý xong lô).
+
+        `polled_at` là thời điểm (Unix) lô được poll về, gắn vào từng tin nhắn để đo độ trễ.
+        """
+        messages = []
+        
+        for update in updates:
+            self.last_update_id = update['update_id']
             
-            result = response.json()
-            if result.get('ok'):
-                logger.info(f"Đã gửi tin nhắn thành công đến {chat_id}")
-                return True
-            else:
-                logger.error(f"Lỗi khi gửi tin nhắn: {result.get('description')}")
-                return False
-                
+            if 'message' in update and 'text' in update['message']:
+                message = update['message']
+                messages.append({
+                    "platform": "telegram",
+                    "chat_id": message["chat"]["id"],
+                    "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
+                    "content": message.get("text", ""),
+                    "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
+                    "date": message["date"],
+                    "message_id": message["message_id"],
+                    "polled_at": polled_at
+                })
+        
+        if messages:
+            logger.info(f"Nhận được {len(messages)} tin nhắn mới")
+        
+        return messages
+    
+    def next_messages(self):
+        """Lô tin nhắn kế tiếp: từ luồng prefetch nếu đã bật, ngược lại gọi getUpdates ngay"""
+        if self.prefetcher is None:
+            return self.get_updates_simple()
+        updates, polled_at = self.prefetcher.get(timeout=1.0) or ([], None)
+        return self.parse_updates(updates, polled_at)
+    
+    def send_message(self, chat_id, text, item=None):
+        """Gửi tin nhắn: True nếu gửi được, False nếu bị từ chối, None nếu lỗi đường truyền hoặc bị hoãn.
+
+        Khi Telegram hoãn (429) hoặc mạch đang mở, `item` (phản hồi trong outbox) được đánh dấu
+        để outbox gửi lại sau mà không tính là một lần gửi lỗi.
+        """
+        try:
+            self.client.send_message(chat_id, text, parse_mode="HTML")
+            logger.info(f"Đã gửi tin nhắn thành công đến {chat_id}")
+            return True
         except Exception as e:
-            logger.error(f"Lỗi khi gửi tin nhắn: {e}")
-            return False
+            if item is not None:
+                # Mạch đang mở: tin nhắn chưa được gửi đi, outbox không tính là một lần gửi lỗi
+                item.rejected = isinstance(e, CircuitOpenError)
+            delay = retry_after(e)
+            if delay is not None:
+                if item is not None:
+                    item.retry_after = delay
+                logger.warning(f"Telegram hoãn tin nhắn đến {chat_id}, gửi lại sau {delay} giây")
+                return None
+            if not is_transport_error(e):
+                logger.error(f"Lỗi khi gửi tin nhắn: {e.description if isinstance(e, TelegramAPIError) else e}")
+                return False
+            logger.warning(f"Chưa gửi được tin nhắn đến {chat_id}, sẽ gửi lại khi có kết nối: {e}")
+            return None
+    
+    def deliver(self, item):
+        """Gửi một phản hồi lấy từ outbox (kết quả như send_message)"""
+        sent = self.send_message(item.chat_id, item.text, item)
+        if sent:
+            self.polling.record_reply(item.meta.get("date"), item.meta.get("polled_at"))
+        return sent
     
-    def create_response(self, message):
+    def poll_delay(self):
+        """Nghỉ theo polling khi kết nối tốt, theo backoff của circuit breaker khi đang lỗi"""
+        default = self.polling.delay()
+        return self.client.breaker.delay(default) if self.client.breaker is not None else default
+    
+    def create_response(self, message, template_id=None):
         """Tạo phản hồi cho tin nhắn"""
-        content = message.get("content", "").lower()
+        content = message.get("content", "")
         sender = message.get("sender", "Unknown")
         
-        # Kiểm tra từ khóa
-        keyword_mapping = self.config.get("keyword_template_mapping", {})
-        
-        for keyword, template_id in keyword_mapping.items():
-            if keyword.lower() in content:
-                template = self.templates.get_template(template_id)
-                if template:
-                    body = template.get("body", "")
-                    # Thay thế placeholder
-                    body = body.replace("{sender_name}", sender)
-                    body = body.replace("{current_time}", datetime.now().strftime("%H:%M:%S"))
-                    body = body.replace("{current_date}", datetime.now().strftime("%d/%m/%Y"))
-                    return body
+        # Kiểm tra keyword_template_mapping (nguyên từ, automaton dùng chung)
+        if template_id is None:
+            template_id = self.config.snapshot.classify(content)
+        if template_id:
+            template = self.templates.get_template(template_id)
+            if template:
+                return self.templates.render(template, {"sender_name": sender})["body"]
         
         # Phản hồi mặc định
         default_template = self.templates.get_template("default")
         if default_template:
             body = default_template.get("body", "Xin chào! Cảm ơn bạn đã liên hệ.")
-            body = body.replace("{sender_name}", sender)
-            return body
+            return self.templates.renderer.render_text(body, {"sender_name": sender})
         
         return "Xin chào! Cảm ơn bạn đã liên hệ."
     
@@ -200,46 +223,63 @@ class ImprovedTelegramBot:
             logger.error("Không thể kết nối đến bot")
             return
         
-        consecutive_errors = 0
-        max_consecutive_errors = 5
+        # Gửi nốt phản hồi còn trong outbox từ lần chạy trước
+        self.outbox.drain(self.deliver)
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+        
+        # Lỗi ngoài đường truyền (trong lúc xử lý lô) cũng nghỉ theo backoff có jitter thay vì dừng bot
+        error_backoff = DecorrelatedJitter(1.0, 60.0)
         
         try:
             while True:
                 try:
-                    # Lấy tin nhắn mới
-                    messages = self.get_updates_simple()
-                    
-                    # Reset error counter nếu thành công
-                    consecutive_errors = 0
+                    # Lấy tin nhắn mới (lô đã prefetch sẵn nếu bật prefetch)
+                    messages = self.next_messages()
                     
                     # Xử lý từng tin nhắn
-                    for message in messages:
+                    template_ids = self.config.snapshot.classify_batch([m.get("content", "") for m in messages])
+                    for message, template_id in zip(messages, template_ids):
                         try:
-                            response_text = self.create_response(message)
+                            response_text = self.create_response(message, template_id)
                             if response_text:
-                                self.send_message(message['chat_id'], response_text)
+                                self.outbox.enqueue(message['chat_id'], response_text,
+                                                   {"date": message.get("date"), "polled_at": message.get("polled_at")})
                         except Exception as e:
                             logger.error(f"Lỗi khi xử lý tin nhắn: {e}")
+                    # Ghi cả lô phản hồi xuống đĩa (một transaction) rồi mới commit offset và gửi
+                    self.outbox.flush()
+                    self.checkpoint.commit(self.last_update_id)
+                    self.outbox.drain(self.deliver)
+                    error_backoff.reset()
                     
-                    # Nghỉ một chút trước khi kiểm tra lại
-                    time.sleep(2)
+                    # Long-polling: poll lại ngay; short-polling hoặc mất kết nối: nghỉ theo backoff
+                    # (khi prefetch, luồng nền tự nghỉ và next_messages() chờ lô kế tiếp)
+                    if self.prefetcher is None:
+                        time.sleep(self.poll_delay())
                     
                 except Exception as e:
-                    consecutive_errors += 1
-                    logger.error(f"Lỗi trong vòng lặp chính (lần {consecutive_errors}): {e}")
-                    
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.error("Quá nhiều lỗi liên tiếp, dừng bot")
-                        break
-                    
-                    # Nghỉ lâu hơn khi có lỗi
-                    time.sleep(10)
+                    delay = error_backoff.next()
+                    logger.error(f"Lỗi trong vòng lặp chính: {e} - thử lại sau {delay:.1f} giây")
+                    time.sleep(delay)
                     
         except KeyboardInterrupt:
             logger.info("Bot đã bị dừng bởi người dùng")
         except Exception as e:
             logger.error(f"Lỗi nghiêm trọng: {e}")
         finally:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+                logger.info(f"Prefetch: {self.prefetcher.stats()}")
+            self.config.flush()
+            logger.info(f"Thống kê kết nối Telegram: {self.client.connection_stats()}")
+            logger.info(f"Thống kê polling và độ trễ trả lời: {self.polling.stats()}")
+            if self.client.breaker is not None:
+                logger.info(f"Circuit breaker: {self.client.breaker.metrics()}")
+            logger.info(f"Outbox: {self.outbox.stats()}")
+            logger.info(f"Nạp lại cấu hình: {self.config.reload_stats()}, mẫu trả lời: {self.templates.reload_stats()}")
+            logger.info(f"Cache render: {self.templates.cache_stats()}, chuẩn hóa: {normalizer_cache_stats()}, ghi cấu hình: {self.config.persistence_stats()}")
+            self.outbox.close()
             logger.info("Bot đã dừng")
 
 def main():
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module phân loại ý định tin nhắn theo bảng luật trong cấu hình
+
+Mỗi luật tự chọn cách so khớp: mặc định từ khóa khớp cả khi nằm trong một từ khác
+("help" khớp "helpful"), còn `whole_words: true` chỉ khớp nguyên từ như `\b` của regex
+(cần cho từ khóa ngắn như "hi", nếu không "this" hay "nothing" cũng bị coi là lời chào).
+"""
+
+import logging
+from dataclasses import dataclass
+
+from keyword_matcher import KeywordMatcher
+from fuzzy_matcher import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTENT_RULES = [
+    {"intent": "urgent", "keywords": ["urgent", "khẩn cấp", "gấp", "emergency"],
+     "priority": 1, "template_id": "urgent_response"},
+    {"intent": "price", "keywords": ["price", "giá", "cost", "bao nhiêu"],
+     "priority": 2, "template_id": "price_inquiry"},
+    {"intent": "welcome", "keywords": ["hello", "hi", "chào", "xin chào"],
+     "priority": 3, "template_id": "welcome_offline", "whole_words": True},
+    {"intent": "sales", "keywords": ["buy", "mua", "order", "đặt hàng"],
+     "priority": 4, "template_id": "sales_offline"},
+    {"intent": "support", "keywords": ["help", "support", "hỗ trợ", "giúp"],
+     "priority": 5, "template_id": "support_offline"},
+]
+
+
+@dataclass(frozen=True, slots=True)
+class IntentRule:
+    intent: str
+    keywords: tuple
+    priority: int
+    template_id: str
+    whole_words: bool = False
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            intent=data["intent"],
+            keywords=tuple(data.get("keywords", [])),
+            priority=data.get("priority", 100),
+            template_id=data["template_id"],
+            whole_words=bool(data.get("whole_words", False))
+        )
+
+
+class IntentClassifier:
+    """Gộp từ khóa của mọi luật vào một automaton (mỗi từ khóa mang cách so khớp của luật),
+    phân loại mỗi tin nhắn trong một lượt duyệt; luật có priority nhỏ hơn thắng.
+
+    `accented` là bộ chuẩn hóa giữ dấu cho tin nhắn gõ có dấu (xem KeywordMatcher).
+    Nếu có `fuzzy` (mục `matching.fuzzy`: enabled, max_distance, min_length, dictionary),
+    tin nhắn không khớp chính xác được thử lại với chỉ mục trigram chịu lỗi chính tả.
+    """
+
+    def __init__(self, rules, normalizer=None, fuzzy=None, accented=None):
+        self.rules = tuple(sorted(rules, key=lambda rule: rule.priority))
+        self.fuzzy_settings = dict(fuzzy or {})
+        entries = [(keyword, rule) for rule in self.rules for keyword in rule.keywords]
+        self.matcher = KeywordMatcher(
+            [(keyword, rule, rule.whole_words) for keyword, rule in entries],
+            normalizer=normalizer, accented=accented)
+        self.normalizer = normalizer or str.lower
+        self.accented = accented
+        self.fuzzy = None
+        if self.fuzzy_settings.get("enabled", False):
+            self.fuzzy = TrigramIndex(
+                entries,
+                max_distance=self.fuzzy_settings.get("max_distance", 1),
+                min_length=self.fuzzy_settings.get("min_length", 6),
+                normalizer=normalizer,
+                dictionary=self.fuzzy_settings.get("dictionary", ())
+            )
+        logger.debug(f"Đã biên dịch {len(self.rules)} luật ý định với {len(entries)} từ khóa")
+
+    @classmethod
+    def from_config(cls, rules, previous=None, normalizer=None, fuzzy=None, accented=None):
+        """Dựng bộ phân loại từ danh sách luật dạng dict (mục `intent_rules` của config.json).
+
+        Nếu `previous` có cùng bộ luật thì dùng lại, không biên dịch lại automaton.
+        """
+        parsed = []
+        for data in rules:
+            try:
+                parsed.append(IntentRule.from_dict(data))
+            except (KeyError, TypeError) as e:
+                logger.error(f"Bỏ qua luật ý định không hợp lệ {data}: {e}")
+        parsed.sort(key=lambda rule: rule.priority)
+        if (previous is not None and previous.rules == tuple(parsed)
+                and previous.normalizer is (normalizer or str.lower)
+                and previous.accented is accented
+                and previous.fuzzy_settings == dict(fuzzy or {})):
+            return previous
+        return cls(parsed, normalizer, fuzzy, accented)
+
+    def classify(self, text):
+        """Trả về IntentRule khớp với tin nhắn, hoặc None"""
+        return self.classify_batch((text,))[0]
+
+    def classify_batch(self, texts):
+        """Phân loại cả lô tin nhắn trong một lần gọi; trả về danh sách IntentRule/None"""
+        results = [matched[1] if matched else None for matched in self.matcher.match_batch(texts)]
+        if self.fuzzy is not None:
+            # Chỉ tin nhắn trượt automaton mới tốn thêm chi phí so khớp gần đúng
+            for index, rule in enumerate(results):
+                if rule is None and texts[index]:
+                    matched = self.fuzzy.match(texts[index])
+                    if matched is not None:
+                        logger.debug(f"Khớp gần đúng từ khóa '{matched[0]}' (khoảng cách {matched[2]})")
+                        results[index] = matched[1]
+        return results
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module mã hóa/giải mã JSON dùng thư viện nhanh nhất đang có
+
+Thứ tự ưu tiên: orjson, ujson, rồi json của thư viện chuẩn. Mọi backend cho cùng một
+kết quả: dumps() trả về str UTF-8 (không escape tiếng Việt), loads() nhận str hoặc bytes.
+Tệp trạng thái do máy ghi dùng dạng gọn (không thụt lề); tệp người sửa tay như
+config.json vẫn ghi đẹp bằng json của thư viện chuẩn để giữ nguyên định dạng.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JsonCodec:
+    """Một backend JSON: `dumps(obj, pretty=False)` -> str, `loads(data)` với data là str/bytes"""
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self._dumps = dumps
+        self.loads = loads
+
+    def dumps(self, obj, pretty=False):
+        return self._dumps(obj, pretty)
+
+    def __repr__(self):
+        return f"JsonCodec({self.name})"
+
+
+def _stdlib_dumps(obj, pretty):
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _orjson_dumps(obj, pretty):
+    # Khóa không phải chuỗi (ví dụ user_id kiểu int) được đổi thành chuỗi như json chuẩn
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+    return orjson.dumps(obj, option=option).decode("utf-8")
+
+
+def _ujson_dumps(obj, pretty):
+    return ujson.dumps(obj, ensure_ascii=False, indent=2 if pretty else 0)
+
+
+def available_codecs():
+    """Các backend đã cài, theo thứ tự ưu tiên"""
+    codecs = {}
+    if orjson is not None:
+        codecs["orjson"] = JsonCodec("orjson", _orjson_dumps, orjson.loads)
+    if ujson is not None:
+        codecs["ujson"] = JsonCodec("ujson", _ujson_dumps, ujson.loads)
+    codecs["json"] = JsonCodec("json", _stdlib_dumps, json.loads)
+    return codecs
+
+
+codec = next(iter(available_codecs().values()))
+dumps = codec.dumps
+loads = codec.loads
+
+
+def load_file(path):
+    """Đọc một tệp JSON bằng backend nhanh nhất"""
+    with open(path, "rb") as file:
+        return loads(file.read())
+
+
+def dump_file(obj, path, pretty=False):
+    """Ghi một tệp JSON (mặc định dạng gọn) bằng backend nhanh nhất"""
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(dumps(obj, pretty))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module so khớp từ khóa bằng automaton Aho-Corasick
+"""
+
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """Tìm mọi từ khóa trong một lượt duyệt văn bản, không phụ thuộc số lượng từ khóa.
+
+    `entries` là danh sách (keyword, value) theo thứ tự ưu tiên: khi nhiều từ khóa
+    cùng xuất hiện, từ khóa đứng trước thắng (giống vòng lặp cũ theo thứ tự mapping).
+    Với `whole_words=True` mỗi kết quả phải nằm giữa hai ranh giới từ như `\\b` của regex;
+    một mục dạng (keyword, value, whole_words) tự chọn cách so khớp của riêng nó, nên các
+    từ khóa nguyên từ và không nguyên từ vẫn dùng chung một automaton, một lượt duyệt.
+    `normalizer` được áp dụng cho từ khóa một lần lúc biên dịch và cho mỗi văn bản
+    lúc so khớp (mặc định: str.lower); vị trí trả về là vị trí trong văn bản đã chuẩn hóa.
+
+    Nếu có `accented` (bộ chuẩn hóa giữ dấu, khi `normalizer` bỏ dấu), văn bản mà hai bộ
+    chuẩn hóa cho kết quả khác nhau (khách gõ có dấu) chỉ được so với dạng có dấu của từ
+    khóa, nên "gặp" không khớp "gấp"; chỉ văn bản gõ không dấu mới được so không phân biệt dấu.
+    """
+
+    def __init__(self, entries, whole_words=True, normalizer=None, accented=None):
+        entries = list(entries)
+        self.whole_words = whole_words
+        self.normalizer = normalizer or str.lower
+        self.accented = accented
+        self._accented_matcher = KeywordMatcher(entries, whole_words, accented) if accented else None
+        self.entries = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for entry in entries:
+            keyword, value = entry[0], entry[1]
+            key = self.normalizer(keyword)
+            if not key:
+                continue
+            self._add(key, len(self.entries), entry[2] if len(entry) > 2 else whole_words)
+            self.entries.append((keyword, value))
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, key, priority, whole_words):
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append((priority, len(key), whole_words))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        # Sắp xếp theo độ ưu tiên để dừng sớm ở kết quả tốt nhất tại mỗi vị trí
+        self._out = [tuple(sorted(out)) for out in self._out]
+        # Bảng chuyển trạng thái đầy đủ (DFA): mỗi ký tự chỉ tốn một lần tra dict,
+        # không phải lần theo liên kết thất bại trong vòng lặp Python
+        self._delta = [None] * len(self._goto)
+        self._delta[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self._delta[node] = {**self._delta[self._fail[node]], **self._goto[node]}
+            queue.extend(self._goto[node].values())
+
+    def _at_boundary(self, text, start, end):
+        before = start > 0 and _is_word(text[start - 1])
+        after = end < len(text) and _is_word(text[end])
+        return before != _is_word(text[start]) and after != _is_word(text[end - 1])
+
+    def _scan(self, text):
+        """Sinh (priority, start, end) cho mọi lần xuất hiện hợp lệ trong văn bản đã chuẩn hóa"""
+        delta = self._delta
+        out = self._out
+        node = 0
+        for index, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            for priority, length, whole_words in out[node]:
+                start = index - length + 1
+                if not whole_words or self._at_boundary(text, start, index + 1):
+                    yield priority, start, index + 1
+
+    def match(self, text):
+        """Trả về (keyword, value) có độ ưu tiên cao nhất tìm thấy, hoặc None"""
+        if not self.entries or not text:
+            return None
+        return self.match_batch((text,))[0]
+
+    def match_batch(self, texts):
+        """Như match() cho cả một lô văn bản trong một lần gọi.
+
+        Các bảng của automaton và bộ chuẩn hóa chỉ được nạp vào biến cục bộ một lần
+        cho cả lô, danh sách kết quả được cấp phát sẵn.
+        """
+        if self._accented_matcher is None:
+            return self._match_batch(texts)
+        accented = [self._has_accents(text) for text in texts]
+        results = self._match_batch([None if has else text for text, has in zip(texts, accented)])
+        if any(accented):
+            typed = [index for index, has in enumerate(accented) if has]
+            for index, matched in zip(typed, self._accented_matcher.match_batch([texts[i] for i in typed])):
+                results[index] = matched
+        return results
+
+    def _has_accents(self, text):
+        return bool(text) and self.accented(text) != self.normalizer(text)
+
+    def _match_batch(self, texts):
+        results = [None] * len(texts)
+        if not self.entries:
+            return results
+        normalizer = self.normalizer
+        delta = self._delta
+        out = self._out
+        entries = self.entries
+        at_boundary = self._at_boundary
+        count = len(entries)
+        for position, text in enumerate(texts):
+            if not text:
+                continue
+            text = normalizer(text)
+            best = count
+            node = 0
+            for index, char in enumerate(text):
+                node = delta[node].get(char, 0)
+                if not out[node]:
+                    continue
+                for priority, length, whole_words in out[node]:
+                    if priority >= best:
+                        break
+                    if not whole_words or at_boundary(text, index - length + 1, index + 1):
+                        best = priority
+                        break
+                if best == 0:
+                    break
+            if best < count:
+                results[position] = entries[best]
+        return results
+
+    def find_all(self, text):
+        """Trả về danh sách (keyword, value, start, end) của mọi từ khóa xuất hiện"""
+        if not self.entries or not text:
+            return []
+        if self._accented_matcher is not None and self._has_accents(text):
+            return self._accented_matcher.find_all(text)
+        return [(*self.entries[priority], start, end) for priority, start, end in self._scan(self.normalizer(text))]
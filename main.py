@@ -4,10 +4,11 @@ import time
 import logging
 import threading
 import subprocess
-from datetime import datetime
 from message_handler import MessageHandler
 from response_templates import ResponseTemplates
 from config import Config
+from text_normalizer import cache_stats as normalizer_cache_stats
+from async_engine import MessageHandlerAdapter, engine_from_config, run_engine
 
 file_handler = logging.FileHandler("auto_responder.log", encoding="utf-8")
 stream_handler = logging.StreamHandler()
@@ -30,7 +31,8 @@ class AutoResponder:
         self.config = Config(config_file)
         self.templates = ResponseTemplates()
         self.message_handler = MessageHandler(self.config, self.templates)
-        self.last_check_time = datetime.now()
+        if self.config.start_watching():
+            self.templates.start_watching(self.config.get("app.hot_reload.interval", 1.0))
         logger.info("AutoResponder đã được khởi tạo")
 
     def start_web_server(self):
@@ -45,45 +47,76 @@ class AutoResponder:
         web_server_thread.daemon = True
         web_server_thread.start()
         logger.info("Bắt đầu dịch vụ tự động trả lời tin nhắn")
+        if self.config.get("app.engine.mode", "sync") == "async":
+            return self.start_async()
         try:
+            # Gửi nốt phản hồi còn trong outbox từ lần chạy trước
+            self.message_handler.deliver_replies()
+            if self.config.snapshot.telegram.enabled:
+                # getUpdates chạy nền (nếu bật prefetch) trong lúc vòng lặp xử lý lô hiện tại
+                self.message_handler.start_prefetch()
             while True:
                 new_messages = self.message_handler.check_new_messages()
                 
                 if new_messages:
                     logger.info(f"Đã nhận được {len(new_messages)} tin nhắn mới")
-                    for message in new_messages:
-                        self.process_message(message)
+                    template_ids = self.message_handler.classify_batch(new_messages)
+                    for message, template_id in zip(new_messages, template_ids):
+                        self.process_message(message, template_id)
+                # Phản hồi đã nằm trong outbox trước khi commit offset; gửi sau khi commit
+                self.message_handler.commit_offsets()
+                self.message_handler.deliver_replies()
                 
-                self.last_check_time = datetime.now()
-                
-                telegram_enabled = self.config.get("platforms.telegram.enabled", False)
-                if telegram_enabled:
-                    check_interval = self.config.get("platforms.telegram.check_interval", 30)
+                snapshot = self.config.snapshot
+                if snapshot.telegram.enabled:
+                    # Long-polling đã chờ phía server: poll lại ngay, trừ khi đang short-polling
+                    # hoặc mất kết nối (khi đó nghỉ theo backoff của circuit breaker)
+                    check_interval = self.message_handler.poll_delay()
                 else:
-                    check_interval = self.config.get("app.check_interval", 300)
+                    check_interval = snapshot.app.check_interval
                 time.sleep(check_interval)
         except KeyboardInterrupt:
             logger.info("Dịch vụ đã bị dừng bởi người dùng")
         except Exception as e:
             logger.error(f"Lỗi không mong muốn: {str(e)}")
         finally:
+            self.message_handler.stop_prefetch()
+            self.config.flush()
+            logger.info(f"Thống kê polling và độ trễ trả lời: {self.message_handler.polling.stats()}")
+            logger.info(f"Trạng thái kết nối Telegram: {self.message_handler.transport_metrics()}")
+            logger.info(f"Nạp lại cấu hình: {self.config.reload_stats()}, mẫu trả lời: {self.templates.reload_stats()}")
+            logger.info(f"Cache render: {self.templates.cache_stats()}, chuẩn hóa: {normalizer_cache_stats()}, ghi cấu hình: {self.config.persistence_stats()}")
+            self.message_handler.outbox.close()
             logger.info("Dịch vụ tự động trả lời tin nhắn đã dừng")
 
-    def process_message(self, message):
+    def start_async(self):
+        """Chạy Telegram bằng engine asyncio (app.engine.mode = "async")"""
+        client = self.message_handler.telegram_client()
+        if client is None:
+            logger.error("Không tìm thấy token của bot Telegram trong tệp cấu hình")
+            return
+        # Engine chỉ commit offset sau khi gửi xong; gửi nốt phản hồi còn trong outbox của chế độ đồng bộ
+        self.message_handler.deliver_replies()
+        handler = MessageHandlerAdapter(self.message_handler)
+        engine = engine_from_config(self.config, client, handler, self.message_handler.checkpoint)
         try:
-            if self.is_new_message(message):
-                response = self.message_handler.create_response(message)
-                
-                if response:
-                    self.message_handler.send_response(message, response)
-                    logger.info(f"Đã gửi phản hồi tự động cho tin nhắn từ {message.get('sender', 'Unknown')}")
+            run_engine(engine)
+        finally:
+            self.config.flush()
+            logger.info("Dịch vụ tự động trả lời tin nhắn đã dừng")
+
+    def process_message(self, message, template_id=None):
+        # Không lọc theo thời điểm: offset của getUpdates đã loại tin nhắn trùng, còn tin nhắn
+        # đến trong lúc deliver_replies() chờ giới hạn tốc độ vẫn phải được trả lời
+        try:
+            response = self.message_handler.create_response(message, template_id)
+            
+            if response:
+                self.message_handler.send_response(message, response)
+                logger.info(f"Đã gửi phản hồi tự động cho tin nhắn từ {message.get('sender', 'Unknown')}")
         except Exception as e:
             logger.error(f"Lỗi khi xử lý tin nhắn: {str(e)}")
 
-    def is_new_message(self, message):
-        message_time = datetime.fromisoformat(message.get("timestamp", datetime.now().isoformat()))
-        return message_time > self.last_check_time
-
 
 def main():
     auto_responder = AutoResponder()
@@ -1,17 +1,37 @@
-import re
-import json
 import logging
 import requests
-import time
 from datetime import datetime
+from checkpoint import OffsetCheckpoint
+from telegram_client import TelegramAPIError, shared_client, http_options
+from circuit_breaker import CircuitOpenError, is_transport_error, retry_after
+from outbox import Outbox, OutboxItem
+from prefetch import PrefetchPoller
+from polling import PollingStrategy
 
 logger = logging.getLogger(__name__)
 
 
 class MessageHandler:
-    def __init__(self, config, templates):
+    def __init__(self, config, templates, outbox_path=None):
         self.config = config
         self.templates = templates
+        self.checkpoint = OffsetCheckpoint(
+            self.config.get("telegram.checkpoint_file", "telegram_offset.log"),
+            initial=self.config.get("telegram.last_update_id", 0)
+        )
+        self.telegram_offset = self.checkpoint.last
+        telegram_settings = self.config.get("platforms.telegram", {})
+        self.polling = PollingStrategy.from_settings(
+            telegram_settings, short_interval=telegram_settings.get("check_interval", 30)
+        )
+        # Phản hồi Telegram được ghi vào outbox trên đĩa trước khi commit offset rồi mới gửi
+        # (outbox_path: mỗi tiến trình worker của webhook_server.py chế độ prefork một tệp riêng)
+        outbox_settings = telegram_settings.get("outbox", {})
+        if outbox_path is not None:
+            outbox_settings = {**outbox_settings, "path": outbox_path}
+        self.outbox = Outbox.from_settings(outbox_settings)
+        # Luồng getUpdates chạy nền, chỉ bật bởi vòng lặp polling (start_prefetch)
+        self.prefetcher = None
         self.platform_handlers = {
             "email": self.handle_email,
             "telegram": self.handle_telegram,
@@ -30,38 +50,48 @@ class MessageHandler:
                     logger.error(f"Lỗi khi kiểm tra tin nhắn từ {platform}: {str(e)}")
         return new_messages
 
-    def create_response(self, message):
+    def commit_offsets(self):
+        """Ghi nhận offset Telegram sau khi đã xử lý xong lô tin nhắn.
+
+        Phản hồi của lô được ghi xuống outbox (một transaction) trước, nên offset không
+        bao giờ vượt qua một phản hồi chưa nằm trên đĩa.
+        """
+        self.outbox.flush()
+        self.checkpoint.commit(self.telegram_offset)
+
+    def classify_batch(self, messages):
+        """Chọn template_id cho cả lô tin nhắn trong một lần gọi (dùng lại automaton đã biên dịch)"""
+        template_ids = self.config.snapshot.classify_batch([message.get("content", "") for message in messages])
+        return [template_id or "default" for template_id in template_ids]
+
+    def create_response(self, message, template_id=None):
         content = message.get("content", "")
         platform = message.get("platform", "")
         sender = message.get("sender", "")
-        if sender in self.config.get("excluded_senders", []):
+        snapshot = self.config.snapshot
+        if sender in snapshot.excluded_senders:
             logger.info(f"Bỏ qua tin nhắn từ người gửi trong danh sách loại trừ: {sender}")
             return None
-        for keyword, template_id in self.config.get("keyword_template_mapping", {}).items():
-            if re.search(r'\b' + re.escape(keyword) + r'\b', content, re.IGNORECASE):
-                logger.info(f"Đã tìm thấy từ khóa '{keyword}' trong tin nhắn")
-                template = self.templates.get_template(template_id)
-                return self._format_template(template, sender)
+        if template_id is not None:
+            return self._format_template(self.templates.get_template(template_id), sender)
+        matched = snapshot.keyword_matcher.match(content)
+        if matched:
+            keyword, template_id = matched
+            logger.info(f"Đã tìm thấy từ khóa '{keyword}' trong tin nhắn")
+            template = self.templates.get_template(template_id)
+            return self._format_template(template, sender)
+        if snapshot.fallback is not None:
+            guess = snapshot.fallback.classify(content)
+            if guess:
+                logger.info(f"Bộ phân loại dự phòng chọn template '{guess[0]}' (điểm {guess[1]:.2f})")
+                return self._format_template(self.templates.get_template(guess[0]), sender)
         default_template = self.templates.get_template("default")
         return self._format_template(default_template, sender)
 
     def _format_template(self, template, sender):
         if not template:
             return None
-        subject = template.get("subject", "")
-        body = template.get("body", "")
-        replacements = {
-            "{sender_name}": sender,
-            "{current_time}": datetime.now().strftime("%H:%M:%S"),
-            "{current_date}": datetime.now().strftime("%d/%m/%Y")
-        }
-        for placeholder, value in replacements.items():
-            subject = subject.replace(placeholder, value)
-            body = body.replace(placeholder, value)
-        return {
-            "subject": subject,
-            "body": body
-        }
+        return self.templates.render(template, {"sender_name": sender})
 
     def send_response(self, original_message, response):
         if not response:
@@ -81,85 +111,120 @@ class MessageHandler:
             logger.error(f"Không hỗ trợ gửi phản hồi qua nền tảng {platform}")
         return False
 
+    def telegram_client(self):
+        """Client Telegram dùng chung (pool kết nối keep-alive) cho token hiện tại"""
+        token = self.config.get("credentials.telegram.token")
+        if not token:
+            return None
+        return shared_client(
+            token,
+            rate_limit=self.config.get("platforms.telegram.rate_limit", {}),
+            circuit_breaker=self.config.get("platforms.telegram.circuit_breaker", {}),
+            **http_options(self.config.get("platforms.telegram.http", {}))
+        )
+
     def handle_email(self):
         logger.info("Kiểm tra email mới")
         return []
 
+    def start_prefetch(self):
+        """Bật luồng prefetch getUpdates nếu `platforms.telegram.prefetch.enabled`; trả về True nếu đã bật"""
+        if self.prefetcher is None and self.telegram_client() is not None:
+            self.prefetcher = PrefetchPoller.from_settings(
+                self.config.get("platforms.telegram.prefetch", {}),
+                self.fetch_telegram_updates,
+                self.telegram_offset + 1,
+                idle_delay=self.backoff_delay
+            )
+            if self.prefetcher is not None:
+                self.prefetcher.start()
+        return self.prefetcher is not None
+
+    def stop_prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            logger.info(f"Prefetch: {self.prefetcher.stats()}")
+
     def handle_telegram(self):
-        token = self.config.get("credentials.telegram.token")
-        last_update_id = self.config.get("telegram.last_update_id", 0)
-        if not token:
+        if self.prefetcher is not None:
+            # Lô đã được luồng nền lấy sẵn; chờ tối đa 1 giây để vòng lặp chính vẫn kiểm tra email
+            updates, polled_at = self.prefetcher.get(timeout=1.0) or ([], None)
+        else:
+            updates = self.fetch_telegram_updates(self.telegram_offset + 1)
+            polled_at = self.polling.polled_at
+        messages = []
+        for update in updates:
+            if "message" in update:
+                message = update["message"]
+                if "text" in message:
+                    messages.append({
+                        "platform": "telegram",
+                        "chat_id": message["chat"]["id"],
+                        "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
+                        "content": message.get("text", ""),
+                        "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
+                        "date": message["date"],
+                        "message_id": message["message_id"],
+                        "polled_at": polled_at
+                    })
+            self.telegram_offset = update["update_id"]
+        if messages:
+            logger.info(f"Đã nhận được {len(messages)} tin nhắn Telegram mới")
+        return messages
+
+    def fetch_telegram_updates(self, offset):
+        """Gọi getUpdates một lần; trả về danh sách update thô (rỗng khi lỗi)"""
+        client = self.telegram_client()
+        if client is None:
             logger.error("Không tìm thấy token của bot Telegram trong tệp cấu hình")
             return []
-        url = f"https://api.telegram.org/bot{token}/getUpdates"
-        params = {
-            "offset": last_update_id + 1,
-            "timeout": 30,  
-            "limit": 100
-        }
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'TelegramBot/1.0'})
-        max_retries = 3
-        retry_delay = 5
-        for attempt in range(max_retries):
-            try:
-                logger.debug(f"Đang kiểm tra tin nhắn Telegram (lần thử {attempt + 1}/{max_retries})")
-                response = session.get(
-                    url, 
-                    params=params,
-                    timeout=(10, 35),  
-                    stream=False
-                )
-                response.raise_for_status()
-                data = response.json()
-                if not data.get("ok", False):
-                    logger.error(f"Telegram API trả về lỗi: {data.get('description', 'Unknown error')}")
-                    return []
-                updates = data.get("result", [])
-                messages = []
-                for update in updates:
-                    if "message" in update:
-                        message = update["message"]
-                        if "text" in message:
-                            messages.append({
-                                "platform": "telegram",
-                                "chat_id": message["chat"]["id"],
-                                "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
-                                "content": message.get("text", ""),
-                                "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
-                                "message_id": message["message_id"]
-                            })
-                    self.config.set("telegram.last_update_id", update["update_id"])
-                if messages:
-                    logger.info(f"Đã nhận được {len(messages)} tin nhắn Telegram mới")
-                return messages
-            except requests.exceptions.Timeout as e:
-                logger.warning(f"Timeout khi kết nối Telegram (lần thử {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error("Đã hết số lần thử kết nối Telegram")
-                    return []
-            except requests.exceptions.ConnectionError as e:
-                logger.warning(f"Lỗi kết nối Telegram (lần thử {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error("Không thể kết nối đến Telegram API")
-                    return []
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Lỗi khi lấy tin nhắn Telegram: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    return []
-            except Exception as e:
-                logger.error(f"Lỗi không mong muốn khi xử lý Telegram: {e}")
-                return []
-        return []
+        # Một lần gọi mỗi vòng: khi mạng lỗi, vòng lặp chính nghỉ theo circuit breaker (poll_delay)
+        try:
+            logger.debug("Đang kiểm tra tin nhắn Telegram")
+            # Còn phản hồi bị hoãn (429) thì không long-poll quá lúc phải gửi lại
+            updates = client.get_updates(offset=offset, **self.polling.params(self.outbox.retry_in()))
+        except CircuitOpenError as e:
+            logger.debug(f"Bỏ qua lần kiểm tra Telegram: {e}")
+            return []
+        except TelegramAPIError as e:
+            self.polling.record_failure()
+            logger.error(f"Telegram API trả về lỗi: {e.description}")
+            return []
+        except requests.exceptions.Timeout as e:
+            self.polling.record_failure()
+            logger.warning(f"Timeout khi kết nối Telegram: {e}")
+            return []
+        except requests.exceptions.ConnectionError as e:
+            self.polling.record_failure()
+            logger.warning(f"Lỗi kết nối Telegram: {e}")
+            return []
+        except requests.exceptions.RequestException as e:
+            self.polling.record_failure()
+            logger.error(f"Lỗi khi lấy tin nhắn Telegram: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Lỗi không mong muốn khi xử lý Telegram: {e}")
+            return []
+        self.polling.record_success(len(updates))
+        return updates
+
+    def poll_delay(self):
+        """Số giây vòng lặp chính nghỉ trước lần kiểm tra tiếp theo (0 khi prefetch: luồng nền tự nghỉ)"""
+        return 0 if self.prefetcher is not None else self.backoff_delay()
+
+    def backoff_delay(self):
+        """Số giây nghỉ trước lần poll tiếp theo: theo polling khi kết nối tốt, theo backoff khi đang lỗi"""
+        client = self.telegram_client()
+        default = self.polling.delay()
+        if client is None or client.breaker is None:
+            return default
+        return client.breaker.delay(default)
+
+    def transport_metrics(self):
+        """Trạng thái circuit breaker và outbox"""
+        client = self.telegram_client()
+        breaker = client.breaker.metrics() if client is not None and client.breaker is not None else None
+        return {"circuit_breaker": breaker, "outbox": self.outbox.stats()}
 
     def send_email(self, original_message, response):
         recipient = original_message.get("sender", "")
@@ -168,8 +233,8 @@ class MessageHandler:
         logger.info(f"Gửi email phản hồi đến {recipient} với tiêu đề '{subject}'")
 
     def send_telegram(self, original_message, response):
-        token = self.config.get("credentials.telegram.token")
-        if not token:
+        client = self.telegram_client()
+        if client is None:
             logger.error("Không tìm thấy token của bot Telegram trong tệp cấu hình")
             return False
         chat_id = original_message.get("chat_id")
@@ -177,55 +242,62 @@ class MessageHandler:
         if not chat_id or not body:
             logger.error("Thiếu chat_id hoặc nội dung để gửi tin nhắn Telegram")
             return False
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": body,
-            "parse_mode": "HTML"  
-        }
-        max_retries = 3
-        retry_delay = 2
-        for attempt in range(max_retries):
-            try:
-                logger.debug(f"Đang gửi tin nhắn Telegram (lần thử {attempt + 1}/{max_retries})")
-                response_obj = requests.post(
-                    url, 
-                    json=payload, 
-                    timeout=(5, 10),  
-                    headers={'User-Agent': 'TelegramBot/1.0'}
-                )
-                response_obj.raise_for_status()
-                data = response_obj.json()
-                if data.get("ok", False):
-                    logger.info(f"Đã gửi tin nhắn Telegram thành công đến {chat_id}")
-                    return True
-                else:
-                    logger.error(f"Telegram API trả về lỗi khi gửi tin nhắn: {data.get('description', 'Unknown error')}")
-                    return False
-            except requests.exceptions.Timeout as e:
-                logger.warning(f"Timeout khi gửi tin nhắn Telegram (lần thử {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error("Đã hết số lần thử gửi tin nhắn Telegram")
-                    return False
-            except requests.exceptions.ConnectionError as e:
-                logger.warning(f"Lỗi kết nối khi gửi tin nhắn Telegram (lần thử {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logger.error("Không thể kết nối đến Telegram API để gửi tin nhắn")
-                    return False
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Lỗi khi gửi tin nhắn Telegram: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    return False
-            except Exception as e:
-                logger.error(f"Lỗi không mong muốn khi gửi tin nhắn Telegram: {e}")
+        # Chỉ xếp vào outbox; deliver_replies() gửi sau khi offset đã được commit
+        self.outbox.enqueue(chat_id, body, {"date": original_message.get("date"),
+                                            "polled_at": original_message.get("polled_at")})
+        return True
+
+    def reply_telegram(self, original_message, response):
+        """Gửi phản hồi ngay trong luồng hiện tại (worker webhook); trả về như _deliver_telegram.
+
+        Gửi được thì không ghi gì vào outbox, nên mỗi request không tốn một lần fsync. Khi lỗi
+        đường truyền hoặc bị hoãn, phản hồi mới được ghi vào outbox (enqueue/flush) để
+        deliver_replies() gửi lại sau.
+        """
+        client = self.telegram_client()
+        chat_id = original_message.get("chat_id")
+        body = response.get("body") if response else None
+        if client is None or not chat_id or not body:
+            logger.error("Thiếu token, chat_id hoặc nội dung để gửi tin nhắn Telegram")
+            return False
+        meta = {"date": original_message.get("date"), "polled_at": original_message.get("polled_at")}
+        item = OutboxItem(None, chat_id, body, meta, 0)
+        sent = self._deliver_telegram(client, item)
+        if sent is None:
+            self.outbox.enqueue(chat_id, body, meta)
+            self.outbox.flush()
+            if item.retry_after is not None and not item.rejected:
+                self.outbox.defer(chat_id, item.retry_after)
+        return sent
+
+    def deliver_replies(self):
+        """Gửi theo thứ tự các phản hồi trong outbox (kể cả phản hồi còn lại từ lần chạy trước).
+
+        Dừng ở lỗi đường truyền đầu tiên; phản hồi chưa gửi được nằm lại để lần sau gửi tiếp.
+        """
+        client = self.telegram_client()
+        if client is None:
+            return 0
+        return self.outbox.drain(lambda item: self._deliver_telegram(client, item))
+
+    def _deliver_telegram(self, client, item):
+        """True nếu Telegram xác nhận, False nếu bị từ chối hẳn, None nếu lỗi đường truyền hoặc bị hoãn"""
+        try:
+            logger.debug(f"Đang gửi tin nhắn Telegram đến {item.chat_id}")
+            client.send_message(item.chat_id, item.text, parse_mode="HTML")
+        except Exception as e:
+            # Mạch đang mở: tin nhắn chưa được gửi đi, outbox không tính là một lần gửi lỗi
+            item.rejected = isinstance(e, CircuitOpenError)
+            item.retry_after = retry_after(e)
+            if item.retry_after is not None:
+                logger.warning(f"Telegram hoãn tin nhắn đến {item.chat_id}, gửi lại sau {item.retry_after} giây")
+                return None
+            if not is_transport_error(e):
+                description = e.description if isinstance(e, TelegramAPIError) else e
+                logger.error(f"Lỗi khi gửi tin nhắn Telegram: {description}")
                 return False
-        return False
+            logger.warning(f"Chưa gửi được tin nhắn Telegram đến {item.chat_id}, sẽ gửi lại khi có kết nối: {e}")
+            return None
+        self.polling.record_reply(item.meta.get("date"), item.meta.get("polled_at"))
+        logger.info(f"Đã gửi tin nhắn Telegram thành công đến {item.chat_id}")
+        return True
@@ -5,16 +5,22 @@
 Auto Responder Bot - Tự động trả lời khi offline
 """
 
-import json
 import time
 import logging
-import requests
 import urllib3
-from datetime import datetime, timedelta
+from datetime import datetime
 from response_templates import ResponseTemplates
 from config import Config
+from text_normalizer import cache_stats as normalizer_cache_stats
+from checkpoint import OffsetCheckpoint
+from polling import PollingStrategy
+from telegram_client import TelegramAPIError, shared_client, http_options
+from circuit_breaker import CircuitOpenError, DecorrelatedJitter, is_transport_error, retry_after
+from outbox import Outbox
+from prefetch import PrefetchPoller
+from json_codec import load_file, dump_file
+from async_engine import OfflineResponderHandler, engine_from_config, run_engine
 import os
-import threading
 from typing import Dict, List, Optional
 
 # Tắt cảnh báo SSL
@@ -37,9 +43,17 @@ class OfflineAutoResponder:
     def __init__(self):
         self.config = Config()
         self.templates = ResponseTemplates()
+        if self.config.start_watching():
+            self.templates.start_watching(self.config.get("app.hot_reload.interval", 1.0))
+        # Bot offline hiển thị giờ dạng HH:MM
+        self.templates.renderer.registry.register("current_time", lambda now: now.strftime("%H:%M"), granularity=60)
         self.token = self.config.get("credentials.telegram.token")
-        self.last_update_id = self.config.get("telegram.last_update_id", 0)
-        self.session = requests.Session()
+        self.checkpoint = OffsetCheckpoint(
+            self.config.get("telegram.checkpoint_file", "telegram_offset.log"),
+            initial=self.config.get("telegram.last_update_id", 0)
+        )
+        self.last_update_id = self.checkpoint.last
+        self.polling = PollingStrategy.from_settings(self.config.get("platforms.telegram", {}), short_interval=3)
         
         # Trạng thái offline/online
         self.is_offline = True
@@ -55,21 +69,20 @@ class OfflineAutoResponder:
         self.max_responses_per_user = 3  # Tối đa 3 phản hồi tự động cho mỗi user
         self.user_response_count = {}
         
-        # Cấu hình session
-        self.session.headers.update({
-            'User-Agent': 'OfflineAutoResponder/1.0',
-            'Connection': 'keep-alive'
-        })
-        
-        # Cấu hình adapter với retry
-        adapter = requests.adapters.HTTPAdapter(
-            max_retries=urllib3.util.Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[500, 502, 503, 504]
-            )
+        # Client dùng chung với pool kết nối keep-alive, thử lại lỗi 5xx
+        self.client = shared_client(
+            self.token,
+            verify=False,
+            retries=3,
+            backoff_factor=1,
+            user_agent='OfflineAutoResponder/1.0',
+            rate_limit=self.config.get("platforms.telegram.rate_limit", {}),
+            circuit_breaker=self.config.get("platforms.telegram.circuit_breaker", {}),
+            **http_options(self.config.get("platforms.telegram.http", {}))
         )
-        self.session.mount('https://', adapter)
+        # Phản hồi được ghi xuống outbox trước khi commit offset, gửi lại được sau khi khởi động lại
+        self.outbox = Outbox.from_settings(self.config.get("platforms.telegram.outbox", {}))
+        self.prefetcher = None
         
         # Load trạng thái từ file
         self.load_state()
@@ -80,18 +93,17 @@ class OfflineAutoResponder:
         """Load trạng thái từ file"""
         try:
             if os.path.exists("auto_responder_state.json"):
-                with open("auto_responder_state.json", "r", encoding="utf-8") as f:
-                    state = json.load(f)
-                    self.is_offline = state.get("is_offline", True)
-                    self.user_response_count = state.get("user_response_count", {})
-                    self.pending_messages = state.get("pending_messages", [])
+                state = load_file("auto_responder_state.json")
+                self.is_offline = state.get("is_offline", True)
+                self.user_response_count = state.get("user_response_count", {})
+                self.pending_messages = state.get("pending_messages", [])
+                
+                # Parse datetime
+                if state.get("offline_start_time"):
+                    self.offline_start_time = datetime.fromisoformat(state["offline_start_time"])
+                if state.get("last_activity_time"):
+                    self.last_activity_time = datetime.fromisoformat(state["last_activity_time"])
                     
-                    # Parse datetime
-                    if state.get("offline_start_time"):
-                        self.offline_start_time = datetime.fromisoformat(state["offline_start_time"])
-                    if state.get("last_activity_time"):
-                        self.last_activity_time = datetime.fromisoformat(state["last_activity_time"])
-                        
                 logger.info("Đã load trạng thái từ file")
         except Exception as e:
             logger.error(f"Lỗi khi load trạng thái: {e}")
@@ -106,8 +118,8 @@ class OfflineAutoResponder:
                 "user_response_count": self.user_response_count,
                 "pending_messages": self.pending_messages
             }
-            with open("auto_responder_state.json", "w", encoding="utf-8") as f:
-                json.dump(state, f, ensure_ascii=False, indent=2)
+            # Ghi sau mỗi tin nhắn: dạng gọn, không thụt lề
+            dump_file(state, "auto_responder_state.json")
         except Exception as e:
             logger.error(f"Lỗi khi lưu trạng thái: {e}")
     
@@ -148,81 +160,103 @@ class OfflineAutoResponder:
     
     def get_updates_simple(self):
         """Lấy updates từ Telegram"""
+        updates = self.fetch_updates(self.last_update_id + 1)
+        return self.parse_updates(updates, self.polling.polled_at)
+    
+    def fetch_updates(self, offset):
+        """Gọi getUpdates một lần; trả về danh sách update thô (rỗng khi lỗi)"""
         try:
-            url = f"https://api.telegram.org/bot{self.token}/getUpdates"
-            params = {
-                "offset": self.last_update_id + 1,
-                "limit": 10,
-                "timeout": 0
-            }
-            
-            response = self.session.get(
-                url, 
-                params=params, 
-                timeout=15,
-                verify=False
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            if not data.get('ok'):
-                logger.error(f"Telegram API error: {data.get('description')}")
-                return []
-            
-            updates = data.get('result', [])
-            messages = []
-            
-            for update in updates:
-                self.last_update_id = update['update_id']
-                self.config.set("telegram.last_update_id", self.last_update_id)
-                
-                if 'message' in update and 'text' in update['message']:
-                    message = update['message']
-                    messages.append({
-                        "platform": "telegram",
-                        "chat_id": message["chat"]["id"],
-                        "user_id": message["from"]["id"],
-                        "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
-                        "content": message.get("text", ""),
-                        "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
-                        "message_id": message["message_id"]
-                    })
-            
-            return messages
+            # Long-polling (timeout phía server, limit=100), tự chuyển short-polling khi mạng kém;
+            # còn phản hồi bị hoãn (429) thì không long-poll quá lúc phải gửi lại
+            updates = self.client.get_updates(offset=offset, **self.polling.params(self.outbox.retry_in()))
+            self.polling.record_success(len(updates))
+            return updates
             
+        except CircuitOpenError as e:
+            logger.debug(f"Bỏ qua lần lấy updates: {e}")
+            return []
+        except TelegramAPIError as e:
+            self.polling.record_failure()
+            logger.error(f"Telegram API error: {e.description}")
+            return []
         except Exception as e:
+            self.polling.record_failure()
             logger.error(f"Lỗi khi lấy updates: {e}")
             return []
     
-    def send_message(self, chat_id, text):
-        """Gửi tin nhắn"""
-        try:
-            url = f"https://api.telegram.org/bot{self.token}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            
-            response = self.session.post(
-                url, 
-                json=data, 
-                timeout=10,
-                verify=False
-            )
-            response.raise_for_status()
+    def parse_updates(self, updates, polled_at=None):
+        """Chuyển update thô thành tin nhắn và cập nhật last_update_id (chỉ commit sau khi xử lý xong lô).
+
+        `polled_at` là thời điểm (Unix) lô được poll về, gắn vào từng tin nhắn để đo độ trễ.
+        """
+        messages = []
+        
+        for update in updates:
+            self.last_update_id = update['update_id']
             
-            result = response.json()
-            if result.get('ok'):
-                logger.info(f"Đã gửi auto-response đến {chat_id}")
-                return True
-            else:
-                logger.error(f"Lỗi khi gửi tin nhắn: {result.get('description')}")
-                return False
-                
+            if 'message' in update and 'text' in update['message']:
+                message = update['message']
+                messages.append({
+                    "platform": "telegram",
+                    "chat_id": message["chat"]["id"],
+                    "user_id": message["from"]["id"],
+                    "sender": message["from"].get("username", message["from"].get("first_name", "Unknown")),
+                    "content": message.get("text", ""),
+                    "timestamp": datetime.fromtimestamp(message["date"]).isoformat(),
+                    "date": message["date"],
+                    "message_id": message["message_id"],
+                    "polled_at": polled_at
+                })
+        
+        return messages
+    
+    def next_messages(self):
+        """Lô tin nhắn kế tiếp: từ luồng prefetch nếu đã bật, ngược lại gọi getUpdates ngay"""
+        if self.prefetcher is None:
+            return self.get_updates_simple()
+        updates, polled_at = self.prefetcher.get(timeout=1.0) or ([], None)
+        return self.parse_updates(updates, polled_at)
+    
+    def send_message(self, chat_id, text, item=None):
+        """Gửi tin nhắn: True nếu gửi được, False nếu bị từ chối, None nếu lỗi đường truyền hoặc bị hoãn.
+
+        Khi Telegram hoãn (429) hoặc mạch đang mở, `item` (phản hồi trong outbox) được đánh dấu
+        để outbox gửi lại sau mà không tính là một lần gửi lỗi.
+        """
+        try:
+            self.client.send_message(chat_id, text, parse_mode="HTML")
+            logger.info(f"Đã gửi auto-response đến {chat_id}")
+            return True
         except Exception as e:
-            logger.error(f"Lỗi khi gửi tin nhắn: {e}")
-            return False
+            if item is not None:
+                # Mạch đang mở: tin nhắn chưa được gửi đi, outbox không tính là một lần gửi lỗi
+                item.rejected = isinstance(e, CircuitOpenError)
+            delay = retry_after(e)
+            if delay is not None:
+                if item is not None:
+                    item.retry_after = delay
+                logger.warning(f"Telegram hoãn tin nhắn đến {chat_id}, gửi lại sau {delay} giây")
+                return None
+            if not is_transport_error(e):
+                logger.error(f"Lỗi khi gửi tin nhắn: {e.description if isinstance(e, TelegramAPIError) else e}")
+                return False
+            logger.warning(f"Chưa gửi được tin nhắn đến {chat_id}, sẽ gửi lại khi có kết nối: {e}")
+            return None
+    
+    def deliver(self, item):
+        """Gửi một phản hồi lấy từ outbox; bị từ chối hẳn thì trả lại lượt phản hồi của user"""
+        sent = self.send_message(item.chat_id, item.text, item)
+        if sent:
+            self.polling.record_reply(item.meta.get("date"), item.meta.get("polled_at"))
+        elif sent is False and item.meta.get("user_id") is not None:
+            key = str(item.meta["user_id"])
+            self.user_response_count[key] = max(0, self.user_response_count.get(key, 0) - 1)
+        return sent
+    
+    def poll_delay(self):
+        """Nghỉ theo polling khi kết nối tốt, theo backoff của circuit breaker khi đang lỗi"""
+        default = self.polling.delay()
+        return self.client.breaker.delay(default) if self.client.breaker is not None else default
     
     def should_auto_respond(self, user_id: int) -> bool:
         """Kiểm tra có nên tự động phản hồi không"""
@@ -236,7 +270,16 @@ class OfflineAutoResponder:
         
         return True
     
-    def create_smart_response(self, message: Dict) -> Optional[str]:
+    def classify_batch(self, messages: List[Dict]) -> List[str]:
+        """Chọn template cho cả lô tin nhắn trong một lần gọi"""
+        snapshot = self.config.snapshot
+        texts = [message.get("content", "") for message in messages]
+        template_ids = [rule.template_id if rule else None for rule in snapshot.intents.classify_batch(texts)]
+        # Không luật nào khớp: thử bộ phân loại dự phòng TF-IDF trước khi dùng mẫu mặc định
+        template_ids = snapshot.fallback_batch(texts, template_ids)
+        return [template_id or "default_offline" for template_id in template_ids]
+    
+    def create_smart_response(self, message: Dict, template_id: Optional[str] = None) -> Optional[str]:
         """Tạo phản hồi thông minh dựa trên nội dung tin nhắn"""
         content = message.get("content", "").lower()
         sender = message.get("sender", "Unknown")
@@ -247,19 +290,9 @@ class OfflineAutoResponder:
         offline_hours = int(offline_duration.total_seconds() / 3600)
         offline_minutes = int((offline_duration.total_seconds() % 3600) / 60)
         
-        # Phân loại tin nhắn và chọn template phù hợp
-        if any(word in content for word in ["urgent", "khẩn cấp", "gấp", "emergency"]):
-            template_id = "urgent_response"
-        elif any(word in content for word in ["price", "giá", "cost", "bao nhiêu"]):
-            template_id = "price_inquiry"
-        elif any(word in content for word in ["hello", "hi", "chào", "xin chào"]):
-            template_id = "welcome_offline"
-        elif any(word in content for word in ["buy", "mua", "order", "đặt hàng"]):
-            template_id = "sales_offline"
-        elif any(word in content for word in ["help", "support", "hỗ trợ", "giúp"]):
-            template_id = "support_offline"
-        else:
-            template_id = "default_offline"
+        # Phân loại tin nhắn theo bảng luật `intent_rules` và chọn template phù hợp
+        if template_id is None:
+            template_id = self.classify_batch([message])[0]
         
         # Lấy template, fallback về default nếu không tìm thấy
         template = self.templates.get_template(template_id)
@@ -269,12 +302,11 @@ class OfflineAutoResponder:
             template = {"body": "Cảm ơn bạn đã nhắn tin! Tôi hiện đang offline và sẽ trả lời sớm nhất có thể."}
         
         # Thay thế placeholder
-        body = template.get("body", "")
-        body = body.replace("{sender_name}", sender)
-        body = body.replace("{offline_hours}", str(offline_hours))
-        body = body.replace("{offline_minutes}", str(offline_minutes))
-        body = body.replace("{current_time}", datetime.now().strftime("%H:%M"))
-        body = body.replace("{current_date}", datetime.now().strftime("%d/%m/%Y"))
+        body = self.templates.renderer.render_text(template.get("body", ""), {
+            "sender_name": sender,
+            "offline_hours": offline_hours,
+            "offline_minutes": offline_minutes
+        })
         
         # Thêm thông tin về thời gian offline nếu > 1 giờ
         if offline_hours > 0:
@@ -296,7 +328,7 @@ class OfflineAutoResponder:
         
         self.save_state()
     
-    def process_message(self, message: Dict):
+    def process_message(self, message: Dict, template_id: Optional[str] = None):
         """Xử lý tin nhắn"""
         user_id = message.get("user_id")
         chat_id = message.get("chat_id")
@@ -306,14 +338,17 @@ class OfflineAutoResponder:
         
         # Kiểm tra có nên auto-respond không
         if self.should_auto_respond(user_id):
-            response_text = self.create_smart_response(message)
-            if response_text and self.send_message(chat_id, response_text):
+            response_text = self.create_smart_response(message, template_id)
+            if response_text:
+                # Xếp vào outbox (gửi sau khi commit offset) và tính luôn vào số lần phản hồi
+                self.outbox.enqueue(chat_id, response_text, {"date": message.get("date"), "user_id": user_id,
+                                                                 "polled_at": message.get("polled_at")})
                 # Cập nhật counter
                 count = self.user_response_count.get(str(user_id), 0)
                 self.user_response_count[str(user_id)] = count + 1
                 self.save_state()
                 
-                logger.info(f"Đã auto-respond cho user {user_id} (lần {count + 1})")
+                logger.info(f"Đã xếp auto-response cho user {user_id} (lần {count + 1})")
     
     def get_pending_messages_summary(self) -> str:
         """Lấy tóm tắt tin nhắn chờ xử lý"""
@@ -342,8 +377,24 @@ class OfflineAutoResponder:
         logger.info("Bắt đầu chạy Offline Auto Responder...")
         logger.info(f"Trạng thái hiện tại: {'OFFLINE' if self.is_offline else 'ONLINE'}")
         
-        consecutive_errors = 0
-        max_consecutive_errors = 5
+        if self.config.get("app.engine.mode", "sync") == "async":
+            return self.run_async()
+        
+        # Lỗi ngoài đường truyền (trong lúc xử lý lô) cũng nghỉ theo backoff có jitter thay vì dừng bot
+        error_backoff = DecorrelatedJitter(1.0, 60.0)
+        
+        # Gửi nốt phản hồi còn trong outbox từ lần chạy trước
+        self.outbox.drain(self.deliver)
+        
+        # Tùy chọn: luồng nền long-poll tiếp trong lúc luồng chính xử lý lô hiện tại
+        self.prefetcher = PrefetchPoller.from_settings(
+            self.config.get("platforms.telegram.prefetch", {}),
+            self.fetch_updates,
+            self.last_update_id + 1,
+            idle_delay=self.poll_delay
+        )
+        if self.prefetcher is not None:
+            self.prefetcher.start()
         
         try:
             while True:
@@ -351,38 +402,64 @@ class OfflineAutoResponder:
                     # Kiểm tra trạng thái offline
                     self.check_offline_status()
                     
-                    # Lấy tin nhắn mới
-                    messages = self.get_updates_simple()
+                    # Lấy tin nhắn mới (lô đã prefetch sẵn nếu bật prefetch)
+                    messages = self.next_messages()
                     
-                    # Reset error counter nếu thành công
-                    consecutive_errors = 0
-                    
-                    # Xử lý từng tin nhắn
-                    for message in messages:
+                    # Phân loại cả lô một lần rồi xử lý từng tin nhắn
+                    template_ids = self.classify_batch(messages)
+                    for message, template_id in zip(messages, template_ids):
                         try:
-                            self.process_message(message)
+                            self.process_message(message, template_id)
                         except Exception as e:
                             logger.error(f"Lỗi khi xử lý tin nhắn: {e}")
+                    # Ghi cả lô phản hồi xuống đĩa (một transaction) rồi mới commit offset và gửi
+                    self.outbox.flush()
+                    self.checkpoint.commit(self.last_update_id)
+                    self.outbox.drain(self.deliver)
+                    error_backoff.reset()
                     
-                    # Nghỉ một chút
-                    time.sleep(3)
+                    # Long-polling: poll lại ngay; short-polling hoặc mất kết nối: nghỉ theo backoff
+                    # (khi prefetch, luồng nền tự nghỉ và next_messages() chờ lô kế tiếp)
+                    if self.prefetcher is None:
+                        time.sleep(self.poll_delay())
                     
                 except Exception as e:
-                    consecutive_errors += 1
-                    logger.error(f"Lỗi trong vòng lặp chính (lần {consecutive_errors}): {e}")
-                    
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.error("Quá nhiều lỗi liên tiếp, dừng bot")
-                        break
-                    
-                    time.sleep(10)
+                    delay = error_backoff.next()
+                    logger.error(f"Lỗi trong vòng lặp chính: {e} - thử lại sau {delay:.1f} giây")
+                    time.sleep(delay)
                     
         except KeyboardInterrupt:
             logger.info("Auto Responder đã bị dừng bởi người dùng")
         except Exception as e:
             logger.error(f"Lỗi nghiêm trọng: {e}")
         finally:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+                logger.info(f"Prefetch: {self.prefetcher.stats()}")
+            self.save_state()
+            self.config.flush()
+            logger.info(f"Thống kê kết nối Telegram: {self.client.connection_stats()}")
+            logger.info(f"Thống kê polling và độ trễ trả lời: {self.polling.stats()}")
+            if self.client.breaker is not None:
+                logger.info(f"Circuit breaker: {self.client.breaker.metrics()}")
+            logger.info(f"Outbox: {self.outbox.stats()}")
+            logger.info(f"Nạp lại cấu hình: {self.config.reload_stats()}, mẫu trả lời: {self.templates.reload_stats()}")
+            logger.info(f"Cache render: {self.templates.cache_stats()}, chuẩn hóa: {normalizer_cache_stats()}, ghi cấu hình: {self.config.persistence_stats()}")
+            self.outbox.close()
+            logger.info("Auto Responder đã dừng")
+
+    def run_async(self):
+        """Chạy bằng engine asyncio: nhận, dựng và gửi phản hồi song song (app.engine.mode = "async")"""
+        # Engine chỉ commit offset sau khi gửi xong nên không cần outbox; gửi nốt phần còn lại của chế độ đồng bộ
+        self.outbox.drain(self.deliver)
+        engine = engine_from_config(self.config, self.client, OfflineResponderHandler(self), self.checkpoint)
+        try:
+            run_engine(engine)
+        finally:
+            self.last_update_id = self.checkpoint.last
             self.save_state()
+            self.config.flush()
+            logger.info(f"Thống kê kết nối Telegram: {self.client.connection_stats()}")
             logger.info("Auto Responder đã dừng")
 
 def main():
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module hàng đợi phản hồi bền vững (outbox) trên SQLite ở chế độ WAL
+
+Phản hồi của một lô update được ghi vào outbox rồi mới commit offset, nên nếu tiến
+trình chết trước khi Telegram xác nhận sendMessage, phản hồi vẫn còn trên đĩa và
+được gửi lại khi khởi động (at-least-once: tin đã gửi nhưng chưa kịp xác nhận có thể
+bị gửi lại một lần).
+
+Group commit: enqueue() và ack() chỉ ghi vào bộ nhớ; flush() ghi tất cả trong một
+transaction, nên mỗi lô chỉ tốn một lần fsync thay vì một lần cho mỗi tin nhắn.
+"""
+
+import time
+import logging
+import sqlite3
+import threading
+
+from json_codec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id,
+    text TEXT NOT NULL,
+    meta TEXT,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class OutboxItem:
+    """Một phản hồi đang chờ gửi; `meta` là dict tùy ý (ví dụ date, user_id của tin nhắn gốc).
+
+    Hàm gửi đặt `retry_after` (giây) khi lần gửi bị hoãn chứ không lỗi (ví dụ Telegram trả 429),
+    và `rejected` khi lời gọi bị từ chối trước khi chạm tới mạng (circuit breaker đang mở).
+    """
+
+    __slots__ = ("id", "chat_id", "text", "meta", "attempts", "retry_after", "rejected")
+
+    def __init__(self, item_id, chat_id, text, meta, attempts):
+        self.id = item_id
+        self.chat_id = chat_id
+        self.text = text
+        self.meta = meta
+        self.attempts = attempts
+        self.retry_after = None
+        self.rejected = False
+
+
+class Outbox:
+    """Hàng đợi phản hồi trên SQLite (WAL), an toàn khi dùng từ nhiều luồng.
+
+    `synchronous` là PRAGMA synchronous của SQLite: "FULL" fsync mỗi lần flush()
+    (bền cả khi mất điện), "NORMAL" chỉ bền khi tiến trình chết.
+    Phản hồi lỗi đường truyền quá `max_attempts` lần bị bỏ để không chặn hàng đợi mãi;
+    phản hồi bị hoãn (`retry_after`) không tính là một lần lỗi, chat của nó chỉ được gửi tiếp
+    sau `retry_after` giây (các chat khác vẫn gửi bình thường). Lần gửi bị circuit breaker từ
+    chối (`rejected`) cũng không được tính, nên mất kết nối lâu không làm mất phản hồi.
+    """
+
+    def __init__(self, path, batch_size=100, max_attempts=20, synchronous="FULL"):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute(_SCHEMA)
+        self._pending = []
+        self._acks = []
+        self._retries = []
+        self._in_flight = set()
+        # chat_id -> thời điểm (monotonic) sớm nhất được gửi tiếp
+        self._not_before = {}
+        self.enqueued = 0
+        self.acked = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.rejected = 0
+        self.commits = 0
+        self.replayed = len(self)
+        if self.replayed:
+            logger.info(f"Outbox {path} còn {self.replayed} phản hồi chưa gửi từ lần chạy trước")
+
+    @classmethod
+    def from_settings(cls, settings, default_path="outbox.db"):
+        """Dựng từ mục `outbox` của cấu hình"""
+        options = {name: settings[name] for name in ("batch_size", "max_attempts", "synchronous") if name in settings}
+        return cls(settings.get("path", default_path), **options)
+
+    def __len__(self):
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return stored + len(self._pending) - len(self._acks)
+
+    def enqueue(self, chat_id, text, meta=None):
+        """Thêm một phản hồi; chỉ bền sau flush() (tự flush khi đủ `batch_size`)"""
+        with self._lock:
+            self._pending.append((chat_id, text, dumps(meta) if meta else None, time.time()))
+            self.enqueued += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Group commit: ghi mọi enqueue/ack/thử lại đang chờ trong một transaction"""
+        with self._lock:
+            if not (self._pending or self._acks or self._retries):
+                return 0
+            pending, acks, retries = self._pending, self._acks, self._retries
+            self._pending, self._acks, self._retries = [], [], []
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT INTO outbox (chat_id, text, meta, created) VALUES (?, ?, ?, ?)", pending)
+                self._conn.executemany("DELETE FROM outbox WHERE id = ?", ((item_id,) for item_id in acks))
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", ((item_id,) for item_id in retries))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                self._pending = pending + self._pending
+                self._acks = acks + self._acks
+                self._retries = retries + self._retries
+                raise
+            self.commits += 1
+            return len(pending) + len(acks)
+
+    def retry_in(self):
+        """Số giây tới khi chat bị hoãn sớm nhất được gửi tiếp; None nếu không có chat nào bị hoãn"""
+        with self._lock:
+            if not self._not_before:
+                return None
+            return max(0.0, min(self._not_before.values()) - time.monotonic())
+
+    def claim(self, limit=None):
+        """Lấy tối đa `limit` phản hồi cũ nhất chưa được luồng nào nhận gửi (bỏ qua chat đang bị hoãn)"""
+        self.flush()
+        with self._lock:
+            now = time.monotonic()
+            self._not_before = {chat_id: until for chat_id, until in self._not_before.items() if until > now}
+            deferred = list(self._not_before)
+            where = f"WHERE chat_id NOT IN ({', '.join('?' * len(deferred))}) " if deferred else ""
+            rows = self._conn.execute(
+                f"SELECT id, chat_id, text, meta, attempts FROM outbox {where}ORDER BY id LIMIT ?",
+                (*deferred, len(self._in_flight) + (limit or self.batch_size))
+            ).fetchall()
+            items = []
+            for item_id, chat_id, text, meta, attempts in rows:
+                if item_id in self._in_flight:
+                    continue
+                self._in_flight.add(item_id)
+                items.append(OutboxItem(item_id, chat_id, text, loads(meta) if meta else {}, attempts))
+                if len(items) >= (limit or self.batch_size):
+                    break
+            return items
+
+    def ack(self, item):
+        """Telegram đã xác nhận (hoặc từ chối hẳn): xóa khỏi outbox ở lần flush tiếp theo"""
+        with self._lock:
+            self._in_flight.discard(item.id)
+            self._acks.append(item.id)
+            self.acked += 1
+
+    def release(self, item):
+        """Gửi lỗi do đường truyền: trả lại hàng đợi, bỏ hẳn nếu đã thử quá `max_attempts` lần.
+
+        Nếu `item.retry_after` được đặt, phản hồi chỉ bị hoãn: không tính lần thử, chat đó được
+        gửi lại sau `retry_after` giây. Nếu `item.rejected`, phản hồi chưa được gửi đi: trả lại
+        hàng đợi mà không tính lần thử.
+        """
+        with self._lock:
+            self._in_flight.discard(item.id)
+            if item.rejected:
+                self.rejected += 1
+            elif item.retry_after is not None:
+                self._defer(item.chat_id, item.retry_after)
+            elif item.attempts + 1 >= self.max_attempts:
+                self._acks.append(item.id)
+                self.dropped += 1
+                logger.error(f"Bỏ phản hồi tới {item.chat_id} sau {item.attempts + 1} lần gửi lỗi")
+            else:
+                self._retries.append(item.id)
+
+    def defer(self, chat_id, delay):
+        """Chỉ gửi tiếp các phản hồi của `chat_id` sau `delay` giây (ví dụ Telegram trả 429)"""
+        with self._lock:
+            self._defer(chat_id, delay)
+
+    def _defer(self, chat_id, delay):
+        until = time.monotonic() + delay
+        self._not_before[chat_id] = max(until, self._not_before.get(chat_id, 0.0))
+        self.deferred += 1
+
+    def drain(self, send, limit=None):
+        """Gửi lần lượt mọi phản hồi bằng `send(item)`, flush sau mỗi đợt; trả về số phản hồi đã xong.
+
+        `send` trả về True khi Telegram xác nhận, False khi bị từ chối hẳn (cũng bị xóa),
+        None khi lỗi đường truyền hoặc mạch đang mở (`item.rejected`): phản hồi đó và các
+        phản hồi sau được giữ lại cho lần sau.
+        Phản hồi bị hoãn (None kèm `item.retry_after`) chỉ giữ lại các phản hồi cùng chat,
+        các chat khác vẫn được gửi tiếp.
+        """
+        done = 0
+        while True:
+            items = self.claim(limit)
+            if not items:
+                break
+            skipped = set()
+            for index, item in enumerate(items):
+                if item.chat_id in skipped:
+                    continue
+                try:
+                    result = send(item)
+                except Exception as e:
+                    logger.error(f"Lỗi khi gửi phản hồi từ outbox: {e}")
+                    result = None
+                if result is None and item.retry_after is not None and not item.rejected:
+                    # Giữ thứ tự trong chat: các phản hồi sau của chat này chờ cùng phản hồi bị hoãn
+                    self.release(item)
+                    skipped.add(item.chat_id)
+                    with self._lock:
+                        self._in_flight.difference_update(
+                            rest.id for rest in items[index + 1:] if rest.chat_id == item.chat_id)
+                    continue
+                if result is None:
+                    self.release(item)
+                    with self._lock:
+                        self._in_flight.difference_update(rest.id for rest in items[index + 1:])
+                    self.flush()
+                    return done
+                self.ack(item)
+                done += 1
+            self.flush()
+        return done
+
+    def stats(self):
+        return {
+            "queued": len(self),
+            "enqueued": self.enqueued,
+            "acked": self.acked,
+            "dropped": self.dropped,
+            "deferred": self.deferred,
+            "rejected": self.rejected,
+            "replayed": self.replayed,
+            "group_commits": self.commits
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module chiến lược polling getUpdates: long-polling có tự chuyển về short-polling khi mạng kém
+
+Ở chế độ long-polling, Telegram giữ yêu cầu tới `timeout` giây và trả về ngay khi có
+tin nhắn, nên bot poll lại ngay sau mỗi lô mà không cần ngủ. Nếu các lần long-poll
+liên tiếp bị lỗi (proxy/NAT cắt kết nối treo lâu...), bot chuyển sang short-polling
+(`timeout=0`, nghỉ `short_interval` giây giữa các lần) rồi thử lại long-polling sau
+`recovery_polls` lần short-poll thành công.
+
+Khi bật prefetch, record_success/record_failure chạy trên luồng nền còn luồng chính đọc
+`mode`/`failures` và ghi độ trễ, nên mọi trạng thái được giữ sau một khóa.
+"""
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """Giữ `window` mẫu độ trễ gần nhất (giây) và tính phân vị"""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        """Số mẫu và p50/p95/p99/max tính bằng mili giây"""
+        if not self.samples:
+            return {"count": self.count}
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "p50_ms": round(self._percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(self._percentile(ordered, 0.95) * 1000, 1),
+            "p99_ms": round(self._percentile(ordered, 0.99) * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1)
+        }
+
+
+class PollingStrategy:
+    """Chọn tham số getUpdates, thời gian nghỉ giữa các lần poll và đo độ trễ trả lời"""
+
+    def __init__(self, long_polling=True, timeout=30, limit=100, short_interval=3.0,
+                 failure_threshold=3, recovery_polls=10):
+        self.long_polling = long_polling
+        self.timeout = timeout
+        self.limit = limit
+        self.short_interval = short_interval
+        self.failure_threshold = failure_threshold
+        self.recovery_polls = recovery_polls
+        self.mode = "long" if long_polling else "short"
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.short_successes = 0
+        self.polls = 0
+        self.empty_polls = 0
+        # Thời điểm (Unix) lần poll thành công gần nhất trả về
+        self.polled_at = None
+        # Từ lúc poll trả về tới lúc gửi xong phản hồi / từ lúc khách gửi tới lúc gửi xong
+        self.poll_to_reply = LatencyStats()
+        self.message_to_reply = LatencyStats()
+
+    @classmethod
+    def from_settings(cls, settings, **defaults):
+        """Dựng từ mục cấu hình (`platforms.telegram` hoặc cấu hình của bot đơn giản)"""
+        options = dict(defaults)
+        for name in ("long_polling", "timeout", "limit", "short_interval", "failure_threshold", "recovery_polls"):
+            if name in settings:
+                options[name] = settings[name]
+        return cls(**options)
+
+    def params(self, max_wait=None):
+        """Tham số `timeout` và `limit` cho getUpdates ở chế độ hiện tại.
+
+        `max_wait` (giây) giới hạn thời gian long-poll, ví dụ khi có phản hồi bị hoãn phải gửi lại.
+        """
+        with self._lock:
+            timeout = self.timeout if self.mode == "long" else 0
+        if max_wait is not None:
+            timeout = min(timeout, math.ceil(max_wait))
+        return {"timeout": timeout, "limit": self.limit}
+
+    def record_success(self, count):
+        with self._lock:
+            self.polled_at = time.time()
+            self.polls += 1
+            self.failures = 0
+            if not count:
+                self.empty_polls += 1
+            if self.mode == "short" and self.long_polling:
+                self.short_successes += 1
+                if self.short_successes >= self.recovery_polls:
+                    self.mode = "long"
+                    logger.info("Mạng ổn định trở lại, dùng lại long-polling")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.mode == "long" and self.failures >= self.failure_threshold:
+                self.mode = "short"
+                self.short_successes = 0
+                logger.warning(f"{self.failures} lần long-poll lỗi liên tiếp, chuyển sang short-polling")
+
+    def delay(self):
+        """Số giây nghỉ trước lần poll tiếp theo (0 khi long-polling: poll lại ngay).
+
+        Sau một lần poll lỗi luôn nghỉ `short_interval` để không gọi dồn khi mất mạng.
+        """
+        with self._lock:
+            return 0 if self.mode == "long" and not self.failures else self.short_interval
+
+    def record_reply(self, message_date=None, polled_at=None):
+        """Ghi nhận một phản hồi vừa gửi xong.
+
+        `message_date` là thời điểm (Unix) khách gửi tin; `polled_at` là thời điểm (Unix) lần
+        poll đã lấy tin đó về (mặc định: lần poll gần nhất, chỉ đúng khi không prefetch).
+        """
+        now = time.time()
+        with self._lock:
+            polled_at = polled_at if polled_at is not None else self.polled_at
+            if polled_at is not None:
+                self.poll_to_reply.record(max(0.0, now - polled_at))
+            if message_date is not None:
+                self.message_to_reply.record(max(0.0, now - message_date))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "polls": self.polls,
+                "empty_polls": self.empty_polls,
+                "poll_to_reply": self.poll_to_reply.summary(),
+                "message_to_reply": self.message_to_reply.summary()
+            }
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module poller chạy nền: gọi getUpdates tiếp ngay khi biết offset mới
+
+Luồng nền long-poll liên tục và đưa từng lô update vào một hàng đợi có giới hạn; luồng
+chính lấy lô ra xử lý (dựng phản hồi, ghi outbox, commit offset, gửi). Nhờ vậy thời gian
+chờ mạng của lần poll sau chồng lên thời gian xử lý lô hiện tại. Khi xử lý chậm, hàng đợi
+đầy và luồng nền dừng lại chờ (backpressure) thay vì lấy thêm. Các lô được xử lý tuần tự
+theo đúng thứ tự nhận, nên thứ tự tin nhắn trong mỗi chat được giữ nguyên.
+
+Lưu ý: getUpdates với offset mới báo cho Telegram rằng các update trước đã nhận, nên nếu
+tiến trình chết, các lô còn nằm trong hàng đợi (tối đa `queue_size` lô) sẽ không được
+gửi lại; vì vậy hàng đợi nên nhỏ.
+"""
+
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchPoller:
+    """Luồng nền gọi `fetch(offset)` liên tục và đưa các lô update vào hàng đợi có giới hạn.
+
+    `fetch` trả về danh sách update thô (rỗng khi hết hạn long-poll hoặc khi lỗi);
+    `idle_delay()` là số giây nghỉ sau một lần poll rỗng/lỗi (0 khi long-polling).
+    Mỗi lô đi kèm thời điểm (Unix) nó được poll về, để đo độ trễ poll -> phản hồi đúng lô.
+    """
+
+    def __init__(self, fetch, offset, queue_size=2, idle_delay=None, name="telegram-prefetch"):
+        self.fetch = fetch
+        self.offset = offset
+        self.idle_delay = idle_delay or (lambda: 0)
+        self.batches = queue.Queue(maxsize=max(1, queue_size))
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+        self.fetched = 0
+        self.updates = 0
+        self.blocked = 0.0
+        self.max_depth = 0
+
+    @classmethod
+    def from_settings(cls, settings, fetch, offset, idle_delay=None):
+        """Dựng từ mục `prefetch` của cấu hình; None nếu chưa bật"""
+        if not settings.get("enabled", False):
+            return None
+        return cls(fetch, offset, settings.get("queue_size", 2), idle_delay)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            logger.info(f"Đã bật prefetch getUpdates (hàng đợi tối đa {self.batches.maxsize} lô)")
+        return self
+
+    def _put(self, batch):
+        started = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.batches.put(batch, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.blocked += time.monotonic() - started
+        self.max_depth = max(self.max_depth, self.batches.qsize())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                updates = self.fetch(self.offset)
+            except Exception as e:
+                logger.error(f"Lỗi trong luồng prefetch: {e}")
+                updates = []
+            if updates:
+                # Biết offset mới ngay khi nhận lô: poll tiếp trong lúc luồng chính xử lý lô này
+                self.offset = updates[-1]["update_id"] + 1
+                self.fetched += 1
+                self.updates += len(updates)
+                self._put((updates, time.time()))
+            else:
+                delay = self.idle_delay()
+                if delay:
+                    self._stop.wait(delay)
+
+    def get(self, timeout=None):
+        """(lô update, thời điểm poll) kế tiếp theo thứ tự nhận, hoặc None nếu chưa có sau `timeout` giây"""
+        try:
+            return self.batches.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self, timeout=1.0):
+        """Dừng luồng nền (lần long-poll đang dở chạy nốt trong luồng daemon)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "batches": self.fetched,
+            "updates": self.updates,
+            "queued": self.batches.qsize(),
+            "max_queued": self.max_depth,
+            "backpressure_seconds": round(self.blocked, 3)
+        }
+
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module giới hạn tốc độ gửi tin nhắn theo giới hạn của Telegram
+
+- Toàn cục: khoảng 30 tin nhắn/giây cho cả bot (một lượt mỗi ô 1/30 giây).
+- Mỗi chat: 1 tin nhắn/giây; nhóm (chat_id âm) thêm giới hạn 20 tin nhắn/phút.
+- Khi Telegram trả về 429 kèm `retry_after`, chat đó bị chặn đúng khoảng thời gian yêu cầu.
+
+Mỗi lần gửi "đặt chỗ" một thời điểm gửi thỏa mọi bucket liên quan rồi chờ tới lượt,
+nên các tin nhắn vượt giới hạn được xếp hàng theo thứ tự thay vì bị từ chối.
+Bucket của chat không hoạt động quá `idle_ttl` giây bị xóa để bộ nhớ không tăng mãi.
+
+Khi nhiều tiến trình cùng gửi cho một bot (webhook_server.py chế độ prefork), biến môi
+trường TELEGRAM_SHARED_STATE trỏ tới một tệp SQLite và mọi tiến trình dùng chung trạng
+thái giới hạn trong tệp đó (SharedRateLimiter).
+"""
+
+import os
+import math
+import time
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket `rate` token/giây dạng GCRA: lưu thời điểm token kế tiếp sẵn sàng.
+
+    Lượt gửi được tính vào thời điểm gửi dự kiến (không phải lúc đặt chỗ), nên tin nhắn
+    bị bucket khác giữ lại không làm bucket này vượt giới hạn. `capacity` > 1 cho phép
+    gửi dồn, nhưng khi đó một cửa sổ 1/rate giây có thể chứa tới capacity + rate lượt.
+    """
+
+    __slots__ = ("interval", "tolerance", "ready_at")
+
+    def __init__(self, rate, capacity=1):
+        self.interval = 1.0 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.ready_at = float("-inf")
+
+    def earliest(self, now):
+        """Thời điểm sớm nhất (>= now) bucket cho phép gửi"""
+        return max(now, self.ready_at - self.tolerance)
+
+    def take(self, at):
+        """Dùng một token cho lần gửi tại thời điểm `at`"""
+        self.ready_at = max(self.ready_at, at) + self.interval
+
+
+class SlotCalendar:
+    """Giới hạn toàn cục: thời gian chia thành các ô 1/rate giây, mỗi ô một lượt gửi.
+
+    Khác với TokenBucket, lượt đặt chỗ ở xa trong tương lai (nhóm đang phải chờ) không
+    chặn các lượt sớm hơn: mỗi lần gửi lấy ô trống đầu tiên từ thời điểm nó được phép.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.taken = set()
+        self.oldest = 0
+
+    def claim(self, at, latest=None):
+        """Lấy ô trống đầu tiên từ `at`; trả về thời điểm gửi hoặc None nếu muộn hơn `latest`"""
+        slot = math.ceil(at * self.rate - 1e-9)
+        while slot in self.taken:
+            slot += 1
+        moment = slot / self.rate
+        if latest is not None and moment > latest:
+            return None
+        self.taken.add(slot)
+        return moment
+
+    def prune(self, now):
+        """Bỏ các ô đã qua"""
+        current = math.floor(now * self.rate)
+        if current - self.oldest > len(self.taken):
+            self.taken = {slot for slot in self.taken if slot >= current}
+        else:
+            for slot in range(self.oldest, current):
+                self.taken.discard(slot)
+        self.oldest = current
+
+
+class _ChatState:
+    __slots__ = ("buckets", "blocked_until", "last_used")
+
+    def __init__(self, buckets, now):
+        self.buckets = buckets
+        self.blocked_until = 0.0
+        self.last_used = now
+
+
+class RateLimiter:
+    """Token bucket toàn cục và theo từng chat, an toàn khi dùng từ nhiều luồng"""
+
+    def __init__(self, global_per_second=30, private_per_second=1.0, group_per_minute=20,
+                 idle_ttl=600.0, clock=time.monotonic, sleep=time.sleep):
+        self.private_per_second = private_per_second
+        self.group_per_minute = group_per_minute
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._global = SlotCalendar(global_per_second)
+        self._global_blocked_until = 0.0
+        self._chats = {}
+        self._calls = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.throttled = 0
+        self.expired = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Dựng từ mục `rate_limit` của cấu hình; None nếu `enabled` là false"""
+        if not settings.get("enabled", True):
+            return None
+        options = {name: settings[name] for name in ("global_per_second", "private_per_second",
+                                                     "group_per_minute", "idle_ttl") if name in settings}
+        return cls(**options)
+
+    @staticmethod
+    def is_group(chat_id):
+        # Nhóm, siêu nhóm và kênh có chat_id âm hoặc dạng "@username"
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat(self, chat_id, now):
+        state = self._chats.get(chat_id)
+        if state is None:
+            # 20 tin/phút của nhóm chặt hơn 1 tin/giây nên nhóm chỉ cần một bucket
+            rate = self.group_per_minute / 60.0 if self.is_group(chat_id) else self.private_per_second
+            state = self._chats[chat_id] = _ChatState([TokenBucket(rate)], now)
+        return state
+
+    def _expire(self, now):
+        stale = [chat_id for chat_id, state in self._chats.items()
+                 if now - state.last_used > self.idle_ttl and now >= state.blocked_until]
+        for chat_id in stale:
+            del self._chats[chat_id]
+        self.expired += len(stale)
+
+    def _schedule(self, state, now, latest=None):
+        """Chọn thời điểm gửi thỏa mọi bucket và dùng token; None nếu muộn hơn `latest`"""
+        at = max(state.blocked_until, self._global_blocked_until,
+                 *(bucket.earliest(now) for bucket in state.buckets))
+        at = self._global.claim(at, latest)
+        if at is None:
+            return None
+        for bucket in state.buckets:
+            bucket.take(at)
+        state.last_used = at
+        return at
+
+    def reserve(self, chat_id):
+        """Đặt chỗ cho một tin nhắn; trả về số giây phải chờ trước khi gửi"""
+        with self._lock:
+            now = self.clock()
+            self._calls += 1
+            if self._calls % 256 == 0:
+                self._expire(now)
+                self._global.prune(now)
+            state = self._chat(chat_id, now)
+            at = self._schedule(state, now)
+            wait = at - now
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+            return wait
+
+    def acquire(self, chat_id):
+        """Chờ (chặn luồng hiện tại) tới lượt gửi cho chat; trả về số giây đã chờ"""
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def try_acquire(self, chat_id):
+        """Lấy lượt gửi ngay nếu không phải chờ; trả về False (không đặt chỗ) nếu phải chờ"""
+        with self._lock:
+            now = self.clock()
+            state = self._chat(chat_id, now)
+            # Ô toàn cục bắt đầu muộn hơn `now` chưa tới 1/rate giây vẫn được tính là gửi ngay
+            return self._schedule(state, now, latest=now + 1.0 / self._global.rate) is not None
+
+    def penalize(self, chat_id, retry_after):
+        """Telegram trả về 429: chặn chat (hoặc cả bot nếu chat_id là None) trong `retry_after` giây"""
+        with self._lock:
+            now = self.clock()
+            until = now + retry_after
+            self.throttled += 1
+            if chat_id is None:
+                self._global_blocked_until = max(self._global_blocked_until, until)
+            else:
+                state = self._chat(chat_id, now)
+                state.blocked_until = max(state.blocked_until, until)
+        logger.warning(f"Telegram yêu cầu chờ {retry_after} giây trước khi gửi tiếp cho {chat_id}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chats": len(self._chats),
+                "delayed": self.delayed,
+                "total_wait": round(self.total_wait, 3),
+                "throttled": self.throttled,
+                "expired": self.expired
+            }
+
+
+class SharedRateLimiter:
+    """RateLimiter dùng chung giữa nhiều tiến trình, trạng thái nằm trong một tệp SQLite (WAL).
+
+    Mỗi lần đặt chỗ là một transaction ngắn (BEGIN IMMEDIATE) nên các tiến trình thấy cùng
+    một giới hạn của bot. Khác RateLimiter: giới hạn toàn cục là token bucket thay cho
+    SlotCalendar, và đồng hồ là time.time() vì các tiến trình không chung time.monotonic().
+    """
+
+    GLOBAL = "*"
+
+    def __init__(self, path, global_per_second=30, private_per_second=1.0, group_per_minute=20,
+                 idle_ttl=600.0, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.global_interval = 1.0 / global_per_second
+        self.private_per_second = private_per_second
+        self.group_per_minute = group_per_minute
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Trạng thái giới hạn chỉ có ý nghĩa trong vài giây: không cần fsync
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limit (chat_key TEXT PRIMARY KEY, "
+                           "ready_at REAL NOT NULL, blocked_until REAL NOT NULL, last_used REAL NOT NULL)")
+        self._calls = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.throttled = 0
+        self.expired = 0
+
+    @classmethod
+    def from_settings(cls, settings, path):
+        """Dựng từ mục `rate_limit` của cấu hình; None nếu `enabled` là false"""
+        if not settings.get("enabled", True):
+            return None
+        options = {name: settings[name] for name in ("global_per_second", "private_per_second",
+                                                     "group_per_minute", "idle_ttl") if name in settings}
+        return cls(path, **options)
+
+    is_group = staticmethod(RateLimiter.is_group)
+
+    def _interval(self, chat_id):
+        rate = self.group_per_minute / 60.0 if self.is_group(chat_id) else self.private_per_second
+        return 1.0 / rate
+
+    def _schedule(self, chat_id, now, slack=None):
+        """Chọn thời điểm gửi và ghi lại; None (không đặt chỗ) nếu muộn hơn now + slack"""
+        key = str(chat_id)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = {row[0]: row[1:] for row in self._conn.execute(
+                "SELECT chat_key, ready_at, blocked_until FROM rate_limit WHERE chat_key IN (?, ?)",
+                (self.GLOBAL, key))}
+            global_ready, global_blocked = rows.get(self.GLOBAL, (0.0, 0.0))
+            chat_ready, chat_blocked = rows.get(key, (0.0, 0.0))
+            at = max(now, global_ready, global_blocked, chat_ready, chat_blocked)
+            if slack is not None and at > now + slack:
+                self._conn.execute("ROLLBACK")
+                return None
+            self._conn.executemany(
+                "INSERT INTO rate_limit (chat_key, ready_at, blocked_until, last_used) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT(chat_key) DO UPDATE SET ready_at = excluded.ready_at, last_used = excluded.last_used",
+                [(self.GLOBAL, max(global_ready, at) + self.global_interval, at),
+                 (key, max(chat_ready, at) + self._interval(chat_id), at)])
+            self._conn.execute("COMMIT")
+            return at
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _expire(self, now):
+        cursor = self._conn.execute(
+            "DELETE FROM rate_limit WHERE chat_key != ? AND last_used < ? AND blocked_until <= ?",
+            (self.GLOBAL, now - self.idle_ttl, now))
+        self.expired += cursor.rowcount
+
+    def reserve(self, chat_id):
+        """Đặt chỗ cho một tin nhắn; trả về số giây phải chờ trước khi gửi"""
+        with self._lock:
+            now = self.clock()
+            self._calls += 1
+            if self._calls % 256 == 0:
+                self._expire(now)
+            wait = self._schedule(chat_id, now) - now
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+            return wait
+
+    def acquire(self, chat_id):
+        """Chờ (chặn luồng hiện tại) tới lượt gửi cho chat; trả về số giây đã chờ"""
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def try_acquire(self, chat_id):
+        """Lấy lượt gửi ngay nếu không phải chờ; trả về False (không đặt chỗ) nếu phải chờ"""
+        with self._lock:
+            return self._schedule(chat_id, self.clock(), slack=self.global_interval) is not None
+
+    def penalize(self, chat_id, retry_after):
+        """Telegram trả về 429: chặn chat (hoặc cả bot nếu chat_id là None) trong `retry_after` giây"""
+        key = self.GLOBAL if chat_id is None else str(chat_id)
+        with self._lock:
+            now = self.clock()
+            self.throttled += 1
+            self._conn.execute(
+                "INSERT INTO rate_limit (chat_key, ready_at, blocked_until, last_used) VALUES (?, 0, ?, ?) "
+                "ON CONFLICT(chat_key) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until), "
+                "last_used = excluded.last_used", (key, now + retry_after, now))
+        logger.warning(f"Telegram yêu cầu chờ {retry_after} giây trước khi gửi tiếp cho {chat_id}")
+
+    def stats(self):
+        with self._lock:
+            chats = self._conn.execute("SELECT COUNT(*) FROM rate_limit WHERE chat_key != ?",
+                                       (self.GLOBAL,)).fetchone()[0]
+            return {
+                "chats": chats,
+                "delayed": self.delayed,
+                "total_wait": round(self.total_wait, 3),
+                "throttled": self.throttled,
+                "expired": self.expired,
+                "shared": self.path
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def shared_limiter(token, settings=None):
+    """Một RateLimiter cho mỗi token trong tiến trình (giới hạn của Telegram tính theo bot).
+
+    Nếu có biến môi trường TELEGRAM_SHARED_STATE thì dùng SharedRateLimiter trên tệp đó,
+    để các tiến trình worker của webhook_server.py chia nhau cùng một giới hạn.
+    """
+    with _limiters_lock:
+        if token not in _limiters:
+            shared_path = os.environ.get("TELEGRAM_SHARED_STATE")
+            if shared_path:
+                _limiters[token] = SharedRateLimiter.from_settings(settings or {}, shared_path)
+            else:
+                _limiters[token] = RateLimiter.from_settings(settings or {})
+        return _limiters[token]
@@ -7,7 +7,10 @@ Module quản lý các mẫu phản hồi tin nhắn
 
 import os
 import json
+import time
 import logging
+from file_watcher import FileWatcher
+from template_engine import TemplateRenderer, RenderCache
 
 logger = logging.getLogger(__name__)
 
@@ -15,10 +18,16 @@ logger = logging.getLogger(__name__)
 class ResponseTemplates:
     """Lớp quản lý các mẫu phản hồi tin nhắn"""
 
-    def __init__(self, templates_file="templates.json"):
-        """Khởi tạo với tệp mẫu phản hồi"""
+    def __init__(self, templates_file="templates.json", cache_size=1024, cache_max_age=300.0):
+        """Khởi tạo với tệp mẫu phản hồi; cache_size=0 để tắt cache kết quả render"""
         self.templates_file = templates_file
         self.templates = {}
+        cache = RenderCache(cache_size, cache_max_age) if cache_size else None
+        self.renderer = TemplateRenderer(cache=cache)
+        self.version = 0
+        self.reloads = {"reloads": 0, "errors": 0, "last_reload_ms": None}
+        self._watcher = None
+        self._own_stat = None
         self.load_templates()
         logger.info("ResponseTemplates đã được khởi tạo")
 
@@ -38,18 +47,73 @@ class ResponseTemplates:
             logger.error(f"Lỗi khi tải mẫu phản hồi: {str(e)}")
             # Tạo mẫu mặc định nếu có lỗi
             self.templates = self.create_default_templates()
+        self.precompile(self.templates)
+        self.version += 1
 
     def save_templates(self):
         """Lưu các mẫu phản hồi vào tệp JSON"""
         try:
             with open(self.templates_file, 'w', encoding='utf-8') as file:
                 json.dump(self.templates, file, ensure_ascii=False, indent=4)
+            st = os.stat(self.templates_file)
+            self._own_stat = (st.st_mtime_ns, st.st_size)
             logger.info(f"Đã lưu {len(self.templates)} mẫu phản hồi vào {self.templates_file}")
             return True
         except Exception as e:
             logger.error(f"Lỗi khi lưu mẫu phản hồi: {str(e)}")
             return False
 
+    def start_watching(self, interval=1.0):
+        """Bật nạp lại nóng tệp mẫu phản hồi khi tệp thay đổi"""
+        if self._watcher is None:
+            self._watcher = FileWatcher(self.templates_file, self.reload, interval).start()
+        return True
+
+    def reload(self):
+        """Đọc lại tệp mẫu ngoài luồng xử lý rồi thay bằng một phép gán tham chiếu"""
+        started = time.perf_counter()
+        try:
+            st = os.stat(self.templates_file)
+            if (st.st_mtime_ns, st.st_size) == self._own_stat:
+                return False
+            with open(self.templates_file, 'r', encoding='utf-8') as file:
+                templates = json.load(file)
+        except Exception as e:
+            self.reloads["errors"] += 1
+            logger.error(f"Lỗi khi nạp lại mẫu phản hồi, giữ nguyên phiên bản cũ: {str(e)}")
+            return False
+        self.precompile(templates)
+        self.templates = templates
+        self.version += 1
+        self.reloads["reloads"] += 1
+        self.reloads["last_reload_ms"] = (time.perf_counter() - started) * 1000
+        logger.info(f"Đã nạp lại {len(templates)} mẫu phản hồi (phiên bản {self.version}) trong {self.reloads['last_reload_ms']:.2f} ms")
+        return True
+
+    def cache_stats(self):
+        """Số lần trúng/trượt của cache kết quả render"""
+        if self.renderer.cache is None:
+            return {}
+        return self.renderer.cache.stats()
+
+    def reload_stats(self):
+        """Trả về phiên bản hiện tại và độ trễ của lần nạp lại gần nhất"""
+        return {**self.reloads, "version": self.version}
+
+    def precompile(self, templates):
+        """Biên dịch trước subject/body của mọi mẫu để lúc render không phải phân tích lại"""
+        for template in templates.values():
+            for field in ("subject", "body"):
+                if isinstance(template.get(field), str):
+                    self.renderer.compile(template[field])
+
+    def render(self, template, variables=None):
+        """Render subject và body của mẫu trong một lượt duyệt mỗi trường"""
+        return {
+            "subject": self.renderer.render_text(template.get("subject", ""), variables),
+            "body": self.renderer.render_text(template.get("body", ""), variables)
+        }
+
     def get_template(self, template_id):
         """Lấy mẫu phản hồi theo ID"""
         template = self.templates.get(template_id)
@@ -65,6 +129,7 @@ class ResponseTemplates:
     def add_template(self, template_id, template_content):
         """Thêm hoặc cập nhật mẫu phản hồi"""
         self.templates[template_id] = template_content
+        self.precompile({template_id: template_content})
         logger.info(f"Đã thêm/cập nhật mẫu phản hồi với ID: {template_id}")
         return self.save_templates()
 
@@ -1,8 +1,12 @@
 import json
 import time
 import logging
-import requests
 from datetime import datetime
+from checkpoint import OffsetCheckpoint
+from template_engine import TemplateRenderer, RenderCache
+from telegram_client import shared_client, http_options
+from polling import PollingStrategy
+from json_codec import load_file, dump_file
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -18,6 +22,11 @@ class SimpleAutoResponder:
         self.state_file = "responder_state.json"
         self.load_config()
         self.load_state()
+        self.checkpoint = OffsetCheckpoint("simple_offset.log", initial=self.state.get("last_update_id", 0))
+        self.last_update_id = self.checkpoint.last
+        self.renderer = TemplateRenderer(cache=RenderCache())
+        # check_interval chỉ dùng khi short-polling (tắt long_polling hoặc mạng kém)
+        self.polling = PollingStrategy.from_settings(self.config, short_interval=self.config["check_interval"])
         self.responded_messages = set()  
     def load_config(self):
         try:
@@ -38,8 +47,7 @@ class SimpleAutoResponder:
             json.dump(self.config, f, ensure_ascii=False, indent=2)
     def load_state(self):
         try:
-            with open(self.state_file, 'r', encoding='utf-8') as f:
-                self.state = json.load(f)
+            self.state = load_file(self.state_file)
         except FileNotFoundError:
             self.state = {
                 "is_online": False,
@@ -48,8 +56,7 @@ class SimpleAutoResponder:
             }
             self.save_state()
     def save_state(self):
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        dump_file(self.state, self.state_file)
     def set_online(self):
         self.state["is_online"] = True
         self.save_state()
@@ -61,32 +68,31 @@ class SimpleAutoResponder:
     def get_status(self):
         status = "ONLINE" if self.state["is_online"] else "OFFLINE"
         return f"🔄 Trạng thái hiện tại: {status}"
+    @property
+    def client(self):
+        return shared_client(
+            self.config["telegram_token"],
+            rate_limit=self.config.get("rate_limit", {}),
+            circuit_breaker=self.config.get("circuit_breaker", {}),
+            **http_options(self.config.get("http", {}))
+        )
+    def poll_delay(self):
+        """Nghỉ theo polling khi kết nối tốt, theo backoff của circuit breaker khi đang lỗi"""
+        breaker = self.client.breaker
+        return breaker.delay(self.polling.delay()) if breaker is not None else self.polling.delay()
     def get_telegram_updates(self):
         try:
-            url = f"https://api.telegram.org/bot{self.config['telegram_token']}/getUpdates"
-            params = {
-                "offset": self.state["last_update_id"] + 1,
-                "timeout": 10
-            }
-            response = requests.get(url, params=params, timeout=15)
-            if response.status_code == 200:
-                data = response.json()
-                if data["ok"]:
-                    return data["result"]
-            return []
+            updates = self.client.get_updates(offset=self.last_update_id + 1, **self.polling.params())
+            self.polling.record_success(len(updates))
+            return updates
         except Exception as e:
+            self.polling.record_failure()
             logger.error(f"Lỗi khi lấy tin nhắn: {e}")
             return []
     def send_telegram_message(self, chat_id, text):
         try:
-            url = f"https://api.telegram.org/bot{self.config['telegram_token']}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, json=data, timeout=10)
-            return response.status_code == 200
+            self.client.send_message(chat_id, text, parse_mode="HTML")
+            return True
         except Exception as e:
             logger.error(f"Lỗi khi gửi tin nhắn: {e}")
             return False
@@ -104,10 +110,11 @@ class SimpleAutoResponder:
             if message["from"].get("last_name"):
                 sender_name += " " + message["from"]["last_name"]
             if self.state["is_online"]:
-                response_text = self.config["messages"]["online"].format(name=sender_name)
+                response_text = self.renderer.render_text(self.config["messages"]["online"], {"name": sender_name})
             else:
-                response_text = self.config["messages"]["offline"].format(name=sender_name)
+                response_text = self.renderer.render_text(self.config["messages"]["offline"], {"name": sender_name})
             if self.send_telegram_message(chat_id, response_text):
+                self.polling.record_reply(message["date"])
                 self.responded_messages.add(unique_id)
                 logger.info(f"✅ Đã trả lời {sender_name} (ID: {chat_id})")
             else:
@@ -122,16 +129,19 @@ class SimpleAutoResponder:
             while True:
                 updates = self.get_telegram_updates()
                 for update in updates:
-                    self.state["last_update_id"] = update["update_id"]
-                    self.save_state()
+                    self.last_update_id = update["update_id"]
                     self.process_message(update)
+                self.checkpoint.commit(self.last_update_id)
                 if len(self.responded_messages) > 1000:
                     self.responded_messages = set(list(self.responded_messages)[-500:])
-                time.sleep(self.config["check_interval"])
+                time.sleep(self.poll_delay())
         except KeyboardInterrupt:
             logger.info("🛑 Đã dừng Auto Responder")
         except Exception as e:
             logger.error(f"❌ Lỗi không mong muốn: {e}")
+        finally:
+            logger.info(f"📊 Thống kê kết nối Telegram: {self.client.connection_stats()}")
+            logger.info(f"📊 Thống kê polling và độ trễ trả lời: {self.polling.stats()}")
 
 def main():
     responder = SimpleAutoResponder()
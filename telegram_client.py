@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module client HTTP dùng chung cho mọi lời gọi Telegram Bot API
+
+Mỗi client giữ một requests.Session với pool kết nối keep-alive, nên các lần gọi
+getUpdates/sendMessage liên tiếp dùng lại kết nối TCP/TLS đã mở thay vì bắt tay lại.
+Client còn đếm số kết nối mới được mở để báo tỉ lệ dùng lại kết nối.
+"""
+
+import os
+import json
+import socket
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import Retry
+
+from rate_limiter import shared_limiter
+from circuit_breaker import shared_breaker
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.telegram.org"
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Các khóa trong mục `platforms.telegram.http` của config.json
+HTTP_OPTIONS = ("base_url", "pool_connections", "pool_maxsize", "connect_timeout", "read_timeout", "keep_alive")
+
+
+class TelegramAPIError(Exception):
+    """Telegram trả về ok=false (kèm error_code, description và retry_after nếu có)"""
+
+    def __init__(self, method, error_code, description, retry_after=None):
+        super().__init__(f"{method}: [{error_code}] {description}")
+        self.method = method
+        self.error_code = error_code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class ConnectionStats:
+    """Bộ đếm lời gọi API và kết nối mới (mỗi kết nối mới = một lần bắt tay TCP/TLS)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def request_sent(self, failed=False):
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(0, self.requests - self.connections)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "handshakes": self.connections,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0
+            }
+
+
+def _counting_pool(base, stats):
+    class CountingConnectionPool(base):
+        def _new_conn(self):
+            stats.connection_opened()
+            return super()._new_conn()
+
+    CountingConnectionPool.__name__ = f"Counting{base.__name__}"
+    return CountingConnectionPool
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter có pool đếm kết nối mới và bật TCP keep-alive nếu được yêu cầu"""
+
+    def __init__(self, stats, keep_alive=True, **kwargs):
+        self._stats = stats
+        self._keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._keep_alive:
+            kwargs["socket_options"] = list(HTTPConnection.default_socket_options) + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._stats),
+            "https": _counting_pool(HTTPSConnectionPool, self._stats),
+        }
+
+
+class TelegramClient:
+    """Client Telegram Bot API với pool kết nối dùng lại giữa các lời gọi.
+
+    `connect_timeout`/`read_timeout` áp dụng cho mọi lời gọi; với getUpdates dạng
+    long-polling, thời gian chờ đọc được cộng thêm `timeout` của lời gọi.
+    `retries` > 0 bật thử lại (có backoff) cho lỗi 5xx của các lời gọi GET.
+    Nếu có `rate_limiter`, sendMessage chờ tới lượt theo giới hạn của Telegram và
+    khi gặp 429 thì chờ `retry_after` rồi gửi lại (tối đa `max_throttle_retries` lần).
+    Nếu có `breaker`, lỗi mạng/5xx được đếm và khi mạch mở mọi lời gọi ném
+    CircuitOpenError ngay thay vì chờ timeout.
+    """
+
+    def __init__(self, token, base_url=DEFAULT_BASE_URL, pool_connections=4, pool_maxsize=32,
+                 connect_timeout=5.0, read_timeout=10.0, keep_alive=True, verify=True,
+                 retries=0, backoff_factor=0.0, user_agent="TelegramBot/2.0", rate_limiter=None,
+                 max_throttle_retries=3, breaker=None):
+        self.token = token
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        self.max_throttle_retries = max_throttle_retries
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.verify = verify
+        self.pool_maxsize = pool_maxsize
+        self.stats = ConnectionStats()
+        max_retries = Retry(total=retries, backoff_factor=backoff_factor,
+                            status_forcelist=[500, 502, 503, 504]) if retries else 0
+        adapter = _PoolAdapter(
+            self.stats,
+            keep_alive=keep_alive,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries
+        )
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": user_agent})
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, method):
+        return f"{self.base_url}/bot{self.token}/{method}"
+
+    def call(self, method, params=None, timeout=None, http_method="POST"):
+        """Gọi một phương thức Bot API và trả về trường `result`.
+
+        Ném TelegramAPIError khi Telegram trả về ok=false; lỗi mạng (requests.RequestException)
+        được ném tiếp cho nơi gọi tự quyết định thử lại. Ném CircuitOpenError khi mạch đang mở.
+        """
+        if self.breaker is None:
+            return self._call(method, params, timeout, http_method)
+        self.breaker.check()
+        try:
+            result = self._call(method, params, timeout, http_method)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        except TelegramAPIError as e:
+            # Chỉ lỗi phía máy chủ mới là lỗi đường truyền; 4xx/429 nghĩa là Telegram vẫn trả lời
+            if isinstance(e.error_code, int) and e.error_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except Exception:
+            # Lỗi cục bộ (ví dụ lỗi mã hóa JSON, tham số sai) không phải lỗi đường truyền nhưng vẫn
+            # phải kết thúc lượt thăm dò half-open, nếu không breaker kẹt ở half_open
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _call(self, method, params, timeout, http_method):
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        try:
+            if http_method == "GET":
+                response = self.session.get(self._url(method), params=params, timeout=timeout, verify=self.verify)
+            else:
+                response = self.session.post(self._url(method), data=json_codec.dumps(params).encode("utf-8"),
+                                             headers=_JSON_HEADERS, timeout=timeout, verify=self.verify)
+        except requests.RequestException:
+            self.stats.request_sent(failed=True)
+            raise
+        try:
+            data = json_codec.loads(response.content)
+        except ValueError:
+            self.stats.request_sent(failed=True)
+            response.raise_for_status()
+            raise TelegramAPIError(method, response.status_code, "Phản hồi không phải JSON")
+        if not isinstance(data, dict):
+            # Proxy hoặc base_url cấu hình sai có thể trả về JSON hợp lệ nhưng không phải object
+            self.stats.request_sent(failed=True)
+            raise TelegramAPIError(method, response.status_code, "Phản hồi JSON không phải object")
+        if not data.get("ok", False):
+            self.stats.request_sent(failed=True)
+            raise TelegramAPIError(
+                method,
+                data.get("error_code", response.status_code),
+                data.get("description", "Unknown error"),
+                data.get("parameters", {}).get("retry_after")
+            )
+        self.stats.request_sent()
+        return data.get("result")
+
+    def get_me(self):
+        return self.call("getMe", http_method="GET")
+
+    def get_updates(self, offset=None, timeout=0, limit=100, allowed_updates=None):
+        """Lấy danh sách update thô; `timeout` > 0 là long-polling phía server"""
+        params = {"timeout": timeout, "limit": limit}
+        if offset is not None:
+            params["offset"] = offset
+        if allowed_updates is not None:
+            params["allowed_updates"] = json.dumps(allowed_updates)
+        return self.call("getUpdates", params, timeout=(self.connect_timeout, self.read_timeout + timeout),
+                         http_method="GET") or []
+
+    def send_message(self, chat_id, text, parse_mode="HTML", **extra):
+        params = {"chat_id": chat_id, "text": text, **extra}
+        if parse_mode:
+            params["parse_mode"] = parse_mode
+        if self.rate_limiter is None:
+            return self.call("sendMessage", params)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(chat_id)
+            try:
+                return self.call("sendMessage", params)
+            except TelegramAPIError as e:
+                if e.error_code != 429 or attempt >= self.max_throttle_retries:
+                    raise
+                attempt += 1
+                self.rate_limiter.penalize(chat_id, e.retry_after or 1)
+
+    def set_webhook(self, url, **extra):
+        return self.call("setWebhook", {"url": url, **extra})
+
+    def delete_webhook(self, **extra):
+        return self.call("deleteWebhook", extra)
+
+    def connection_stats(self):
+        """Số lời gọi, số lần bắt tay (kết nối mới) và tỉ lệ dùng lại kết nối"""
+        return self.stats.snapshot()
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(token, rate_limit=None, circuit_breaker=None, **options):
+    """Trả về client dùng chung trong tiến trình cho cùng token và tùy chọn.
+
+    `rate_limit` và `circuit_breaker` là mục cấu hình của RateLimiter/CircuitBreaker; mọi
+    client cùng token dùng chung một bộ giới hạn và một breaker vì Telegram tính theo bot.
+    """
+    key = (token, tuple(sorted(options.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = TelegramClient(
+                token,
+                rate_limiter=shared_limiter(token, rate_limit),
+                breaker=shared_breaker(token, circuit_breaker),
+                **options
+            )
+            logger.debug(f"Đã tạo TelegramClient mới ({client.base_url})")
+        return client
+
+
+def http_options(settings):
+    """Lọc các tùy chọn client từ mục `platforms.telegram.http` của cấu hình.
+
+    Biến môi trường TELEGRAM_API_BASE_URL (nếu có) ghi đè `base_url`, để trỏ mọi bot
+    vào máy chủ giả lập (fake_telegram_server.py) mà không phải sửa cấu hình.
+    """
+    options = {name: settings[name] for name in HTTP_OPTIONS if name in (settings or {})}
+    if os.environ.get("TELEGRAM_API_BASE_URL"):
+        options["base_url"] = os.environ["TELEGRAM_API_BASE_URL"]
+    return options
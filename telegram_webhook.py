@@ -3,15 +3,27 @@
 
 """
 Telegram Bot với Webhook thay vì polling
+
+Route /webhook chỉ kiểm tra update, xếp vào hàng đợi và trả 200 ngay; các worker của
+WebhookDispatcher dựng phản hồi và gửi, nên Telegram không phải chờ sendMessage.
+Với tin nhắn chỉ có một phản hồi, phản hồi được trả thẳng trong HTTP response
+({"method": "sendMessage", ...}) nếu giới hạn tốc độ cho phép, khỏi tốn một lời gọi API.
+
+Chạy trực tiếp file này dùng máy chủ đa luồng; nhiều tiến trình thì chạy webhook_server.py.
 """
 
+import os
 import json
+import atexit
 import logging
-import requests
 from flask import Flask, request, jsonify
 from message_handler import MessageHandler
 from response_templates import ResponseTemplates
 from config import Config
+from text_normalizer import cache_stats as normalizer_cache_stats
+from telegram_client import TelegramAPIError
+from webhook_dispatcher import WebhookDispatcher, SharedDedup
+from async_engine import message_from_update
 
 # Thiết lập logging
 logging.basicConfig(
@@ -25,109 +37,151 @@ app = Flask(__name__)
 # Khởi tạo các thành phần
 config = Config()
 templates = ResponseTemplates()
-message_handler = MessageHandler(config, templates)
+# webhook_server.py (chế độ prefork) đặt WEBHOOK_WORKER_ID cho mỗi tiến trình worker: mỗi
+# worker một outbox riêng, còn update đã nhận và giới hạn tốc độ dùng chung qua
+# tệp SQLite TELEGRAM_SHARED_STATE
+worker_id = os.environ.get("WEBHOOK_WORKER_ID")
+shared_state = os.environ.get("TELEGRAM_SHARED_STATE")
+outbox_path = None
+if worker_id is not None:
+    root, ext = os.path.splitext(config.get("platforms.telegram.outbox.path", "outbox.db"))
+    outbox_path = f"{root}.worker{worker_id}{ext}"
+message_handler = MessageHandler(config, templates, outbox_path=outbox_path)
+if config.start_watching():
+    templates.start_watching(config.get("app.hot_reload.interval", 1.0))
+
+webhook_settings = config.get("platforms.telegram.webhook", {})
+
+def process_update(update):
+    """Chạy trong worker: dựng phản hồi cho một update rồi gửi; True nếu đã gửi được"""
+    message = message_from_update(update)
+    if message is None:
+        return False
+    response = message_handler.create_response(message)
+    if not response:
+        return False
+    sent = message_handler.reply_telegram(message, response)
+    if sent:
+        logger.info(f"Đã xử lý phản hồi cho tin nhắn từ {message['sender']}")
+    return sent
+
+# Worker 0 gửi lại định kỳ các phản hồi còn nằm trong outbox (lỗi mạng, lần chạy trước)
+dedup = SharedDedup(shared_state, webhook_settings.get("dedup_size", 10000)) if shared_state else None
+dispatcher = WebhookDispatcher.from_settings(webhook_settings, process_update,
+                                             idle=message_handler.deliver_replies, dedup=dedup).start()
+# Khi tắt: xử lý nốt các update đã trả 200 rồi mới thoát
+atexit.register(dispatcher.stop)
+
+def inline_reply(update):
+    """Phản hồi trả thẳng trong HTTP response của webhook; None nếu phải gửi qua worker.
+
+    Chỉ dùng khi chat không còn update nào đang chờ worker (giữ thứ tự) và bộ giới hạn tốc độ
+    cho gửi ngay. Telegram không báo kết quả của lời gọi này, nên nó không đi qua outbox.
+    """
+    message = message_from_update(update)
+    if message is None or dispatcher.has_pending(message["chat_id"]):
+        return None
+    response = message_handler.create_response(message)
+    body = response.get("body") if response else None
+    if not body:
+        return None
+    client = message_handler.telegram_client()
+    limiter = client.rate_limiter if client is not None else None
+    if limiter is not None and not limiter.try_acquire(message["chat_id"]):
+        return None
+    message_handler.polling.record_reply(message["date"])
+    dispatcher.record_inline()
+    return {"method": "sendMessage", "chat_id": message["chat_id"], "text": body, "parse_mode": "HTML"}
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    """Xử lý webhook từ Telegram"""
+    """Nhận update từ Telegram: kiểm tra, xếp hàng và trả 200 ngay"""
+    secret_token = webhook_settings.get("secret_token")
+    if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+        return jsonify({'status': 'error', 'message': 'Invalid secret token'}), 403
+    
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or not isinstance(update.get('update_id'), int):
+        return jsonify({'status': 'error', 'message': 'No data received'}), 400
+    
+    logger.debug(f"Nhận được update: {update['update_id']}")
+    if dispatcher.is_duplicate(update['update_id']):
+        return jsonify({'status': 'duplicate'}), 200
     try:
-        update = request.get_json()
-        
-        if not update:
-            return jsonify({'status': 'error', 'message': 'No data received'}), 400
-        
-        logger.info(f"Nhận được update: {update}")
-        
-        # Xử lý tin nhắn
-        if 'message' in update:
-            message_data = update['message']
-            
-            # Chỉ xử lý tin nhắn text
-            if 'text' in message_data:
-                # Tạo message object theo format của bot
-                message = {
-                    "platform": "telegram",
-                    "chat_id": message_data["chat"]["id"],
-                    "sender": message_data["from"].get("username", message_data["from"].get("first_name", "Unknown")),
-                    "content": message_data.get("text", ""),
-                    "timestamp": str(message_data["date"]),
-                    "message_id": message_data["message_id"]
-                }
-                
-                # Tạo phản hồi
-                response = message_handler.create_response(message)
-                
-                if response:
-                    # Gửi phản hồi
-                    success = message_handler.send_response(message, response)
-                    if success:
-                        logger.info(f"Đã gửi phản hồi cho tin nhắn từ {message['sender']}")
-                    else:
-                        logger.error("Không thể gửi phản hồi")
-        
-        return jsonify({'status': 'ok'}), 200
-        
-    except Exception as e:
-        logger.error(f"Lỗi khi xử lý webhook: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        reply = inline_reply(update) if webhook_settings.get("inline_reply", True) else None
+        if reply is not None:
+            return jsonify(reply), 200
+        status = dispatcher.enqueue(update)
+    except Exception:
+        # Trả 500 thì Telegram gửi lại update này: bỏ đánh dấu đã thấy để lần đó không bị coi là trùng
+        dispatcher.forget(update['update_id'])
+        raise
+    if status == "full":
+        # Không trả 200 để Telegram gửi lại update này sau
+        logger.warning(f"Hàng đợi webhook đầy, từ chối update {update['update_id']}")
+        return jsonify({'status': 'error', 'message': 'Queue full'}), 503
+    return jsonify({'status': status}), 200
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'bot': 'running'}), 200
+    client = message_handler.telegram_client()
+    connections = client.connection_stats() if client is not None else None
+    return jsonify({
+        'status': 'healthy',
+        'bot': 'running',
+        'worker': worker_id,
+        'pid': os.getpid(),
+        'connections': connections,
+        'transport': message_handler.transport_metrics(),
+        'webhook': dispatcher.metrics(),
+        'config': config.reload_stats(),
+        'templates': templates.reload_stats(),
+        'caches': {'render': templates.cache_stats(), 'normalizer': normalizer_cache_stats()},
+        'persistence': config.persistence_stats()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Độ sâu hàng đợi webhook và độ trễ từ lúc nhận update tới lúc gửi phản hồi"""
+    return jsonify(dispatcher.metrics()), 200
 
 def set_webhook():
     """Thiết lập webhook cho bot"""
-    token = config.get("credentials.telegram.token")
-    if not token:
+    client = message_handler.telegram_client()
+    if client is None:
         logger.error("Không tìm thấy token Telegram")
         return False
     
-    # URL webhook - bạn cần thay đổi thành URL công khai của bạn
-    webhook_url = "https://your-domain.com/webhook"  # Thay đổi URL này
-    
-    url = f"https://api.telegram.org/bot{token}/setWebhook"
-    data = {
-        "url": webhook_url
-    }
+    # URL webhook - đặt URL công khai của bạn trong platforms.telegram.webhook.url
+    webhook_url = webhook_settings.get("url") or "https://your-domain.com/webhook"
+    options = {"secret_token": webhook_settings["secret_token"]} if webhook_settings.get("secret_token") else {}
     
     try:
-        response = requests.post(url, json=data)
-        response.raise_for_status()
-        
-        result = response.json()
-        if result.get('ok'):
-            logger.info(f"Webhook đã được thiết lập thành công: {webhook_url}")
-            return True
-        else:
-            logger.error(f"Lỗi khi thiết lập webhook: {result.get('description')}")
-            return False
-            
+        client.set_webhook(webhook_url, **options)
+        logger.info(f"Webhook đã được thiết lập thành công: {webhook_url}")
+        return True
+    except TelegramAPIError as e:
+        logger.error(f"Lỗi khi thiết lập webhook: {e.description}")
+        return False
     except Exception as e:
         logger.error(f"Lỗi khi thiết lập webhook: {e}")
         return False
 
 def delete_webhook():
     """Xóa webhook (chuyển về polling)"""
-    token = config.get("credentials.telegram.token")
-    if not token:
+    client = message_handler.telegram_client()
+    if client is None:
         logger.error("Không tìm thấy token Telegram")
         return False
     
-    url = f"https://api.telegram.org/bot{token}/deleteWebhook"
-    
     try:
-        response = requests.post(url)
-        response.raise_for_status()
-        
-        result = response.json()
-        if result.get('ok'):
-            logger.info("Webhook đã được xóa thành công")
-            return True
-        else:
-            logger.error(f"Lỗi khi xóa webhook: {result.get('description')}")
-            return False
-            
+        client.delete_webhook()
+        logger.info("Webhook đã được xóa thành công")
+        return True
+    except TelegramAPIError as e:
+        logger.error(f"Lỗi khi xóa webhook: {e.description}")
+        return False
     except Exception as e:
         logger.error(f"Lỗi khi xóa webhook: {e}")
         return False
@@ -138,5 +192,6 @@ if __name__ == '__main__':
     # Xóa webhook cũ trước (nếu có)
     delete_webhook()
     
-    # Chạy Flask app
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Chạy Flask app bằng máy chủ đa luồng (xem webhook_server.py)
+    from webhook_server import serve_app
+    serve_app(app, webhook_settings)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module biên dịch và render mẫu phản hồi trong một lượt duyệt
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+class CompiledTemplate:
+    """Mẫu đã được tách sẵn thành các đoạn chữ cố định và placeholder"""
+
+    __slots__ = ("source", "parts", "slots", "placeholders", "names")
+
+    def __init__(self, source):
+        parts = []
+        slots = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(source):
+            parts.append(source[position:match.start()])
+            slots.append((len(parts), match.group(1)))
+            parts.append(match.group(0))
+            position = match.end()
+        parts.append(source[position:])
+        self.source = source
+        self.parts = parts
+        self.slots = tuple(slots)
+        self.placeholders = frozenset(name for _, name in slots)
+        self.names = tuple(sorted(self.placeholders))
+
+
+class VariableRegistry:
+    """Bảng các biến tự tính (thời gian, ngày...) dùng được trong mọi mẫu"""
+
+    def __init__(self):
+        self._providers = {}
+        self._granularity = {}
+
+    def register(self, name, provider, granularity=None):
+        """Đăng ký biến `name`; `provider(now)` trả về giá trị của biến.
+
+        `granularity` là số giây giá trị giữ nguyên (60 với giờ:phút, 86400 với
+        ngày); None nghĩa là không biết trước, mẫu dùng biến này sẽ không được cache.
+        """
+        self._providers[name] = provider
+        self._granularity[name] = granularity
+
+    def unregister(self, name):
+        self._providers.pop(name, None)
+        self._granularity.pop(name, None)
+
+    def get(self, name):
+        return self._providers.get(name)
+
+    def granularity(self, name):
+        return self._granularity.get(name)
+
+    def copy(self):
+        registry = VariableRegistry()
+        registry._providers = dict(self._providers)
+        registry._granularity = dict(self._granularity)
+        return registry
+
+
+def default_registry():
+    """Các biến mặc định: {current_time}, {current_date}"""
+    registry = VariableRegistry()
+    registry.register("current_time", lambda now: now.strftime("%H:%M:%S"), granularity=1)
+    registry.register("current_date", lambda now: now.strftime("%d/%m/%Y"), granularity=86400)
+    return registry
+
+
+class RenderCache:
+    """Cache LRU cho kết quả render, giới hạn theo số mục và theo tuổi"""
+
+    def __init__(self, max_size=1024, max_age=300.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if time.monotonic() - stored_at <= self.max_age:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+class TemplateRenderer:
+    """Render mẫu đã biên dịch: mỗi placeholder được thay một lần, ghép bằng một lần join"""
+
+    MAX_COMPILED = 1024
+
+    def __init__(self, registry=None, cache=None):
+        self.registry = registry or default_registry()
+        self.cache = cache
+        self._compiled = {}
+
+    def compile(self, source):
+        """Biên dịch (có bộ nhớ đệm theo nội dung) một chuỗi mẫu"""
+        compiled = self._compiled.get(source)
+        if compiled is None:
+            if len(self._compiled) >= self.MAX_COMPILED:
+                self._compiled = {}
+            compiled = self._compiled[source] = CompiledTemplate(source)
+        return compiled
+
+    def _cache_key(self, compiled, variables):
+        # Khóa = mẫu + giá trị các biến mẫu thực sự dùng + mốc thời gian theo biến thời gian nhỏ nhất
+        values = []
+        granularity = 0
+        for name in compiled.names:
+            value = variables.get(name)
+            if value is None and self.registry.get(name) is not None:
+                step = self.registry.granularity(name)
+                if step is None:
+                    return None
+                granularity = step if not granularity else min(granularity, step)
+            values.append(value)
+        bucket = 0
+        if granularity:
+            now = time.time()
+            bucket = int((now + time.localtime(now).tm_gmtoff) // granularity)
+        return compiled, tuple(values), bucket
+
+    def render(self, compiled, variables=None):
+        """Render mẫu; biến không có giá trị và không được đăng ký sẽ được giữ nguyên"""
+        if not compiled.slots:
+            return compiled.source
+        variables = variables or {}
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(compiled, variables)
+            if key is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+        text = self._render(compiled, variables)
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    def _render(self, compiled, variables):
+        parts = compiled.parts.copy()
+        now = None
+        for index, name in compiled.slots:
+            value = variables.get(name)
+            if value is None:
+                provider = self.registry.get(name)
+                if provider is None:
+                    continue
+                if now is None:
+                    now = datetime.now()
+                value = provider(now)
+            parts[index] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
+
+    def render_text(self, source, variables=None):
+        return self.render(self.compile(source), variables)
@@ -5,9 +5,15 @@
 Script kiểm tra kết nối Telegram Bot
 """
 
+import os
 import requests
 import json
 
+def api_base_url(config):
+    """URL gốc của Bot API: TELEGRAM_API_BASE_URL, rồi platforms.telegram.http.base_url, rồi Telegram thật"""
+    http = config.get('platforms', {}).get('telegram', {}).get('http', {})
+    return (os.environ.get('TELEGRAM_API_BASE_URL') or http.get('base_url') or 'https://api.telegram.org').rstrip('/')
+
 def test_telegram_bot():
     """Kiểm tra kết nối và thông tin bot Telegram"""
     
@@ -28,7 +34,7 @@ def test_telegram_bot():
     
     # Test getMe API
     try:
-        url = f"https://api.telegram.org/bot{token}/getMe"
+        url = f"{api_base_url(config)}/bot{token}/getMe"
         response = requests.get(url, timeout=10)
         response.raise_for_status()
         
@@ -67,7 +73,7 @@ def test_get_updates():
     print("\nĐang kiểm tra getUpdates...")
     
     try:
-        url = f"https://api.telegram.org/bot{token}/getUpdates"
+        url = f"{api_base_url(config)}/bot{token}/getUpdates"
         params = {
             "limit": 5,
             "timeout": 5
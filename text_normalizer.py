@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module chuẩn hóa văn bản tiếng Việt để so khớp không phân biệt dấu
+
+Bỏ dấu làm nhiều từ khác nghĩa trùng nhau ("gặp"/"gấp", "gia"/"giá", "mùa"/"mua"), nên
+bộ so khớp chỉ dùng dạng bỏ dấu (normalize) cho tin nhắn gõ không dấu; tin nhắn có dấu
+được so bằng dạng giữ dấu (normalize_accented).
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Bỏ mọi dấu kết hợp (thanh điệu, mũ, móc, trăng...) sau khi tách NFD, gộp đ/Đ thành d
+_COMBINING_RANGES = ((0x0300, 0x036F), (0x1AB0, 0x1AFF), (0x1DC0, 0x1DFF), (0x20D0, 0x20FF))
+_FOLD_TABLE = {code: None for start, end in _COMBINING_RANGES for code in range(start, end + 1)}
+_FOLD_TABLE.update({ord("đ"): "d", ord("Đ"): "d"})
+
+CACHE_SIZE = 4096
+MAX_CACHED_LENGTH = 1024
+
+
+def fold(text):
+    """Chuẩn hóa: NFD, bỏ dấu, đ→d, casefold, gộp khoảng trắng ("Hỗ  TRỢ" → "ho tro")"""
+    text = unicodedata.normalize("NFD", text).translate(_FOLD_TABLE).casefold()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def lower(text):
+    """Như fold() nhưng giữ dấu: NFC, casefold, gộp khoảng trắng ("Hỗ  TRỢ" → "hỗ trợ")"""
+    text = unicodedata.normalize("NFC", text).casefold()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _fold_cached(text):
+    return fold(text)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _lower_cached(text):
+    return lower(text)
+
+
+def normalize(text):
+    """Như fold() nhưng có cache LRU giới hạn.
+
+    Khóa cache là chính chuỗi tin nhắn (băm nội dung, Python lưu sẵn giá trị băm
+    trong đối tượng str), nên cùng một tin nhắn được nhiều bộ so khớp chuẩn hóa
+    chỉ tốn công xử lý Unicode một lần. Tin nhắn quá dài không được cache.
+    """
+    if len(text) > MAX_CACHED_LENGTH:
+        return fold(text)
+    return _fold_cached(text)
+
+
+def normalize_accented(text):
+    """Như lower() nhưng có cache LRU giới hạn như normalize()"""
+    if len(text) > MAX_CACHED_LENGTH:
+        return lower(text)
+    return _lower_cached(text)
+
+
+def cache_stats():
+    info = _fold_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module phân loại dự phòng: chọn template gần nhất theo TF-IDF khi không từ khóa nào khớp
+
+Cần NumPy (tùy chọn). Ma trận TF-IDF được dựng một lần từ các câu ví dụ của mỗi
+template, lưu ra tệp .npy và được memory-map khi khởi động lại; chỉ dựng lại khi
+các câu ví dụ thay đổi.
+"""
+
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from text_normalizer import normalize
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+
+
+def extract_terms(text, normalizer=normalize):
+    """Tách văn bản (đã chuẩn hóa) thành từ đơn và cặp từ liền nhau"""
+    words = _TOKEN.findall(normalizer(text))
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class TfidfFallback:
+    """Tìm template có vector TF-IDF gần nhất (cosine) với tin nhắn, kèm ngưỡng tin cậy"""
+
+    def __init__(self, examples, threshold=0.35, matrix_file="tfidf_fallback.npy"):
+        if np is None:
+            raise RuntimeError("Cần cài đặt numpy để dùng bộ phân loại dự phòng TF-IDF")
+        self.examples = {template_id: list(phrases) for template_id, phrases in examples.items() if phrases}
+        self.threshold = threshold
+        self.matrix_file = matrix_file
+        self.meta_file = os.path.splitext(matrix_file)[0] + ".json"
+        self.signature = hashlib.sha1(
+            json.dumps(self.examples, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        if not self._load():
+            self._build()
+            self._save()
+            self._load()
+
+    @classmethod
+    def from_config(cls, settings, previous=None):
+        """Dựng từ mục `matching.fallback`; trả về None nếu bị tắt hoặc thiếu numpy"""
+        if not settings.get("enabled", False):
+            return None
+        if np is None:
+            logger.warning("Chưa cài numpy, bỏ qua bộ phân loại dự phòng TF-IDF")
+            return None
+        threshold = settings.get("threshold", 0.35)
+        matrix_file = settings.get("matrix_file", "tfidf_fallback.npy")
+        examples = settings.get("examples", {})
+        if (previous is not None and previous.examples == examples
+                and previous.matrix_file == matrix_file and previous.threshold == threshold):
+            return previous
+        try:
+            return cls(examples, threshold, matrix_file)
+        except Exception as e:
+            logger.error(f"Lỗi khi dựng bộ phân loại dự phòng TF-IDF: {e}")
+            return None
+
+    def _build(self):
+        documents = []
+        owners = []
+        self.template_ids = list(self.examples)
+        for row, template_id in enumerate(self.template_ids):
+            for phrase in self.examples[template_id]:
+                documents.append(extract_terms(phrase))
+                owners.append(row)
+        document_frequency = {}
+        for terms in documents:
+            for term in set(terms):
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self.vocabulary = {term: column for column, term in enumerate(sorted(document_frequency))}
+        total = len(documents)
+        self.idf = np.array(
+            [math.log((1 + total) / (1 + document_frequency[term])) + 1 for term in sorted(document_frequency)],
+            dtype=np.float32
+        )
+        # Ma trận lưu theo hàng = từ (term-major) để lấy các hàng của từ trong tin nhắn cho nhanh
+        matrix = np.zeros((len(self.vocabulary), len(self.template_ids)), dtype=np.float32)
+        for terms, row in zip(documents, owners):
+            vector = self._vectorize(terms)
+            if vector is not None:
+                columns, weights = vector
+                matrix[columns, row] += weights
+        norms = np.linalg.norm(matrix, axis=0)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.matrix_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npy")
+        with os.fdopen(fd, "wb") as file:
+            np.save(file, self.matrix)
+        os.replace(tmp_path, self.matrix_file)
+        meta = {
+            "signature": self.signature,
+            "template_ids": self.template_ids,
+            "vocabulary": self.vocabulary,
+            "idf": self.idf.tolist()
+        }
+        with open(self.meta_file, "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False)
+        logger.info(f"Đã dựng ma trận TF-IDF {self.matrix.shape} và lưu vào {self.matrix_file}")
+
+    def _load(self):
+        try:
+            with open(self.meta_file, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            if meta.get("signature") != self.signature:
+                return False
+            # Xem vùng memory-map như ndarray thường để tránh chi phí của lớp np.memmap khi lấy hàng
+            self.matrix = np.load(self.matrix_file, mmap_mode="r").view(np.ndarray)
+        except (OSError, ValueError):
+            return False
+        self.template_ids = meta["template_ids"]
+        self.vocabulary = meta["vocabulary"]
+        self.idf = np.array(meta["idf"], dtype=np.float32)
+        return True
+
+    def _vectorize(self, terms):
+        counts = {}
+        for term in terms:
+            column = self.vocabulary.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        if not counts:
+            return None
+        columns = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[columns]
+        return columns, weights / math.sqrt(float(weights @ weights))
+
+    def classify(self, text):
+        """Trả về (template_id, điểm cosine) nếu vượt ngưỡng, ngược lại None"""
+        vector = self._vectorize(extract_terms(text))
+        if vector is None:
+            return None
+        columns, weights = vector
+        scores = weights @ self.matrix[columns]
+        best = int(scores.argmax())
+        score = float(scores[best])
+        if score < self.threshold:
+            return None
+        return self.template_ids[best], score
+
+    def classify_batch(self, texts):
+        """Như classify() cho cả lô, chỉ trả về template_id hoặc None"""
+        results = []
+        for text in texts:
+            matched = self.classify(text)
+            results.append(matched[0] if matched else None)
+        return results
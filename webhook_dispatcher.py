@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module xử lý update webhook bất đồng bộ: nhận, xếp hàng và trả 200 ngay
+
+Luồng HTTP chỉ kiểm tra update, loại update trùng (Telegram gửi lại khi webhook chậm)
+và đưa vào hàng đợi; một nhóm worker dựng phản hồi và gửi. Update được chia cho worker
+theo chat_id, nên tin nhắn trong cùng một chat vẫn được trả lời đúng thứ tự.
+
+Lưu ý: update đã trả 200 nhưng còn nằm trong hàng đợi (tối đa `queue_size`) sẽ mất nếu
+tiến trình chết; phản hồi đã dựng thì nằm trong outbox và được gửi lại.
+
+Khi webhook chạy nhiều tiến trình (webhook_server.py chế độ prefork), danh sách update đã
+nhận nằm trong một tệp SQLite dùng chung (SharedDedup) để Telegram gửi lại một update vào
+tiến trình khác vẫn bị loại.
+"""
+
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from polling import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def update_chat_id(update):
+    """chat_id của update (để chia worker), None nếu update không thuộc chat nào"""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if isinstance(update.get(key), dict):
+            return update[key].get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if isinstance(callback, dict):
+        return callback.get("message", {}).get("chat", {}).get("id")
+    return None
+
+
+class SharedDedup:
+    """Các update_id đã nhận, dùng chung giữa các tiến trình qua một tệp SQLite (WAL).
+
+    Chỉ giữ khoảng `size` update mới nhất: update_id của Telegram tăng dần, nên update
+    cũ hơn thế không còn bị gửi lại.
+    """
+
+    def __init__(self, path, size=10000):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._added = 0
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS webhook_seen (update_id INTEGER PRIMARY KEY)")
+
+    def add(self, update_id):
+        """Ghi nhận update; True nếu đây là lần đầu update được thấy (ở bất kỳ tiến trình nào)"""
+        with self._lock:
+            added = self._conn.execute("INSERT OR IGNORE INTO webhook_seen (update_id) VALUES (?)",
+                                       (update_id,)).rowcount == 1
+            self._added += 1
+            if self._added % 1024 == 0:
+                self._conn.execute("DELETE FROM webhook_seen WHERE update_id <= (SELECT update_id FROM "
+                                   "webhook_seen ORDER BY update_id DESC LIMIT 1 OFFSET ?)", (self.size,))
+            return added
+
+    def discard(self, update_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_seen WHERE update_id = ?", (update_id,))
+
+
+class WebhookDispatcher:
+    """Hàng đợi update webhook với `workers` luồng xử lý.
+
+    `process(update)` trả về True khi đã gửi được phản hồi (để đo độ trễ từ lúc nhận tới
+    lúc gửi), giá trị khác nếu không có gì để gửi hoặc gửi lỗi. `idle()` (nếu có) được gọi
+    định kỳ khi rảnh, ví dụ để gửi lại các phản hồi còn nằm trong outbox. `dedup` (nếu có,
+    ví dụ SharedDedup) thay cho danh sách update đã thấy trong bộ nhớ.
+    """
+
+    def __init__(self, process, workers=4, queue_size=1000, dedup_size=10000, idle=None, idle_interval=5.0,
+                 dedup=None):
+        self.process = process
+        self.dedup = dedup
+        self.idle = idle
+        self.idle_interval = idle_interval
+        per_worker = max(1, queue_size // max(1, workers))
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(max(1, workers))]
+        self.dedup_size = dedup_size
+        self._seen = OrderedDict()
+        self._pending_chats = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.latency = LatencyStats()
+        self.counters = {"accepted": 0, "duplicates": 0, "rejected": 0, "processed": 0, "sent": 0, "failed": 0,
+                         "inline": 0}
+
+    @classmethod
+    def from_settings(cls, settings, process, idle=None, dedup=None):
+        """Dựng từ mục `platforms.telegram.webhook` của cấu hình"""
+        options = {name: settings[name] for name in ("workers", "queue_size", "dedup_size", "idle_interval")
+                   if name in settings}
+        return cls(process, idle=idle, dedup=dedup, **options)
+
+    def start(self):
+        for index, pending in enumerate(self.queues):
+            thread = threading.Thread(target=self._worker, args=(index, pending),
+                                      name=f"webhook-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Đã bật {len(self.queues)} worker xử lý webhook")
+        return self
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def is_duplicate(self, update_id):
+        """True nếu update đã được nhận trước đó; nếu chưa thì ghi nhận là đã thấy"""
+        if self.dedup is not None:
+            if self.dedup.add(update_id):
+                return False
+            self._count("duplicates")
+            return True
+        with self._lock:
+            if update_id in self._seen:
+                self.counters["duplicates"] += 1
+                return True
+            self._seen[update_id] = None
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def submit(self, update):
+        """Nhận một update từ webhook; trả về "accepted", "duplicate" hoặc "full" (hàng đợi đầy)"""
+        if self.is_duplicate(update["update_id"]):
+            return "duplicate"
+        return self.enqueue(update)
+
+    def enqueue(self, update):
+        """Xếp một update (đã qua is_duplicate) cho worker; trả về "accepted" hoặc "full" (hàng đợi đầy)"""
+        chat_id = update_chat_id(update)
+        pending = self.queues[hash(chat_id) % len(self.queues)]
+        with self._lock:
+            self._pending_chats[chat_id] = self._pending_chats.get(chat_id, 0) + 1
+        try:
+            pending.put_nowait((update, time.monotonic()))
+        except queue.Full:
+            self.forget(update["update_id"])
+            with self._lock:
+                self._done(chat_id)
+                self.counters["rejected"] += 1
+            return "full"
+        self._count("accepted")
+        return "accepted"
+
+    def forget(self, update_id):
+        """Update chưa được nhận (hàng đợi đầy, lỗi khi xử lý): bỏ khỏi danh sách đã thấy để
+        lần Telegram gửi lại được xử lý thay vì bị coi là trùng"""
+        if self.dedup is not None:
+            self.dedup.discard(update_id)
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def has_pending(self, chat_id):
+        """True nếu chat còn update chưa xử lý xong (trả lời ngay lúc này sẽ sai thứ tự)"""
+        with self._lock:
+            return chat_id in self._pending_chats
+
+    def record_inline(self):
+        """Đếm một phản hồi trả thẳng trong HTTP response của webhook (không qua worker)"""
+        self._count("inline")
+
+    def _done(self, chat_id):
+        remaining = self._pending_chats.get(chat_id, 0) - 1
+        if remaining > 0:
+            self._pending_chats[chat_id] = remaining
+        else:
+            self._pending_chats.pop(chat_id, None)
+
+    def _worker(self, index, pending):
+        while True:
+            try:
+                item = pending.get(timeout=self.idle_interval)
+            except queue.Empty:
+                if index == 0 and self.idle is not None:
+                    self._run_idle()
+                continue
+            if item is _STOP:
+                return
+            update, enqueued_at = item
+            try:
+                sent = self.process(update)
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý update {update.get('update_id')}: {e}")
+                self._count("failed")
+                continue
+            finally:
+                with self._lock:
+                    self._done(update_chat_id(update))
+            self._count("processed")
+            if sent:
+                self._count("sent")
+                self.latency.record(time.monotonic() - enqueued_at)
+
+    def _run_idle(self):
+        try:
+            self.idle()
+        except Exception as e:
+            logger.error(f"Lỗi trong tác vụ nền của webhook: {e}")
+
+    def depth(self):
+        return sum(pending.qsize() for pending in self.queues)
+
+    def stop(self, timeout=5.0):
+        """Xử lý nốt update đã nhận rồi dừng các worker"""
+        for pending in self.queues:
+            pending.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "queue_depth": self.depth(),
+            "workers": len(self.queues),
+            "enqueue_to_send": self.latency.summary()
+        }
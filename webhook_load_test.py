@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Đo tải máy chủ webhook: số request/giây mà mỗi chế độ của webhook_server.py chịu được
+
+Với mỗi chế độ (flask, threaded, prefork), script dựng thư mục làm việc tạm như
+e2e_benchmark.py, chạy webhook_server.py với sendMessage trỏ vào máy chủ Telegram giả lập,
+rồi `--connections` kết nối keep-alive cùng POST update giả lên /webhook trong `--duration`
+giây. Kết quả gồm request/giây, độ trễ p50/p95/p99 của HTTP response, số response theo mã
+trạng thái, số phản hồi trả thẳng trong response (inline) và số lời gọi sendMessage.
+
+Mặc định tắt bộ giới hạn 30 tin/giây của bot để đo chính máy chủ HTTP (bật bằng
+--rate-limit). Client là các luồng Python nên cũng tốn CPU: trên máy ít nhân, số đo của
+prefork có thể bị giới hạn bởi client chứ không phải máy chủ.
+    python webhook_load_test.py --modes flask threaded prefork --connections 64 --duration 10
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import Counter
+
+import json_codec
+from polling import LatencyStats
+from fake_telegram_server import FakeTelegramServer, SAMPLE_TEXTS
+from e2e_benchmark import REPO_DIR, prepare_workspace, stop_process, free_port, port_open, wait_for
+
+logger = logging.getLogger(__name__)
+
+MODES = ("flask", "threaded", "prefork")
+
+
+def make_update(update_id, chats):
+    """Một update tin nhắn riêng tư; chat đổi lần lượt để không dồn vào giới hạn từng chat"""
+    chat_id = 100000 + update_id % chats
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Khách {chat_id}"},
+            "text": SAMPLE_TEXTS[update_id % len(SAMPLE_TEXTS)]
+        }
+    }
+
+
+class LoadClient:
+    """`connections` luồng, mỗi luồng một kết nối keep-alive POST update liên tục tới /webhook"""
+
+    def __init__(self, port, connections, duration, chats):
+        self.port = port
+        self.connections = connections
+        self.duration = duration
+        self.chats = chats
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.statuses = Counter()
+        self.inline = 0
+        self.errors = 0
+        self.latency = LatencyStats(window=200000)
+
+    def _run(self, deadline):
+        connection = None
+        statuses, inline, errors, samples = Counter(), 0, 0, []
+        while time.monotonic() < deadline:
+            if connection is None:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+            body = json_codec.dumps(make_update(next(self._ids), self.chats)).encode("utf-8")
+            started = time.monotonic()
+            try:
+                connection.request("POST", "/webhook", body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                connection = None
+                continue
+            samples.append(time.monotonic() - started)
+            statuses[response.status] += 1
+            if response.status == 200 and b'"method"' in data:
+                inline += 1
+            if response.will_close:
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+        with self._lock:
+            self.statuses.update(statuses)
+            self.inline += inline
+            self.errors += errors
+            for sample in samples:
+                self.latency.record(sample)
+
+    def run(self):
+        """Chạy tải; trả về số giây thực tế"""
+        deadline = time.monotonic() + self.duration
+        threads = [threading.Thread(target=self._run, args=(deadline,), daemon=True)
+                   for _ in range(self.connections)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+
+def run_mode(mode, args):
+    """Chạy webhook_server.py ở một chế độ và đo tải; trả về dict kết quả"""
+    result = {"mode": mode}
+    fake = FakeTelegramServer(latency=args.latency, seed=1).start()
+    directory = tempfile.mkdtemp(prefix=f"webhook-load-{mode}-")
+    port = free_port()
+    try:
+        prepare_workspace(directory, "webhook-inline" if args.inline else "webhook", args.rate_limit, port,
+                          server={"mode": mode, "processes": args.processes, "threads": args.threads})
+        env = dict(os.environ, TELEGRAM_API_BASE_URL=fake.base_url, PYTHONPATH=REPO_DIR, PYTHONUNBUFFERED="1")
+        with open(os.path.join(directory, "stderr.log"), "wb") as stderr:
+            process = subprocess.Popen([sys.executable, "-c", "from webhook_server import main; main()"],
+                                       cwd=directory, env=env, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=stderr)
+        if not wait_for(lambda: port_open(port) or process.poll() is not None, args.startup_timeout) \
+                or process.poll() is not None:
+            stop_process(process)
+            result["error"] = "máy chủ không sẵn sàng (xem log)"
+            return result
+        # prefork: đợi mọi worker import xong trước khi đo
+        time.sleep(args.warmup)
+
+        client = LoadClient(port, args.connections, args.duration, args.chats)
+        elapsed = client.run()
+        exit_code, _ = stop_process(process)
+        stats = fake.api.stats()
+        requests_done = sum(client.statuses.values())
+        result.update({
+            "requests": requests_done,
+            "requests_per_second": round(requests_done / elapsed, 1) if elapsed else 0.0,
+            "latency": client.latency.summary(),
+            "statuses": {str(status): count for status, count in sorted(client.statuses.items())},
+            "connection_errors": client.errors,
+            "inline_replies": client.inline,
+            "send_message_calls": stats.get("send_message_calls", 0),
+            "exit_code": exit_code
+        })
+        return result
+    finally:
+        fake.stop()
+        if args.keep_logs:
+            result["workspace"] = directory
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"  {result['mode']:<9} LỖI: {result['error']}")
+        return
+    latency = result["latency"]
+    statuses = ", ".join(f"{status}: {count}" for status, count in result["statuses"].items())
+    print(f"  {result['mode']:<9} {result['requests_per_second']:>8.1f} request/giây  "
+          f"p50 {latency.get('p50_ms', 0):>6.1f} ms  p95 {latency.get('p95_ms', 0):>6.1f} ms  "
+          f"p99 {latency.get('p99_ms', 0):>6.1f} ms  [{statuses}]  lỗi kết nối {result['connection_errors']}  "
+          f"inline {result['inline_replies']}  sendMessage {result['send_message_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo số request/giây của máy chủ webhook")
+    parser.add_argument("--modes", nargs="*", default=list(MODES), choices=MODES, help="Các chế độ máy chủ cần đo")
+    parser.add_argument("--connections", type=int, default=32, help="Số kết nối đồng thời")
+    parser.add_argument("--duration", type=float, default=10.0, help="Số giây gửi tải mỗi chế độ")
+    parser.add_argument("--chats", type=int, default=10000, help="Số chat khác nhau trong các update giả")
+    parser.add_argument("--processes", type=int, default=0, help="Số worker của chế độ prefork (0 = số CPU)")
+    parser.add_argument("--threads", type=int, default=16, help="Số luồng của waitress (nếu đã cài)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Độ trễ của sendMessage trên máy chủ giả (giây)")
+    parser.add_argument("--no-inline", dest="inline", action="store_false",
+                        help="Tắt trả phản hồi trong HTTP response (mọi phản hồi qua worker và sendMessage)")
+    parser.add_argument("--rate-limit", action="store_true", help="Bật bộ giới hạn 30 tin/giây của bot")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Số giây chờ sau khi cổng đã mở")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--keep-logs", action="store_true", help="Giữ thư mục làm việc (log) của máy chủ")
+    parser.add_argument("--output", help="Tệp JSON kết quả")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"Tải webhook: {args.connections} kết nối, {args.duration:g} giây mỗi chế độ, "
+          f"{os.cpu_count()} CPU")
+    results = []
+    for mode in args.modes:
+        result = run_mode(mode, args)
+        results.append(result)
+        print_result(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"settings": vars(args), "results": results}, file, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
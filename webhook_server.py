@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Chạy webhook (telegram_webhook.app) bằng máy chủ chịu được nhiều kết nối đồng thời
+
+Chế độ lấy từ mục `platforms.telegram.webhook.server` của config.json:
+- "threaded" (mặc định): một tiến trình, mỗi kết nối một luồng. Dùng waitress (tối đa
+  `threads` luồng) nếu đã cài, không thì máy chủ WSGI đa luồng của werkzeug.
+- "prefork": `processes` tiến trình worker (0 = số CPU) cùng lắng nghe một cổng nhờ
+  SO_REUSEPORT, kernel chia kết nối cho các worker. Mỗi worker import telegram_webhook
+  sau khi fork nên có HTTP client (keep-alive), luồng xử lý và outbox riêng; danh sách
+  update đã nhận và giới hạn tốc độ dùng chung qua tệp SQLite `shared_state`.
+  Worker chết được khởi động lại. Cần os.fork và SO_REUSEPORT (Linux); nơi khác chạy "threaded".
+- "flask": máy chủ phát triển của Flask như trước, chỉ để so sánh.
+
+Lưu ý với "prefork": các update của cùng một chat có thể vào những worker khác nhau, nên
+thứ tự phản hồi trong một chat chỉ được giữ trong từng worker. /health và /metrics chỉ
+cho số liệu của worker nhận request đó.
+
+Chạy:
+    python webhook_server.py
+Đo số request/giây của từng chế độ: python webhook_load_test.py
+"""
+
+import os
+import sys
+import time
+import atexit
+import signal
+import socket
+import logging
+
+from werkzeug.serving import make_server
+
+from config import Config
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+logger = logging.getLogger(__name__)
+
+# Mã thoát của worker không mở được cổng: tiến trình cha dừng thay vì khởi động lại mãi
+_BIND_FAILED = 3
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def listen_socket(host, port, backlog=1024, reuse_port=False):
+    """Socket TCP đang lắng nghe; `reuse_port` cho nhiều tiến trình cùng bind một cổng"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def serve_socket(app, sock, threads=16, backlog=1024):
+    """Phục vụ app WSGI trên socket đã lắng nghe cho tới khi bị ngắt (Ctrl+C, SIGTERM)"""
+    if waitress is not None:
+        waitress.serve(app, sockets=[sock], threads=threads, backlog=backlog)
+        return
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def _quiet_access_log():
+    # Mỗi request một dòng log INFO của werkzeug tốn đáng kể khi tải cao
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+
+def serve_app(app, settings):
+    """Chạy app trong tiến trình hiện tại ("threaded", hoặc "flask" nếu cấu hình như vậy)"""
+    server = settings.get("server", {})
+    host, port = settings.get("host", "0.0.0.0"), settings.get("port", 5000)
+    if server.get("mode") == "flask":
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+    if server.get("mode") == "prefork":
+        logger.warning("Chế độ prefork chỉ chạy được qua webhook_server.py, dùng chế độ threaded")
+    _quiet_access_log()
+    backlog = server.get("backlog", 1024)
+    sock = listen_socket(host, port, backlog)
+    logger.info(f"Webhook lắng nghe {host}:{port} ({'waitress' if waitress else 'werkzeug'}, đa luồng)")
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        serve_socket(app, sock, server.get("threads", 16), backlog)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+def _run_worker(index, settings, delete_webhook):
+    """Thân của một tiến trình worker (sau fork); trả về mã thoát"""
+    server = settings.get("server", {})
+    host, port = settings.get("host", "0.0.0.0"), settings.get("port", 5000)
+    backlog = server.get("backlog", 1024)
+    try:
+        sock = listen_socket(host, port, backlog, reuse_port=True)
+    except OSError as e:
+        logger.error(f"Worker {index} không mở được cổng {host}:{port}: {e}")
+        return _BIND_FAILED
+    os.environ["WEBHOOK_WORKER_ID"] = str(index)
+    # Import sau khi fork: client HTTP, luồng xử lý và kết nối SQLite thuộc riêng worker này
+    import telegram_webhook
+    if delete_webhook:
+        telegram_webhook.delete_webhook()
+    _quiet_access_log()
+    try:
+        serve_socket(telegram_webhook.app, sock, server.get("threads", 16), backlog)
+    finally:
+        sock.close()
+    return 0
+
+
+def serve_prefork(settings):
+    """Chạy `processes` worker cùng cổng (SO_REUSEPORT) và khởi động lại worker bị chết"""
+    server = settings.get("server", {})
+    processes = server.get("processes") or os.cpu_count() or 1
+    os.environ["TELEGRAM_SHARED_STATE"] = os.path.abspath(server.get("shared_state", "webhook_state.db"))
+    signal.signal(signal.SIGTERM, _interrupt)
+    children = {}
+
+    def spawn(index, first):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _run_worker(index, settings, delete_webhook=first and index == 0)
+            except KeyboardInterrupt:
+                code = 0
+            except BaseException as e:
+                logger.error(f"Worker {index} dừng vì lỗi: {e}")
+            finally:
+                # os._exit bỏ qua atexit nên tự chạy: dispatcher.stop(), config.flush()...
+                atexit._run_exitfuncs()
+                os._exit(code)
+        children[pid] = index
+
+    for index in range(processes):
+        spawn(index, first=True)
+    logger.info(f"Webhook lắng nghe {settings.get('host', '0.0.0.0')}:{settings.get('port', 5000)} "
+                f"với {processes} tiến trình worker")
+    try:
+        while children:
+            pid, status = os.wait()
+            index = children.pop(pid, None)
+            if index is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code == _BIND_FAILED:
+                break
+            logger.warning(f"Worker {index} (pid {pid}) đã thoát với mã {code}, khởi động lại")
+            time.sleep(1.0)
+            spawn(index, first=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(children):
+            os.waitpid(pid, 0)
+        logger.info("Đã dừng các worker webhook")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    # Tiến trình cha không ghi cấu hình và không tạo luồng nào trước khi fork
+    settings = Config(write_behind=False).get("platforms.telegram.webhook", {})
+    server = settings.get("server", {})
+    if server.get("mode") == "prefork":
+        if hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"):
+            serve_prefork(settings)
+            return 0
+        logger.warning("Hệ điều hành không hỗ trợ os.fork/SO_REUSEPORT, dùng chế độ threaded")
+        settings = {**settings, "server": {**server, "mode": "threaded"}}
+    import telegram_webhook
+    logger.info("Bắt đầu Telegram Bot với Webhook")
+    telegram_webhook.delete_webhook()
+    serve_app(telegram_webhook.app, settings)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())